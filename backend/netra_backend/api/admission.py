@@ -0,0 +1,331 @@
+"""
+Admission control for the inference endpoints.
+
+Each worker runs at most ``INFERENCE_CONCURRENCY`` predictions at a time.
+Requests wait for a slot in one of two priority lanes:
+
+- ``clinical``: authenticated nurses and doctors (``upload_scan``, ``predict``)
+- ``public``: everyone else, e.g. anonymous demo predictions
+
+A free slot always goes to a waiting clinical request first, and
+``INFERENCE_LANES`` caps how many slots the public lane may hold, so a burst of
+anonymous uploads cannot starve clinical traffic. Queues are bounded. When a
+lane's queue is full, or a request waits longer than the lane timeout, it is
+rejected at once with 503 and a Retry-After estimate.
+
+Before queueing, every caller also draws from a token bucket keyed by user
+(or client IP when anonymous), with the ``RATE_LIMITS`` of its lane; an empty
+bucket gives 429. Buckets live in their own SQLite file (``RATE_LIMIT_DB``),
+spent with a single upsert, so the limit holds across all workers on a host
+without taking the main database's write lock. Each worker also keeps its own
+copy of every bucket, which can only hold more tokens than the shared one, so
+a caller it already knows to be empty is refused without touching the file.
+Behind a proxy listed in ``TRUSTED_PROXIES`` the client IP is taken from
+``X-Forwarded-For``.
+"""
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import ADMISSION_REJECTIONS_TOTAL, INFERENCE_QUEUE_WAIT_SECONDS
+
+CLINICAL_ROLES = ('nurse', 'doctor')
+
+
+class Rejected(Exception):
+    """Base for admission failures; ``retry_after`` is in seconds."""
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    message = 'Inference capacity exhausted. Please retry shortly.'
+
+    def __init__(self, retry_after):
+        super().__init__(self.message)
+        self.retry_after = retry_after
+
+
+class Overloaded(Rejected):
+    pass
+
+
+class RateLimited(Rejected):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    message = 'Rate limit exceeded. Please retry shortly.'
+
+
+class _Lane:
+    def __init__(self, name, max_queued, timeout, max_active=None):
+        self.name = name
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.max_active = max_active
+        self.active = 0
+        self.waiting = 0
+
+
+class InferenceGate:
+    """Concurrency limiter with strict-priority lanes (first lane wins)."""
+
+    def __init__(self, slots, lanes):
+        self.slots = slots
+        self.lanes = {name: _Lane(name, **config) for name, config in lanes.items()}
+        self.active = 0
+        self._service_time = 1.0  # moving average of slot hold time, for Retry-After
+        self._cond = threading.Condition()
+
+    def _can_run(self, lane):
+        if self.active >= self.slots:
+            return False
+        if lane.max_active is not None and lane.active >= lane.max_active:
+            return False
+        for other in self.lanes.values():
+            if other is lane:
+                return True
+            if other.waiting and (other.max_active is None or other.active < other.max_active):
+                return False
+        return True
+
+    def _retry_after(self):
+        queued = sum(lane.waiting for lane in self.lanes.values())
+        return max(1, math.ceil((queued + 1) * self._service_time / self.slots))
+
+    def acquire(self, lane_name):
+        """Take a slot, waiting in ``lane_name``'s queue; returns the seconds waited."""
+        lane = self.lanes[lane_name]
+        started = time.monotonic()
+        with self._cond:
+            if not self._can_run(lane):
+                if lane.waiting >= lane.max_queued:
+                    ADMISSION_REJECTIONS_TOTAL.inc(lane=lane.name, reason='queue_full')
+                    raise Overloaded(self._retry_after())
+                deadline = started + lane.timeout
+                lane.waiting += 1
+                try:
+                    while not self._can_run(lane):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            ADMISSION_REJECTIONS_TOTAL.inc(lane=lane.name, reason='timeout')
+                            raise Overloaded(self._retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    lane.waiting -= 1
+                    # A higher-priority waiter leaving may unblock lower lanes.
+                    self._cond.notify_all()
+            self.active += 1
+            lane.active += 1
+        waited = time.monotonic() - started
+        INFERENCE_QUEUE_WAIT_SECONDS.observe(waited, lane=lane.name)
+        return waited
+
+    def release(self, lane_name, held):
+        with self._cond:
+            self.active -= 1
+            self.lanes[lane_name].active -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * held
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, lane_name):
+        self.acquire(lane_name)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(lane_name, time.monotonic() - started)
+
+    def snapshot(self):
+        with self._cond:
+            return {name: {'active': lane.active, 'waiting': lane.waiting} for name, lane in self.lanes.items()}
+
+
+# Refill the stored bucket, then spend one token only if a whole one is left.
+# The conflict clause runs atomically per row.
+SPEND_TOKEN = """
+INSERT INTO buckets (key, tokens, updated) VALUES (:key, :burst - 1, :now)
+ON CONFLICT (key) DO UPDATE SET tokens = {refilled} - 1, updated = excluded.updated
+WHERE {refilled} >= 1
+RETURNING tokens
+""".format(refilled='min(:burst, buckets.tokens + (excluded.updated - buckets.updated) * :rate)')
+PRUNE_PROBABILITY = 0.001
+LOCAL_BUCKETS_MAX = 10_000
+
+
+class BucketStore:
+    """Token bucket rows in a small SQLite file of their own, shared by every worker on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # Losing a few refills in a crash is harmless; don't wait for fsync.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def spend(self, key, rate, burst, now):
+        """Take a token from ``key``'s bucket; returns ``(spent, tokens left)``."""
+        connection = self._connection()
+        params = {'key': key, 'rate': rate, 'burst': burst, 'now': now}
+        row = connection.execute(SPEND_TOKEN, params).fetchone()
+        if row is not None:
+            return True, row[0]
+        tokens, updated = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+        return False, min(burst, tokens + (now - updated) * rate)
+
+    def prune(self, prefix, before):
+        """Drop buckets under ``prefix`` untouched since ``before``; they are full again anyway."""
+        self._connection().execute(
+            'DELETE FROM buckets WHERE substr(key, 1, length(?)) = ? AND updated < ?', (prefix, prefix, before),
+        )
+
+
+class TokenBucket:
+    """``rate`` tokens per second up to ``burst``, kept per key in a ``BucketStore``."""
+
+    def __init__(self, rate, burst, name, store=None):
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self.store = store or get_store()
+        self._seen = {}  # key -> (tokens, time) as of this worker's last look
+        self._lock = threading.Lock()
+
+    def _retry_after(self, tokens):
+        return max(1, math.ceil((1 - tokens) / self.rate))
+
+    def _refilled(self, key, now):
+        tokens, updated = self._seen.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def consume(self, key):
+        """Take one token for ``key``; returns 0 if allowed, else seconds until the next token."""
+        key = f'{self.name}:{key}'
+        now = time.time()
+        with self._lock:
+            # Other workers only ever drain the shared bucket further, so an
+            # empty local copy means the shared one is empty too.
+            tokens = self._refilled(key, now)
+            if tokens < 1:
+                return self._retry_after(tokens)
+        spent, tokens = self.store.spend(key, self.rate, self.burst, now)
+        with self._lock:
+            self._seen[key] = (tokens, now)
+            if len(self._seen) > LOCAL_BUCKETS_MAX:
+                self._seen = {k: v for k, v in self._seen.items() if self._refilled(k, now) < self.burst}
+        if random.random() < PRUNE_PROBABILITY:
+            self.store.prune(f'{self.name}:', now - self.burst / self.rate)
+        return 0 if spent else self._retry_after(tokens)
+
+
+def lane_for(request):
+    user = request.user
+    return 'clinical' if user.is_authenticated and user.role in CLINICAL_ROLES else 'public'
+
+
+def client_ip(request):
+    """Client address: the nearest ``X-Forwarded-For`` hop not in ``TRUSTED_PROXIES`` behind a trusted proxy."""
+    remote = request.META.get('REMOTE_ADDR')
+    trusted = settings.TRUSTED_PROXIES
+    if remote not in trusted:
+        return remote
+    hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if hop not in trusted:
+            return hop
+    return hops[0] if hops else remote
+
+
+def rate_limit_key(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+_gate = None
+_store = None
+_buckets = {}
+_state_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _state_lock:
+        if _store is None:
+            _store = BucketStore(settings.RATE_LIMIT_DB)
+        return _store
+
+
+def get_gate():
+    global _gate
+    with _state_lock:
+        if _gate is None:
+            _gate = InferenceGate(settings.INFERENCE_CONCURRENCY, settings.INFERENCE_LANES)
+        return _gate
+
+
+def get_bucket(lane):
+    limits = settings.RATE_LIMITS.get(lane)
+    if not limits:
+        return None
+    store = get_store()
+    with _state_lock:
+        if lane not in _buckets:
+            _buckets[lane] = TokenBucket(limits['rate'], limits['burst'], name=f'ratelimit:{lane}', store=store)
+        return _buckets[lane]
+
+
+def admit(request):
+    """Rate-limit and queue ``request``; returns a context manager holding its slot."""
+    lane = lane_for(request)
+    bucket = get_bucket(lane)
+    if bucket is not None:
+        retry_after = bucket.consume(rate_limit_key(request))
+        if retry_after:
+            ADMISSION_REJECTIONS_TOTAL.inc(lane=lane, reason='rate_limited')
+            raise RateLimited(retry_after)
+    return get_gate().slot(lane)
+
+
+def admission_controlled(view):
+    """Run a DRF function view under ``admit``; rejections become 429/503 with Retry-After."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            slot = admit(request)
+            with slot:
+                return view(request, *args, **kwargs)
+        except Rejected as exc:
+            return Response(
+                {'error': exc.message},
+                status=exc.status_code,
+                headers={'Retry-After': str(exc.retry_after)}
+            )
+    return wrapper
+
+
+def _reset_admission(setting, **kwargs):
+    global _gate, _store
+    if setting in ('INFERENCE_CONCURRENCY', 'INFERENCE_LANES', 'RATE_LIMITS', 'RATE_LIMIT_DB'):
+        with _state_lock:
+            _gate = _store = None
+            _buckets.clear()
+
+
+setting_changed.connect(_reset_admission)
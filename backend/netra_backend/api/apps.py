@@ -4,3 +4,29 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.core.signals import request_finished
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+
+        from .authentication import invalidate_cached_user
+        from .models import PatientDoctorSubscription
+        from .search import reindex_patient_on_save
+        from .sqlite_tuning import configure_sqlite_connection, optimize_sqlite_connections
+        from .subscriptions import invalidate_patient_set
+
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='api.sqlite_tuning')
+        request_finished.connect(optimize_sqlite_connections, dispatch_uid='api.sqlite_optimize')
+
+        User = get_user_model()
+        post_save.connect(invalidate_cached_user, sender=User, dispatch_uid='api.user_cache_save')
+        post_delete.connect(invalidate_cached_user, sender=User, dispatch_uid='api.user_cache_delete')
+        post_save.connect(reindex_patient_on_save, sender=User, dispatch_uid='api.search_patient_save')
+        post_save.connect(
+            invalidate_patient_set, sender=PatientDoctorSubscription, dispatch_uid='api.subscription_cache_save',
+        )
+        post_delete.connect(
+            invalidate_patient_set, sender=PatientDoctorSubscription, dispatch_uid='api.subscription_cache_delete',
+        )
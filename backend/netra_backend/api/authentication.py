@@ -0,0 +1,71 @@
+"""
+JWT authentication with a cached user lookup.
+
+Tokens issued by ``tokens_for_user`` carry the user's ``role`` next to the
+standard ``user_id`` claim. ``CachedJWTAuthentication`` resolves the user from
+a small per-process TTL/LRU cache instead of loading the row on every request;
+the cache is invalidated whenever a user is saved or deleted.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .caching import TTLCache
+from .metrics import record_cache
+
+ROLE_CLAIM = 'role'
+
+user_cache = TTLCache(
+    maxsize=getattr(settings, 'JWT_USER_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'JWT_USER_CACHE_TTL', 60),
+)
+
+
+def tokens_for_user(user):
+    """Refresh/access token pair with the role claim embedded."""
+    refresh = RefreshToken.for_user(user)
+    refresh[ROLE_CLAIM] = user.role
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+    }
+
+
+def _snapshot(user):
+    # Store plain field values rather than the instance so concurrent requests
+    # never share (and mutate) the same model object.
+    names = tuple(field.attname for field in user._meta.concrete_fields)
+    return user._state.db, names, tuple(getattr(user, name) for name in names)
+
+
+def _restore(snapshot):
+    db, names, values = snapshot
+    return get_user_model().from_db(db, names, values)
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    """``post_save``/``post_delete`` receiver for the user model."""
+    user_cache.delete(str(instance.pk))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None or api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+
+        key = str(user_id)
+        snapshot = user_cache.get(key)
+        if snapshot is not None:
+            user = _restore(snapshot)
+            claimed_role = validated_token.get(ROLE_CLAIM)
+            if user.is_active and claimed_role in (None, user.role):
+                record_cache('jwt_user', hit=True)
+                return user
+
+        record_cache('jwt_user', hit=False)
+        user = super().get_user(validated_token)
+        user_cache.set(key, _snapshot(user))
+        return user
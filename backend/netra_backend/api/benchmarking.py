@@ -0,0 +1,93 @@
+"""
+Small helpers shared by the benchmark management commands.
+
+Latencies are collected in seconds and reported in milliseconds.
+"""
+import json
+import math
+import platform
+import random
+import subprocess
+from datetime import datetime, timezone
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize_latencies(samples, elapsed=None):
+    """Return count, mean and p50/p95/p99/max (ms) for a list of durations (s)."""
+    values = sorted(samples)
+    summary = {'count': len(values)}
+    if values:
+        summary.update({
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 50) * 1000, 3),
+            'p95_ms': round(percentile(values, 95) * 1000, 3),
+            'p99_ms': round(percentile(values, 99) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3),
+        })
+    if elapsed:
+        summary['per_second'] = round(len(values) / elapsed, 2)
+    return summary
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report_metadata():
+    """Context recorded with every report so runs can be compared across commits."""
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+    }
+
+
+def write_report(path, report):
+    with open(path, 'w') as fh:
+        json.dump(report, fh, indent=2, default=str)
+
+
+def synthetic_fundus(seed, size):
+    """A cheap fundus-like PNG so image handling costs resemble real uploads."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, (0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    w, h = size
+    draw.ellipse((w * 0.05, h * 0.05, w * 0.95, h * 0.95), fill=(170 + rng.randint(0, 40), 70, 30))
+    for _ in range(40):
+        x, y = rng.randint(0, w), rng.randint(0, h)
+        draw.line((w / 2, h / 2, x, y), fill=(120, 20, 10), width=rng.randint(2, 6))
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def parse_importtime(text):
+    """
+    Parse ``python -X importtime`` output into ``(module, self_us, cumulative_us)``
+    tuples, in the order the imports finished.
+    """
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
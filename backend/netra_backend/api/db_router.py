@@ -0,0 +1,66 @@
+"""
+Primary/replica database routing.
+
+Writes always go to the ``default`` alias. Reads stay on ``default`` too,
+unless the current request is running inside a view decorated with
+``@replica_reads`` and a ``replica`` alias is configured. This keeps
+read-after-write flows (e.g. ``upload_scan`` serializing the scan it just
+created) on the primary, while the read-only list/stats endpoints can be
+scaled out separately.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+PRIMARY_DB_ALIAS = 'default'
+REPLICA_DB_ALIAS = 'replica'
+
+_use_replica = ContextVar('netra_use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def reading_from_replica():
+    """Route reads issued inside the block to the replica (if configured)."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_reads(view_func):
+    """Decorator for read-only views whose queries may be served by the replica."""
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        with reading_from_replica():
+            return view_func(*args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """Sends writes to the primary and opted-in reads to the replica."""
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Follow relations on the alias the instance was loaded from.
+            return instance._state.db
+        if _use_replica.get() and replica_configured():
+            return REPLICA_DB_ALIAS
+        return PRIMARY_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases point at the same logical database.
+        aliases = {PRIMARY_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
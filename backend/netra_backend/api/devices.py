@@ -0,0 +1,357 @@
+"""
+Inference devices, model replicas and automatic batch sizing.
+
+``probe_devices()`` lists where models run, from ``INFERENCE_DEVICES``:
+
+- ``auto``: every CUDA device, else Apple ``mps``, else the CPU
+- ``numa``: one CPU device per NUMA node, pinned to that node's cores
+- a comma-separated list of torch device strings, e.g. ``cuda:0,cuda:1``
+
+``ReplicaPool`` loads ``INFERENCE_REPLICAS_PER_DEVICE`` model replicas per
+device. Each call goes to the replica with the fewest images queued, and
+large batches are split across replicas. Each replica runs on its own
+threads, pinned to its NUMA node's cores when it has them. Together the
+replicas keep ``INFERENCE_CONCURRENCY`` threads.
+
+Batch size is picked per call from the memory free right now. That is
+``mem_get_info`` on CUDA, and ``MemAvailable`` capped by the cgroup limit
+on CPU. Take off ``INFERENCE_MEMORY_HEADROOM`` and split what is left
+between the threads that share that memory. Divide by the estimated peak
+bytes per image, which is ``INFERENCE_ACTIVATION_FACTOR`` times its
+float32 input. The result is capped at ``INFERENCE_MAX_BATCH_SIZE`` and
+rounded down to a power of two. If a batch still runs out of memory, the
+replica halves its cap and retries, down to single images. A busy shared
+device then costs throughput instead of failing requests.
+
+Only accelerator devices import torch. Memory and topology are read from
+overridable paths, so all of this runs and is tested on CPU-only machines.
+"""
+import itertools
+import logging
+import math
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .metrics import INFERENCE_OOM_TOTAL
+
+logger = logging.getLogger(__name__)
+
+PROC_MEMINFO = '/proc/meminfo'
+CGROUP_ROOT = '/sys/fs/cgroup'
+NUMA_ROOT = '/sys/devices/system/node'
+
+
+def parse_cpulist(text):
+    """``'0-3,8'`` -> ``(0, 1, 2, 3, 8)``"""
+    cpus = []
+    for part in text.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return tuple(cpus)
+
+
+def _meminfo(path):
+    """Byte values from a ``/proc/meminfo``-style file, keyed by field name."""
+    values = {}
+    with open(path) as fh:
+        for line in fh:
+            key, _, rest = line.partition(':')
+            parts = rest.split()
+            if parts:
+                values[key.split()[-1]] = int(parts[0]) * (1024 if parts[1:] == ['kB'] else 1)
+    return values
+
+
+def _cgroup_limit():
+    """``(limit, usage)`` of the cgroup v2 memory controller, or None when unlimited."""
+    try:
+        with open(os.path.join(CGROUP_ROOT, 'memory.max')) as fh:
+            limit = fh.read().strip()
+        with open(os.path.join(CGROUP_ROOT, 'memory.current')) as fh:
+            usage = int(fh.read())
+    except (OSError, ValueError):
+        return None
+    return None if limit == 'max' else (int(limit), usage)
+
+
+def cpu_memory():
+    """``(free, total)`` host memory in bytes, within the container's limit; None if unknown."""
+    try:
+        info = _meminfo(PROC_MEMINFO)
+        total, free = info['MemTotal'], info.get('MemAvailable', info['MemFree'])
+    except (OSError, KeyError, ValueError):
+        try:
+            page = os.sysconf('SC_PAGE_SIZE')
+            total, free = os.sysconf('SC_PHYS_PAGES') * page, os.sysconf('SC_AVPHYS_PAGES') * page
+        except (ValueError, OSError, AttributeError):
+            return None
+    cgroup = _cgroup_limit()
+    if cgroup:
+        limit, usage = cgroup
+        total, free = min(total, limit), min(free, limit - usage)
+    return max(0, free), total
+
+
+def numa_nodes():
+    """``[(node, cpus)]`` from sysfs; empty where the kernel exposes no NUMA topology."""
+    try:
+        names = os.listdir(NUMA_ROOT)
+    except OSError:
+        return []
+    nodes = []
+    for name in names:
+        if not (name.startswith('node') and name[4:].isdigit()):
+            continue
+        try:
+            with open(os.path.join(NUMA_ROOT, name, 'cpulist')) as fh:
+                cpus = parse_cpulist(fh.read())
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append((int(name[4:]), cpus))
+    return sorted(nodes)
+
+
+def numa_memory(node):
+    try:
+        info = _meminfo(os.path.join(NUMA_ROOT, f'node{node}', 'meminfo'))
+        return info['MemFree'], info['MemTotal']
+    except (OSError, KeyError, ValueError):
+        return cpu_memory()
+
+
+@dataclass(frozen=True)
+class Device:
+    name: str  # torch device string
+    cpus: tuple = ()  # cores CPU replicas are pinned to; empty means no pinning
+    numa_node: int = None
+
+    @property
+    def kind(self):
+        return self.name.split(':')[0]
+
+    @property
+    def memory_domain(self):
+        """Devices with the same domain draw on the same memory."""
+        return self.name if self.kind != 'cpu' else f'cpu:{self.numa_node}'
+
+    def memory(self):
+        """``(free, total)`` bytes available to this device now, or None if unknown."""
+        if self.kind == 'cuda':
+            import torch
+
+            return torch.cuda.mem_get_info(torch.device(self.name))
+        if self.kind == 'mps':
+            import torch
+
+            total = torch.mps.recommended_max_memory()
+            return max(0, total - torch.mps.driver_allocated_memory()), total
+        if self.numa_node is not None:
+            return numa_memory(self.numa_node)
+        return cpu_memory()
+
+
+def _accelerators():
+    from .model_loader import TORCH_AVAILABLE
+
+    if not TORCH_AVAILABLE:
+        return []
+    import torch
+
+    if torch.cuda.is_available():
+        return [Device(f'cuda:{index}') for index in range(torch.cuda.device_count())]
+    mps = getattr(torch.backends, 'mps', None)
+    if mps is not None and mps.is_available():
+        return [Device('mps')]
+    return []
+
+
+def probe_devices(spec=None):
+    """Devices to place replicas on, from ``spec`` or ``INFERENCE_DEVICES``."""
+    spec = spec or getattr(settings, 'INFERENCE_DEVICES', 'auto')
+    if spec == 'auto':
+        return _accelerators() or [Device('cpu')]
+    if spec == 'numa':
+        nodes = numa_nodes()
+        if len(nodes) < 2:
+            return [Device('cpu')]
+        return [Device('cpu', cpus, node) for node, cpus in nodes]
+    return [Device(name.strip()) for name in spec.split(',') if name.strip()]
+
+
+def bytes_per_image(shape):
+    """Estimated peak memory of one HxWx3 image during a forward pass."""
+    height, width = shape[:2]
+    return height * width * 3 * 4 * getattr(settings, 'INFERENCE_ACTIVATION_FACTOR', 64)
+
+
+def safe_batch_size(free_bytes, per_image, sharers=1, cap=32):
+    """
+    Largest power of two up to ``cap`` whose batch fits in a ``sharers``-th of
+    ``free_bytes`` after headroom. Unknown memory (None) gives ``cap``.
+    """
+    if free_bytes is None:
+        fits = cap
+    else:
+        usable = free_bytes * (1 - getattr(settings, 'INFERENCE_MEMORY_HEADROOM', 0.2)) / max(1, sharers)
+        fits = int(usable // max(1, per_image))
+    size = max(1, min(cap, fits))
+    return 1 << (size.bit_length() - 1)
+
+
+def is_out_of_memory(exc):
+    if isinstance(exc, MemoryError) or type(exc).__name__ == 'OutOfMemoryError':
+        return True
+    message = str(exc)
+    return isinstance(exc, RuntimeError) and ('out of memory' in message or "can't allocate memory" in message)
+
+
+class Replica:
+    """One loaded model on one device, with its own worker threads."""
+
+    def __init__(self, device, model, threads=1, sharers=1):
+        self.device = device
+        self.model = model
+        self.sharers = sharers  # threads on all replicas that can allocate from this device's memory at once
+        self.max_batch_size = getattr(settings, 'INFERENCE_MAX_BATCH_SIZE', 32)
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            threads, thread_name_prefix=f'replica-{device.name}', initializer=self._pin,
+        )
+
+    def _pin(self):
+        if not self.device.cpus or not hasattr(os, 'sched_setaffinity'):
+            return
+        try:
+            os.sched_setaffinity(0, self.device.cpus)
+        except OSError:
+            logger.warning("Could not pin replica thread", extra={'fields': {'device': self.device.name}})
+
+    def submit(self, fn, *args, images=1, **kwargs):
+        with self._lock:
+            self.queued += images
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self._release(images))
+        return future
+
+    def _release(self, images):
+        with self._lock:
+            self.queued -= images
+
+    def batch_size(self, shape):
+        try:
+            memory = self.device.memory()
+        except Exception:
+            memory = None
+        free = memory[0] if memory else None
+        return safe_batch_size(free, bytes_per_image(shape), self.sharers, self.max_batch_size)
+
+    def predict_batch(self, predict, arrays):
+        """``predict(model, arrays, device=...)`` in memory-safe batches; results keep input order."""
+        results = []
+        start = 0
+        while start < len(arrays):
+            window = arrays[start:start + self.max_batch_size]
+            size = self.batch_size(max((array.shape for array in window), key=lambda shape: shape[0] * shape[1]))
+            batch = arrays[start:start + size]
+            try:
+                results.extend(predict(self.model, batch, device=self.device.name))
+            except Exception as exc:
+                if not is_out_of_memory(exc) or len(batch) == 1:
+                    raise
+                self._degrade(len(batch))
+                continue
+            start += len(batch)
+        return results
+
+    def _degrade(self, failed_size):
+        self.max_batch_size = 1 << ((failed_size // 2).bit_length() - 1)
+        INFERENCE_OOM_TOTAL.inc(device=self.device.name)
+        torch = sys.modules.get('torch')
+        if torch is not None and self.device.kind == 'cuda':
+            torch.cuda.empty_cache()
+        logger.warning("Inference ran out of memory; batch size reduced", extra={'fields': {
+            'device': self.device.name, 'failed_batch_size': failed_size, 'max_batch_size': self.max_batch_size,
+        }})
+
+    def describe(self):
+        return {
+            'device': self.device.name, 'numa_node': self.device.numa_node,
+            'max_batch_size': self.max_batch_size, 'queued': self.queued,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class ReplicaPool:
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self._offsets = itertools.count()
+
+    @classmethod
+    def load(cls, load_model, devices=None, per_device=None):
+        """
+        Call ``load_model(device_name)`` once per replica; devices whose load
+        returns None are skipped. Returns None if no replica loaded.
+        """
+        devices = devices or probe_devices()
+        per_device = per_device or getattr(settings, 'INFERENCE_REPLICAS_PER_DEVICE', 1)
+        placements = [device for device in devices for _ in range(per_device)]
+        threads = max(1, math.ceil(getattr(settings, 'INFERENCE_CONCURRENCY', 1) / len(placements)))
+        domains = {}
+        for device in placements:
+            domains[device.memory_domain] = domains.get(device.memory_domain, 0) + threads
+
+        replicas = []
+        for device in placements:
+            model = load_model(device.name)
+            if model is None:
+                logger.warning("Replica not loaded", extra={'fields': {'device': device.name}})
+                continue
+            replicas.append(Replica(device, model, threads, domains[device.memory_domain]))
+        if not replicas:
+            return None
+        logger.info("Model replicas loaded", extra={'fields': {
+            'devices': [replica.device.name for replica in replicas], 'threads_per_replica': threads,
+        }})
+        return cls(replicas)
+
+    def least_loaded(self):
+        # Rotate the starting point so ties don't always land on the first replica.
+        offset = next(self._offsets) % len(self.replicas)
+        rotated = self.replicas[offset:] + self.replicas[:offset]
+        return min(rotated, key=lambda replica: replica.queued)
+
+    def predict(self, predict_image, image_file):
+        """``predict_image(model, image_file, device=...)`` on the least-loaded replica."""
+        replica = self.least_loaded()
+        return replica.submit(predict_image, replica.model, image_file, device=replica.device.name).result()
+
+    def predict_batch(self, predict_batch, arrays):
+        """Split ``arrays`` across replicas, least loaded first; results keep input order."""
+        if not arrays:
+            return []
+        part = math.ceil(len(arrays) / min(len(self.replicas), len(arrays)))
+        futures = []
+        for start in range(0, len(arrays), part):
+            replica = self.least_loaded()
+            chunk = arrays[start:start + part]
+            futures.append(replica.submit(replica.predict_batch, predict_batch, chunk, images=len(chunk)))
+        return [result for future in futures for result in future.result()]
+
+    def describe(self):
+        return [replica.describe() for replica in self.replicas]
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
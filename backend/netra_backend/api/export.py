@@ -0,0 +1,267 @@
+"""
+Streaming export of scans, predictions, notes and image paths.
+
+``export_chunks`` walks the scans in primary-key order with keyset pagination
+(``id > last_id ... LIMIT chunk_size``). Each chunk makes three queries:
+scans with their patients, images and notes. Memory stays bounded by the
+chunk size however large the table is, and no read transaction or cursor is
+held open between chunks.
+
+Rows are encoded by a ``Format``:
+
+- ``csv``: one line per scan; list/object columns are JSON-encoded
+- ``jsonl``: one JSON object per line
+- ``parquet``: one row group per chunk; requires pyarrow
+
+``stream_export`` yields the encoded file. ``stream_tar`` yields an
+uncompressed tar instead: each chunk becomes a ``scans/part-NNNNN.<ext>``
+member followed by that chunk's image files under ``images/``. Tar headers
+are written by hand so image files are copied through in small blocks
+rather than buffered whole.
+"""
+import csv
+import io
+import json
+import os
+import tarfile
+import time
+
+from .models import DoctorNote, RetinalScan, ScanImage
+from .tiering import stored_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+SCAN_FIELDS = [
+    'id', 'patient_id', 'patient__username', 'patient__full_name', 'nurse_id', 'doctor_id',
+    'priority', 'status', 'patient_age', 'patient_diabetes_duration',
+    'left_eye_prediction', 'left_eye_prediction_class', 'right_eye_prediction', 'right_eye_prediction_class',
+    'model_version', 'ai_details', 'created_at', 'updated_at',
+]
+COLUMNS = [field.replace('__', '_') for field in SCAN_FIELDS] + ['images', 'notes']
+FILE_BLOCK_SIZE = 64 * 1024
+
+
+def filter_scans(scans, status=None, priority=None, date_from=None, date_to=None):
+    if status:
+        scans = scans.filter(status=status)
+    if priority:
+        scans = scans.filter(priority=priority)
+    if date_from:
+        scans = scans.filter(created_at__date__gte=date_from)
+    if date_to:
+        scans = scans.filter(created_at__date__lte=date_to)
+    return scans
+
+
+def export_chunks(scans=None, chunk_size=1000, using=None):
+    """Yield lists of export rows (dicts keyed by ``COLUMNS``), ``chunk_size`` scans at a time."""
+    scans = (scans if scans is not None else RetinalScan.objects.all()).order_by('id')
+    if using:
+        scans = scans.using(using)
+    last_id = 0
+    while True:
+        chunk = list(scans.filter(id__gt=last_id).values_list(*SCAN_FIELDS)[:chunk_size])
+        if not chunk:
+            return
+        ids = [row[0] for row in chunk]
+        last_id = ids[-1]
+
+        images, notes = {}, {}
+        image_rows = ScanImage.objects.using(scans.db).filter(scan_id__in=ids).order_by('id')
+        for scan_id, eye_side, name, tier, cold_name in image_rows.values_list(
+            'scan_id', 'eye_side', 'image', 'storage_tier', 'cold_name',
+        ):
+            images.setdefault(scan_id, []).append({
+                'eye_side': eye_side, 'path': name, 'storage_tier': tier, 'cold_path': cold_name,
+            })
+        note_rows = DoctorNote.objects.using(scans.db).filter(scan_id__in=ids).order_by('id')
+        for scan_id, doctor_id, text, created_at in note_rows.values_list(
+            'scan_id', 'doctor_id', 'note_text', 'created_at',
+        ):
+            notes.setdefault(scan_id, []).append({
+                'doctor_id': doctor_id, 'note_text': text, 'created_at': created_at.isoformat(),
+            })
+
+        rows = []
+        for values in chunk:
+            row = dict(zip(COLUMNS, values))
+            row['created_at'] = row['created_at'].isoformat()
+            row['updated_at'] = row['updated_at'].isoformat()
+            row['images'] = images.get(row['id'], [])
+            row['notes'] = notes.get(row['id'], [])
+            rows.append(row)
+        yield rows
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that collects bytes until ``drain``ed."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+class Format:
+    name = extension = content_type = None
+
+    def header(self):
+        return b''
+
+    def encode(self, rows):
+        raise NotImplementedError
+
+    def footer(self):
+        return b''
+
+
+class CSVFormat(Format):
+    name, extension, content_type = 'csv', 'csv', 'text/csv'
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _take(self):
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def header(self):
+        self._writer.writerow(COLUMNS)
+        return self._take()
+
+    def encode(self, rows):
+        for row in rows:
+            self._writer.writerow([
+                json.dumps(value) if isinstance(value, (list, dict)) else value
+                for value in (row[column] for column in COLUMNS)
+            ])
+        return self._take()
+
+
+class JSONLinesFormat(Format):
+    name, extension, content_type = 'jsonl', 'jsonl', 'application/x-ndjson'
+
+    def encode(self, rows):
+        return ''.join(json.dumps(row) + '\n' for row in rows).encode()
+
+
+class ParquetFormat(Format):
+    name, extension, content_type = 'parquet', 'parquet', 'application/vnd.apache.parquet'
+
+    def __init__(self):
+        if pq is None:
+            raise ValueError('Parquet export requires pyarrow (pip install pyarrow).')
+        image = pa.struct([
+            ('eye_side', pa.string()), ('path', pa.string()),
+            ('storage_tier', pa.string()), ('cold_path', pa.string()),
+        ])
+        note = pa.struct([('doctor_id', pa.int64()), ('note_text', pa.string()), ('created_at', pa.string())])
+        types = {
+            'patient_age': pa.int64(), 'patient_diabetes_duration': pa.int64(),
+            'left_eye_prediction_class': pa.int64(), 'right_eye_prediction_class': pa.int64(),
+            'images': pa.list_(image), 'notes': pa.list_(note),
+        }
+        self.schema = pa.schema([
+            (column, types.get(column, pa.int64() if column.endswith('id') else pa.string()))
+            for column in COLUMNS
+        ])
+        self._sink = _Sink()
+        self._writer = pq.ParquetWriter(self._sink, self.schema, compression='zstd')
+
+    def encode(self, rows):
+        rows = [{**row, 'ai_details': json.dumps(row['ai_details'])} for row in rows]
+        self._writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+        return self._sink.drain()
+
+    def footer(self):
+        self._writer.close()
+        return self._sink.drain()
+
+
+FORMATS = {format.name: format for format in (CSVFormat, JSONLinesFormat, ParquetFormat)}
+
+
+def get_format(name):
+    if name not in FORMATS:
+        raise ValueError(f"Unknown export format {name!r}; use one of {', '.join(FORMATS)}.")
+    return FORMATS[name]()
+
+
+def stream_export(format_name, scans=None, chunk_size=1000, using=None):
+    """Yield the export file as bytes, one chunk of scans at a time."""
+    encoder = get_format(format_name)
+    yield encoder.header()
+    for rows in export_chunks(scans, chunk_size, using):
+        yield encoder.encode(rows)
+    yield encoder.footer()
+
+
+def _tar_member(name, size, blocks, mtime=None):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime or time.time()
+    info.mode = 0o644
+    yield info.tobuf(format=tarfile.PAX_FORMAT)
+    yield from blocks
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        yield b'\0' * (tarfile.BLOCKSIZE - remainder)
+
+
+def _file_blocks(handle):
+    with handle:
+        while block := handle.read(FILE_BLOCK_SIZE):
+            yield block
+
+
+def stream_tar(format_name, scans=None, chunk_size=1000, using=None):
+    """Yield a tar of per-chunk export parts and the scans' image files."""
+    get_format(format_name)  # fail before the first byte is sent
+    written = set()  # seeded scans share files across chunks; each goes in once
+    for number, rows in enumerate(export_chunks(scans, chunk_size, using), start=1):
+        encoder = get_format(format_name)
+        part = encoder.header() + encoder.encode(rows) + encoder.footer()
+        yield from _tar_member(f'scans/part-{number:05d}.{encoder.extension}', len(part), [part])
+
+        files = sorted({
+            (image['path'], image['storage_tier'], image['cold_path']) for row in rows for image in row['images']
+        })
+        for path, tier, cold_path in files:
+            member = f'images/{cold_path or path}'
+            if member in written:
+                continue
+            try:
+                handle = open(stored_path(path, tier, cold_path), 'rb')
+            except OSError:
+                continue  # file already gone; its path is still in the export
+            size = os.fstat(handle.fileno()).st_size
+            written.add(member)
+            # Cold originals go in as stored (``cold_path``, possibly lossless WebP).
+            yield from _tar_member(member, size, _file_blocks(handle))
+    yield b'\0' * (tarfile.BLOCKSIZE * 2)
+
+
+def export_filename(format_name, images=False):
+    return f"netra-scans-{time.strftime('%Y%m%d')}.{'tar' if images else FORMATS[format_name].extension}"
@@ -0,0 +1,109 @@
+"""
+Downscaled renditions of uploaded scan images.
+
+Dashboards only need previews, so each ``ScanImage`` gets a thumbnail and a
+medium-size copy stored next to the originals under ``derivatives/``. They are
+generated when a scan is ingested and regenerated lazily if one goes missing.
+"""
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RENDITIONS = {
+    'thumbnail': 256,
+    'medium': 1024,
+}
+
+DERIVATIVE_ROOT = 'derivatives'
+
+FORMAT_EXTENSIONS = {
+    'WEBP': 'webp',
+    'JPEG': 'jpg',
+}
+
+
+def renditions():
+    return getattr(settings, 'SCAN_IMAGE_RENDITIONS', DEFAULT_RENDITIONS)
+
+
+def derivative_format():
+    from PIL import features
+
+    fmt = getattr(settings, 'SCAN_IMAGE_DERIVATIVE_FORMAT', 'WEBP').upper()
+    if fmt == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return fmt
+
+
+def derivative_name(image_name, rendition):
+    """
+    Storage name of a rendition, e.g. ``derivatives/thumbnail/retina_scans/x.png.webp``.
+    The original's extension is kept so ``x.png`` and ``x.jpg`` never share one.
+    """
+    return f"{DERIVATIVE_ROOT}/{rendition}/{image_name}.{FORMAT_EXTENSIONS[derivative_format()]}"
+
+
+def _render(source, max_side, fmt):
+    from PIL import Image
+
+    with Image.open(source) as image:
+        # JPEG can decode straight at a reduced scale, skipping most of the work.
+        image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, format=fmt, quality=getattr(settings, 'SCAN_IMAGE_DERIVATIVE_QUALITY', 80))
+    return buffer.getvalue()
+
+
+def generate_derivative(scan_image, rendition):
+    """Render one rendition of ``scan_image`` and store it, replacing any old copy."""
+    from .tiering import open_original
+
+    storage = scan_image.image.storage
+    name = derivative_name(scan_image.image.name, rendition)
+    with open_original(scan_image) as source:
+        data = _render(source, renditions()[rendition], derivative_format())
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(data))
+    return name
+
+
+def generate_derivatives(scan_image):
+    """Create every configured rendition for a newly ingested image."""
+    for rendition in renditions():
+        try:
+            generate_derivative(scan_image, rendition)
+        except Exception:
+            logger.exception('Could not create %s for %s', rendition, scan_image.image.name)
+
+
+def ensure_derivative(scan_image, rendition):
+    """Storage name of a rendition, regenerating it first if it is missing."""
+    if not scan_image.image or rendition not in renditions():
+        return None
+    name = derivative_name(scan_image.image.name, rendition)
+    exists = scan_image.image.storage.exists(name)
+    record_cache('image_derivative', hit=exists)
+    if not exists:
+        try:
+            generate_derivative(scan_image, rendition)
+        except Exception:
+            logger.exception('Could not regenerate %s for %s', rendition, scan_image.image.name)
+            return None
+    return name
+
+
+def derivative_url(scan_image, rendition):
+    """URL of a rendition (see ``ensure_derivative``)."""
+    name = ensure_derivative(scan_image, rendition)
+    if name is None:
+        return None
+    return scan_image.image.storage.url(name)
@@ -0,0 +1,142 @@
+"""
+Cheap checks on uploaded images before anything decodes them.
+
+``Image.open`` only parses the header, so format, dimensions and pixel count
+are known before a single pixel is decoded. ``inspect_image`` rejects
+unsupported formats and oversized inputs from that alone. ``open_for_inference``
+then decodes within a per-request memory budget: anything larger than
+``INFERENCE_MAX_PIXELS`` is downscaled, using JPEG draft mode to decode
+directly at a reduced scale where possible. Peak memory per request stays
+bounded whatever is uploaded.
+
+Pillow is imported on first use, so processes that never handle an image
+don't load it.
+"""
+import math
+import os
+from dataclasses import dataclass
+
+from django.conf import settings
+from rest_framework import status
+
+DEFAULT_ALLOWED_FORMATS = ('JPEG', 'PNG', 'TIFF', 'BMP', 'WEBP')
+
+# Bytes per pixel held at once while predicting: the RGB image, its numpy
+# copy and the float32 tensor (3 + 3 + 12).
+INFERENCE_BYTES_PER_PIXEL = 18
+
+
+class ImageRejected(Exception):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class ImageInfo:
+    format: str
+    width: int
+    height: int
+    mode: str
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+    @property
+    def decoded_bytes(self):
+        """Memory needed to decode at full size and convert to RGB."""
+        from PIL import Image
+
+        try:
+            bands = Image.getmodebands(self.mode)
+        except KeyError:
+            bands = 4
+        depth = 4 if self.mode in ('I', 'F') else 2 if self.mode.startswith('I;16') else 1
+        converted = 0 if self.mode == 'RGB' else 3
+        return self.pixels * (bands * depth + converted)
+
+
+def _file_size(image_file):
+    size = getattr(image_file, 'size', None)
+    if size is None and hasattr(image_file, 'seek'):
+        position = image_file.tell()
+        size = image_file.seek(0, os.SEEK_END)
+        image_file.seek(position)
+    elif size is None:
+        size = os.path.getsize(image_file)
+    return size
+
+
+def inspect_image(image_file):
+    """Validate ``image_file`` from its header alone; raises ``ImageRejected``."""
+    max_bytes = getattr(settings, 'IMAGE_MAX_UPLOAD_BYTES', 50 * 1024 * 1024)
+    if _file_size(image_file) > max_bytes:
+        raise ImageRejected(
+            f'Image exceeds {max_bytes // (1024 * 1024)} MB.', status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    from PIL import Image, UnidentifiedImageError
+
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    try:
+        with Image.open(image_file) as image:
+            info = ImageInfo(image.format, image.width, image.height, image.mode)
+    except Image.DecompressionBombError:
+        raise ImageRejected('Image is too large.', status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise ImageRejected('File is not a readable image.')
+    finally:
+        if hasattr(image_file, 'seek'):
+            image_file.seek(0)
+
+    allowed = getattr(settings, 'IMAGE_ALLOWED_FORMATS', DEFAULT_ALLOWED_FORMATS)
+    if info.format not in allowed:
+        raise ImageRejected(f"Unsupported image format {info.format}; use one of {', '.join(allowed)}.")
+    if not info.width or not info.height:
+        raise ImageRejected('Image has no pixels.')
+
+    max_pixels = getattr(settings, 'IMAGE_MAX_PIXELS', 50_000_000)
+    budget = getattr(settings, 'INFERENCE_MEMORY_BUDGET', 512 * 1024 * 1024)
+    if info.pixels > max_pixels or info.decoded_bytes > budget:
+        raise ImageRejected(
+            f'Image is too large ({info.width}x{info.height}); the limit is {max_pixels} pixels.',
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+    return info
+
+
+def inference_size(width, height):
+    """Largest size with the same aspect ratio that fits the inference pixel and memory limits."""
+    max_pixels = min(
+        getattr(settings, 'INFERENCE_MAX_PIXELS', 12_000_000),
+        getattr(settings, 'INFERENCE_MEMORY_BUDGET', 512 * 1024 * 1024) // INFERENCE_BYTES_PER_PIXEL,
+    )
+    if width * height <= max_pixels:
+        return width, height
+    scale = math.sqrt(max_pixels / (width * height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def open_for_inference(image_file):
+    """Validate, then decode ``image_file`` to an RGB image no larger than ``inference_size``."""
+    from PIL import Image
+
+    info = inspect_image(image_file)
+    target = inference_size(info.width, info.height)
+    try:
+        with Image.open(image_file) as image:
+            if target != (info.width, info.height):
+                # JPEG decodes at 1/2, 1/4 or 1/8 scale directly; other formats ignore this.
+                image.draft('RGB', target)
+            image = image.convert('RGB')
+    except (OSError, SyntaxError, ValueError):
+        # Truncated or corrupt pixel data behind a valid header.
+        raise ImageRejected('File is not a readable image.')
+    finally:
+        if hasattr(image_file, 'seek'):
+            image_file.seek(0)
+    if image.size[0] * image.size[1] > target[0] * target[1]:
+        image = image.resize(target, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return image
@@ -0,0 +1,271 @@
+"""
+Pluggable inference backends.
+
+Views predict through ``model_registry.get_registry()``, which owns the
+active backend, and never touch the model directly.
+``settings.INFERENCE_BACKEND`` selects the implementation, either by
+short name or dotted path. ``settings.INFERENCE_BACKEND_OPTIONS`` holds
+its keyword arguments.
+
+- ``torch``: eager PyTorch checkpoint (the original behaviour)
+- ``exported``: TorchScript (``.pt``) or ONNX (``.onnx``) export
+- ``remote``: POSTs images to another Netra instance's ``predict/``
+  endpoint
+- ``stub``: deterministic, seedable fake with configurable latency, for
+  CI and load tests
+
+Every backend returns
+``{"prediction": <label>, "prediction_class": <0-4>}``.
+``predict_batch(arrays)`` takes decoded HxWx3 uint8 arrays (see
+``model_loader.decode_array``) and returns one such dict per array.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from io import BytesIO
+from urllib import request as urlrequest
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import model_loader
+from .devices import ReplicaPool
+from .metrics import INFERENCE_BATCH_SIZE, INFERENCE_STAGE_SECONDS, PREDICTIONS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBackend:
+    """Interface shared by all backends."""
+
+    name = 'base'
+
+    def __init__(self, **options):
+        self.options = options
+        self.version = None
+        self.warmed = False
+
+    def load(self):
+        """Prepare the backend; called once before the first prediction."""
+
+    @property
+    def ready(self):
+        return True
+
+    def predict(self, image_file):
+        raise NotImplementedError
+
+    def predict_batch(self, arrays):
+        """Fallback for backends without native batching: re-encode and predict one by one."""
+        from PIL import Image
+
+        results = []
+        for array in arrays:
+            buffer = BytesIO()
+            Image.fromarray(array).save(buffer, format='PNG')
+            buffer.seek(0)
+            results.append(self.predict(buffer))
+        return results
+
+    def describe(self):
+        return {'backend': self.name, 'version': self.version, 'ready': self.ready, 'warmed': self.warmed}
+
+    def close(self):
+        """Release worker threads once the registry drops this backend; queued calls still finish."""
+
+
+def _file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class TorchBackend(InferenceBackend):
+    """
+    Eager PyTorch model loaded from a training checkpoint, with one replica
+    per inference device (see api/devices.py).
+    """
+
+    name = 'torch'
+
+    def __init__(self, checkpoint=None, **options):
+        super().__init__(**options)
+        self.checkpoint = checkpoint or model_loader.DEFAULT_MODEL_PATH
+        self.pool = None
+
+    def load(self):
+        self.pool = ReplicaPool.load(self._load_replica)
+        if self.pool is not None:
+            self.version = f'{os.path.basename(self.checkpoint)}@{_file_digest(self.checkpoint)}'
+
+    def _load_replica(self, device):
+        return model_loader.load_model(self.checkpoint, device)
+
+    @property
+    def ready(self):
+        return self.pool is not None
+
+    def predict(self, image_file):
+        if self.pool is None:
+            return model_loader.predict_image(None, image_file)  # raises "Model not available"
+        return self.pool.predict(model_loader.predict_image, image_file)
+
+    def predict_batch(self, arrays):
+        if self.pool is None:
+            return model_loader.predict_batch(None, arrays)
+        return self.pool.predict_batch(model_loader.predict_batch, arrays)
+
+    def describe(self):
+        return {**super().describe(), 'replicas': self.pool.describe() if self.pool else []}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+
+class _OnnxModule:
+    """Makes an onnxruntime session callable like a torch module."""
+
+    def __init__(self, path):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(path, providers=onnxruntime.get_available_providers())
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, tensor):
+        import torch
+
+        outputs = self.session.run(None, {self.input_name: tensor.cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+class ExportedBackend(TorchBackend):
+    """TorchScript or ONNX export of the model, run through the same pre/post-processing."""
+
+    name = 'exported'
+
+    def load(self):
+        if not model_loader.TORCH_AVAILABLE:
+            logger.warning("PyTorch not available. Exported model not loaded.")
+            return
+        if not os.path.exists(self.checkpoint):
+            logger.warning("Exported model not found at %s.", self.checkpoint)
+            return
+        super().load()
+        if self.pool is not None:
+            logger.info("Exported model loaded from %s", self.checkpoint)
+
+    def _load_replica(self, device):
+        if self.checkpoint.endswith('.onnx'):
+            return _OnnxModule(self.checkpoint)
+        import torch
+
+        return torch.jit.load(self.checkpoint, map_location=device).eval()
+
+
+class RemoteBackend(InferenceBackend):
+    """Delegates to a dedicated inference worker over HTTP."""
+
+    name = 'remote'
+
+    def __init__(self, url=None, timeout=30, **options):
+        super().__init__(**options)
+        self.url = url or os.environ.get('NETRA_INFERENCE_URL', 'http://127.0.0.1:8001/api/predict/')
+        self.timeout = timeout
+
+    def predict(self, image_file):
+        image_file.seek(0)
+        content = image_file.read()
+        image_file.seek(0)
+        boundary = uuid.uuid4().hex
+        filename = os.path.basename(getattr(image_file, 'name', None) or 'image')
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+            + content + f'\r\n--{boundary}--\r\n'.encode()
+        )
+        req = urlrequest.Request(self.url, data=body, method='POST')
+        req.add_header('Content-Type', f'multipart/form-data; boundary={boundary}')
+        started = time.perf_counter()
+        with urlrequest.urlopen(req, timeout=self.timeout) as response:
+            result = json.loads(response.read())
+            self.version = response.headers.get('X-Model-Version', self.version)
+        INFERENCE_STAGE_SECONDS.observe(time.perf_counter() - started, stage='remote')
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        PREDICTIONS_TOTAL.inc(label=result['prediction'])
+        return {'prediction': result['prediction'], 'prediction_class': result['prediction_class']}
+
+
+class StubBackend(InferenceBackend):
+    """
+    Deterministic fake: the predicted class depends only on the seed and the
+    decoded pixels, so repeated runs (and batch re-scoring) give identical
+    results. ``latency_ms`` (plus up to ``jitter_ms``) simulates model cost
+    per call.
+    """
+
+    name = 'stub'
+
+    def __init__(self, seed=0, latency_ms=0, jitter_ms=0, **options):
+        super().__init__(**options)
+        self.seed = int(seed)
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.version = f'stub-{self.seed}'
+
+    def predict(self, image_file):
+        image_file.seek(0)
+        array = model_loader.decode_array(image_file)
+        image_file.seek(0)
+        return self.predict_batch([array])[0]
+
+    def predict_batch(self, arrays):
+        digests = [hashlib.sha256(str(self.seed).encode() + array.tobytes()).digest() for array in arrays]
+
+        started = time.perf_counter()
+        delay = self.latency_ms + (random.Random(digests[0]).random() * self.jitter_ms if digests else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        INFERENCE_STAGE_SECONDS.observe(time.perf_counter() - started, stage='forward')
+        INFERENCE_BATCH_SIZE.observe(len(arrays))
+
+        results = []
+        for digest in digests:
+            pred_class = digest[0] % len(model_loader.LABELS)
+            PREDICTIONS_TOTAL.inc(label=model_loader.LABELS[pred_class])
+            results.append({
+                "prediction": model_loader.LABELS[pred_class],
+                "prediction_class": pred_class
+            })
+        return results
+
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'exported': ExportedBackend,
+    'remote': RemoteBackend,
+    'stub': StubBackend,
+}
+
+
+def create_backend(name=None, options=None):
+    name = name or getattr(settings, 'INFERENCE_BACKEND', 'torch')
+    options = getattr(settings, 'INFERENCE_BACKEND_OPTIONS', {}) if options is None else options
+    backend_class = BACKENDS.get(name) or import_string(name)
+    backend = backend_class(**options)
+    backend.load()
+    return backend
+
+
+def get_backend():
+    """The active backend of the process-wide model registry (see api/model_registry.py)."""
+    from .model_registry import get_registry
+
+    return get_registry().active
@@ -0,0 +1,79 @@
+"""
+Bounded worker pool for password verification.
+
+Password hashing is deliberately CPU-heavy, and at shift start every nurse and
+doctor logs in at once. Login requests hand ``authenticate()`` to a small pool
+(``LOGIN_HASH_WORKERS`` threads; PBKDF2 and Argon2 both release the GIL) so no
+more than that many hashes run at a time. At most ``LOGIN_MAX_PENDING`` more
+may wait. Anything beyond that is rejected immediately with ``LoginBusy`` so
+the scan and inference endpoints keep their CPU.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class LoginBusy(Exception):
+    """Raised when the login pool is saturated; ``retry_after`` is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__('Login capacity exhausted')
+        self.retry_after = retry_after
+
+
+class LoginPool:
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    @staticmethod
+    def _call(fn, args, kwargs):
+        # Worker threads hold their own DB connections; keep them healthy.
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    def run(self, fn, *args, timeout=None, retry_after=1, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy(retry_after)
+        future = self._executor.submit(self._call, fn, args, kwargs)
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise LoginBusy(retry_after)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_login_pool():
+    global _pool
+    workers = getattr(settings, 'LOGIN_HASH_WORKERS', 0)
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool.workers != workers:
+            _pool = LoginPool(workers, getattr(settings, 'LOGIN_MAX_PENDING', 32))
+        return _pool
+
+
+def run_login_hash(fn, *args, **kwargs):
+    """Run ``fn`` (normally ``authenticate``) on the login pool, or inline if disabled."""
+    pool = get_login_pool()
+    if pool is None:
+        return fn(*args, **kwargs)
+    return pool.run(
+        fn, *args,
+        timeout=getattr(settings, 'LOGIN_QUEUE_TIMEOUT', 10),
+        retry_after=getattr(settings, 'LOGIN_RETRY_AFTER', 2),
+        **kwargs,
+    )
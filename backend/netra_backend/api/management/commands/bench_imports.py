@@ -0,0 +1,113 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarking import parse_importtime, report_metadata, write_report
+
+HEAVY_MODULES = ('torch', 'timm', 'onnxruntime', 'numpy', 'PIL')
+
+# Failed imports show up in the importtime log too, so the child reports
+# which heavy modules actually ended up in sys.modules.
+STARTUP = (
+    'import sys, django; django.setup(); import {target}; '
+    'print(" ".join(name for name in {heavy!r} if name in sys.modules))'
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure process startup (django.setup() plus importing the URLconf) with '
+        'python -X importtime, per settings profile, and report the slowest packages.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='netra_backend.settings_web,netra_backend.settings_inference',
+                            help='Comma-separated settings modules to measure.')
+        parser.add_argument('--target', default=settings.ROOT_URLCONF,
+                            help='Module imported after django.setup(); the URLconf pulls in every view.')
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per profile; the median is reported.')
+        parser.add_argument('--top', type=int, default=10, help='Packages listed per profile.')
+        parser.add_argument('--output', help='Write the JSON report to this path.')
+        parser.add_argument('--history', help='Append a summary line to this JSON lines file and compare with its last run.')
+
+    def handle(self, *args, **options):
+        report = {'meta': report_metadata(), 'target': options['target'], 'profiles': {}}
+        for profile in options['profiles'].split(','):
+            runs = [self._run(profile, options['target']) for _ in range(options['runs'])]
+            wall = statistics.median(run['wall_ms'] for run in runs)
+            median_run = min(runs, key=lambda run: abs(run['wall_ms'] - wall))
+            result = {'wall_ms': round(wall, 1), **{k: v for k, v in median_run.items() if k != 'wall_ms'}}
+            result['packages'] = result['packages'][:options['top']]
+            report['profiles'][profile] = result
+            self._print(profile, result)
+
+        if options['history']:
+            self._track(options['history'], report)
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _run(self, profile, target):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': profile}
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP.format(target=target, heavy=HEAVY_MODULES)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        wall_ms = (time.perf_counter() - started) * 1000
+        if proc.returncode:
+            raise CommandError(f'Importing {target} with {profile} failed:\n{proc.stderr[-2000:]}')
+
+        modules = parse_importtime(proc.stderr)
+        packages = {}
+        for name, self_us, _ in modules:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + self_us
+        return {
+            'wall_ms': wall_ms,
+            'import_ms': round(sum(self_us for _, self_us, _ in modules) / 1000, 1),
+            'modules': len(modules),
+            'heavy_modules': (proc.stdout.strip().splitlines() or [''])[-1].split(),
+            'packages': [
+                {'package': package, 'self_ms': round(us / 1000, 1)}
+                for package, us in sorted(packages.items(), key=lambda item: -item[1])
+            ],
+        }
+
+    def _track(self, path, report):
+        previous = {}
+        if os.path.exists(path):
+            with open(path) as fh:
+                for line in fh:
+                    if line.strip():
+                        entry = json.loads(line)
+                        previous[entry['profile']] = entry
+        with open(path, 'a') as fh:
+            for profile, result in report['profiles'].items():
+                entry = {
+                    **report['meta'], 'profile': profile, 'target': report['target'],
+                    'wall_ms': result['wall_ms'], 'import_ms': result['import_ms'],
+                    'heavy_modules': result['heavy_modules'],
+                }
+                fh.write(json.dumps(entry, default=str) + '\n')
+                last = previous.get(profile)
+                if last:
+                    self.stdout.write(
+                        f"{profile}: {result['wall_ms'] - last['wall_ms']:+.1f} ms wall since "
+                        f"{last.get('git_revision') or last['timestamp']}"
+                    )
+
+    def _print(self, profile, result):
+        heavy = ', '.join(result['heavy_modules']) or 'none'
+        self.stdout.write(
+            f"{profile}: {result['wall_ms']:.1f} ms wall, {result['import_ms']:.1f} ms importing "
+            f"{result['modules']} modules; heavy modules: {heavy}"
+        )
+        for package in result['packages']:
+            self.stdout.write(f"    {package['package']:<28} {package['self_ms']:>8.1f} ms")
@@ -0,0 +1,83 @@
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import model_loader
+from api.benchmarking import report_metadata, summarize_latencies, synthetic_fundus, write_report
+
+
+def _mock_model():
+    """Tiny stand-in with the real model's interface (NCHW in, 5 logits out)."""
+    import torch
+
+    class MockModel(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.head = torch.nn.Linear(3, len(model_loader.LABELS))
+
+        def forward(self, x):
+            return self.head(x.mean(dim=(2, 3)))
+
+    return MockModel().eval().to(model_loader.get_device())
+
+
+class Command(BaseCommand):
+    help = (
+        'Micro-benchmark preprocess_image and predict_image with a mock model '
+        'and, if the checkpoint is available, the real model.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='224x224,1024x768,2048x1536',
+                            help='Comma-separated WxH input sizes.')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--skip-real', action='store_true', help='Only benchmark the mock model.')
+        parser.add_argument('--output', help='Write the JSON report to this path.')
+
+    def handle(self, *args, **options):
+        if not model_loader.TORCH_AVAILABLE:
+            raise CommandError('PyTorch is not installed; nothing to benchmark.')
+
+        models = {'mock': _mock_model()}
+        if not options['skip_real']:
+            real = model_loader.load_model()
+            if real is None:
+                self.stdout.write(self.style.WARNING('Real model unavailable, benchmarking the mock only.'))
+            else:
+                models['real'] = real
+
+        report = {'meta': report_metadata(), 'device': str(model_loader.get_device()), 'results': []}
+        for size in options['sizes'].split(','):
+            width, height = (int(v) for v in size.split('x'))
+            payload = synthetic_fundus(0, (width, height))
+
+            timings = self._time(lambda: model_loader.preprocess_image(BytesIO(payload)), options)
+            report['results'].append({'function': 'preprocess_image', 'size': size, **timings})
+            self._print('preprocess_image', size, timings)
+
+            for name, model in models.items():
+                timings = self._time(lambda: model_loader.predict_image(model, BytesIO(payload)), options)
+                report['results'].append({'function': 'predict_image', 'model': name, 'size': size, **timings})
+                self._print(f'predict_image[{name}]', size, timings)
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _time(self, fn, options):
+        for _ in range(options['warmup']):
+            fn()
+        samples = []
+        for _ in range(options['iterations']):
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+        return summarize_latencies(samples, elapsed=sum(samples))
+
+    def _print(self, label, size, timings):
+        self.stdout.write(
+            f"{label:24s} {size:>10s}  p50={timings['p50_ms']}ms p95={timings['p95_ms']}ms "
+            f"p99={timings['p99_ms']}ms ({timings['per_second']}/s)"
+        )
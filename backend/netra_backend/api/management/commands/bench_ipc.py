@@ -0,0 +1,104 @@
+import multiprocessing
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from api import model_loader
+from api.benchmarking import report_metadata, summarize_latencies, synthetic_fundus, write_report
+from api.shm_ring import ShmRing
+
+
+def _pickled_consumer(conn):
+    while True:
+        tensor = conn.recv()
+        if tensor is None:
+            return
+        conn.send(float(tensor[0, 0, 0]))
+
+
+def _shm_consumer(conn, name):
+    ring = ShmRing.attach(name)
+    try:
+        while True:
+            slot = conn.recv()
+            if slot is None:
+                return
+            batch = ring.batch([slot])
+            value = float(batch[0, 0, 0, 0])
+            ring.release([slot])
+            conn.send(value)
+    finally:
+        ring.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare handing decoded scans to another process as pickled arrays over a pipe '
+        'with writing them into a shared-memory ring and sending only slot indices.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='224x224,2048x1536',
+                            help='Comma-separated WxH input sizes (the default ends with a full-resolution fundus).')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--slots', type=int, default=4, help='Slots in the shared-memory ring.')
+        parser.add_argument('--output', help='Write the JSON report to this path.')
+
+    def handle(self, *args, **options):
+        import numpy as np
+
+        report = {'meta': report_metadata(), 'results': []}
+        for size in options['sizes'].split(','):
+            width, height = (int(v) for v in size.split('x'))
+            image = model_loader.decode_image(BytesIO(synthetic_fundus(0, (width, height))))
+            shape = (3, image.height, image.width)
+
+            def pickled(conn):
+                conn.send(model_loader.write_tensor(image, np.empty(shape, dtype=np.float32)))
+                conn.recv()
+
+            timings = self._run(_pickled_consumer, (), pickled, options)
+            self._record(report, 'pickle', size, shape, timings)
+
+            ring = ShmRing.create(options['slots'], shape)
+            try:
+                def shared(conn):
+                    conn.send(ring.put(image))
+                    conn.recv()
+
+                timings = self._run(_shm_consumer, (ring.name,), shared, options)
+            finally:
+                ring.close()
+            self._record(report, 'shared_memory', size, shape, timings)
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _run(self, consumer, args, send, options):
+        """Time ``send`` round trips to a consumer process: handoff, first read, reply."""
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=consumer, args=(child_conn, *args), daemon=True)
+        process.start()
+        try:
+            for _ in range(options['warmup']):
+                send(conn)
+            samples = []
+            for _ in range(options['iterations']):
+                started = time.perf_counter()
+                send(conn)
+                samples.append(time.perf_counter() - started)
+        finally:
+            conn.send(None)
+            process.join()
+        return summarize_latencies(samples, elapsed=sum(samples))
+
+    def _record(self, report, transfer, size, shape, timings):
+        megabytes = round(shape[0] * shape[1] * shape[2] * 4 / 1e6, 2)
+        report['results'].append({'transfer': transfer, 'size': size, 'tensor_mb': megabytes, **timings})
+        self.stdout.write(
+            f"{transfer:14s} {size:>10s} {megabytes:7.2f}MB  p50={timings['p50_ms']}ms "
+            f"p95={timings['p95_ms']}ms ({timings['per_second']}/s)"
+        )
@@ -0,0 +1,162 @@
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.benchmarking import report_metadata, summarize_latencies, write_report
+from api.sqlite_tuning import apply_pragmas, sqlite_pragmas
+
+SCHEMA = """
+CREATE TABLE scan (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    doctor_id INTEGER NOT NULL,
+    patient_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX scan_doctor_created ON scan (doctor_id, created_at);
+"""
+
+READ_SQL = 'SELECT id, patient_id, status, payload FROM scan WHERE doctor_id = ? ORDER BY created_at DESC LIMIT 50'
+WRITE_SQL = 'INSERT INTO scan (doctor_id, patient_id, status, payload, created_at) VALUES (?, ?, ?, ?, ?)'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark mixed SQLite readers and writers with the default journal '
+        'settings and with SQLITE_PRAGMAS, reporting lock errors and latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per profile.')
+        parser.add_argument('--doctors', type=int, default=20)
+        parser.add_argument('--seed-rows', type=int, default=20000)
+        parser.add_argument('--write-hold-ms', type=float, default=5.0,
+                            help='Time a writer keeps its transaction open (simulates upload work).')
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help='sqlite3 connect timeout for the default profile.')
+        parser.add_argument('--output', help='Write the JSON report to this path.')
+
+    def handle(self, *args, **options):
+        profiles = {
+            'default': {'pragmas': {}, 'isolation_level': 'DEFERRED'},
+            'tuned': {'pragmas': sqlite_pragmas(), 'isolation_level': 'IMMEDIATE'},
+        }
+        report = {'meta': report_metadata(), 'config': {
+            key: options[key] for key in ('readers', 'writers', 'duration', 'doctors', 'seed_rows', 'write_hold_ms')
+        }, 'profiles': {}}
+
+        for name, profile in profiles.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'bench.sqlite3')
+                self._seed(path, options)
+                result = self._run(path, profile, options)
+            report['profiles'][name] = result
+            reads, writes = result['reads'], result['writes']
+            self.stdout.write(
+                f"{name:8s} reads/s={reads.get('per_second')} read p99={reads.get('p99_ms')}ms "
+                f"writes/s={writes.get('per_second')} write p99={writes.get('p99_ms')}ms "
+                f"lock errors={result['lock_errors']}"
+            )
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def _seed(self, path, options):
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA)
+        now = time.time()
+        rows = [
+            (random.randint(1, options['doctors']), random.randint(1, 10000), 'pending', 'x' * 200, now - i)
+            for i in range(options['seed_rows'])
+        ]
+        conn.executemany(WRITE_SQL, rows)
+        conn.commit()
+        conn.close()
+
+    def _connect(self, path, profile, options):
+        conn = sqlite3.connect(
+            path, timeout=options['timeout'], isolation_level=None, check_same_thread=False,
+        )
+        if profile['pragmas']:
+            apply_pragmas(conn.cursor(), profile['pragmas'])
+        return conn
+
+    def _run(self, path, profile, options):
+        # WAL is persistent, so switch the file once before the workers start.
+        self._connect(path, profile, options).close()
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        read_latencies, write_latencies = [], []
+        counters = {'lock_errors': 0}
+
+        def record(bucket, value):
+            with lock:
+                bucket.append(value)
+
+        def lock_error():
+            with lock:
+                counters['lock_errors'] += 1
+
+        def reader():
+            conn = self._connect(path, profile, options)
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    conn.execute(READ_SQL, (random.randint(1, options['doctors']),)).fetchall()
+                except sqlite3.OperationalError:
+                    lock_error()
+                    continue
+                record(read_latencies, time.perf_counter() - started)
+            conn.close()
+
+        def writer():
+            conn = self._connect(path, profile, options)
+            hold = options['write_hold_ms'] / 1000
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    conn.execute(f"BEGIN {profile['isolation_level']}")
+                    conn.execute(WRITE_SQL, (
+                        random.randint(1, options['doctors']), random.randint(1, 10000),
+                        'pending', 'x' * 200, time.time(),
+                    ))
+                    time.sleep(hold)
+                    conn.execute('COMMIT')
+                except sqlite3.OperationalError:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    lock_error()
+                    continue
+                record(write_latencies, time.perf_counter() - started)
+            conn.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer) for _ in range(options['writers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return {
+            'pragmas': profile['pragmas'],
+            'reads': summarize_latencies(read_latencies, elapsed),
+            'writes': summarize_latencies(write_latencies, elapsed),
+            'lock_errors': counters['lock_errors'],
+        }
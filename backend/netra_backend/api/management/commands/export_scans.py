@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api import export
+from api.models import RetinalScan
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream every RetinalScan with its predictions, notes and image paths to a CSV, '
+        'JSON-lines or Parquet file (or, with --images, a tar that also holds the image '
+        'files), reading the table in chunks so memory stays flat.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', default='jsonl', choices=list(export.FORMATS))
+        parser.add_argument('--output', '-o', default='-', help='Output file; - writes to stdout.')
+        parser.add_argument('--images', action='store_true', help='Write a tar including the image files.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Scans read per query.')
+        parser.add_argument('--status')
+        parser.add_argument('--priority')
+        parser.add_argument('--date-from', type=parse_date, help='YYYY-MM-DD, inclusive.')
+        parser.add_argument('--date-to', type=parse_date, help='YYYY-MM-DD, inclusive.')
+
+    def handle(self, *args, **options):
+        try:
+            export.get_format(options['format'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        scans = export.filter_scans(
+            RetinalScan.objects.all(),
+            status=options['status'], priority=options['priority'],
+            date_from=options['date_from'], date_to=options['date_to'],
+        )
+        stream_factory = export.stream_tar if options['images'] else export.stream_export
+        stream = stream_factory(options['format'], scans, chunk_size=options['chunk_size'])
+
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        written = 0
+        try:
+            for data in stream:
+                output.write(data)
+                written += len(data)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}."))
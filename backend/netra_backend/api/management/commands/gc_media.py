@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.media_gc import MediaGarbageCollector
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove scan image files (and their preview renditions) that no ScanImage refers to '
+        'any more, e.g. after scans were deleted. Files younger than MEDIA_GC_GRACE_PERIOD '
+        'are kept. Safe to run from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed.')
+        parser.add_argument('--grace', type=int, help='Grace period in seconds (default: MEDIA_GC_GRACE_PERIOD).')
+        parser.add_argument('--batch-size', type=int, default=200, help='File names checked per query.')
+
+    def handle(self, *args, **options):
+        result = MediaGarbageCollector(
+            grace_period=options['grace'], batch_size=options['batch_size'], dry_run=options['dry_run'],
+        ).run()
+        if options['dry_run']:
+            summary = f'would remove {result.orphaned} orphans ({result.orphaned_bytes / 1024 / 1024:.1f} MB)'
+        else:
+            summary = f'removed {result.deleted} orphans ({result.bytes_reclaimed / 1024 / 1024:.1f} MB reclaimed)'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {result.scanned} files: {summary}, {result.recent} within the grace period.'
+        ))
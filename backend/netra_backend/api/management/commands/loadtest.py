@@ -0,0 +1,172 @@
+import json
+import random
+import threading
+import time
+import uuid
+from urllib import error, request as urlrequest
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarking import report_metadata, summarize_latencies, synthetic_fundus, write_report
+from api.management.commands.seed_data import DEFAULT_PASSWORD, PREFIX
+
+SCENARIOS = {
+    # name: (method, path, role)
+    'upload-scan': ('POST', 'upload-scan/', 'nurse'),
+    'all-scans': ('GET', 'all-scans/', 'doctor'),
+    'scan-stats': ('GET', 'scan-stats/', 'doctor'),
+    'admin-stats': ('GET', 'admin/stats/', 'admin'),
+}
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, content, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive a running server with concurrent requests against upload-scan/, '
+        'all-scans/, scan-stats/ and admin/stats/ using users created by '
+        'seed_data, and report latency percentiles and throughput.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/api/')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help='Comma-separated subset of: ' + ', '.join(SCENARIOS))
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds per scenario.')
+        parser.add_argument('--users', type=int, default=5, help='Seeded users per role to log in as.')
+        parser.add_argument('--password', default=DEFAULT_PASSWORD)
+        parser.add_argument('--image-size', default='1024x768')
+        parser.add_argument('--timeout', type=float, default=60.0)
+        parser.add_argument('--output', help='Write the JSON report to this path.')
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/') + '/'
+        self.timeout = options['timeout']
+        names = options['scenarios'].split(',')
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        tokens = {}
+        for role in {SCENARIOS[name][2] for name in names}:
+            count = 1 if role == 'admin' else options['users']
+            tokens[role] = [self._login(f'{PREFIX}_{role}_{i}', options['password']) for i in range(count)]
+
+        self.upload_targets = []
+        if 'upload-scan' in names:
+            # Doctors' rosters give the subscribed pairs, even when no doctor scenario runs.
+            doctors = tokens.get('doctor') or [
+                self._login(f'{PREFIX}_doctor_{i}', options['password']) for i in range(options['users'])
+            ]
+            self.upload_targets = self._upload_targets(doctors)
+        width, height = (int(v) for v in options['image_size'].split('x'))
+        self.image = synthetic_fundus(1, (width, height))
+
+        report = {'meta': report_metadata(), 'config': {
+            key: options[key] for key in ('base_url', 'concurrency', 'duration', 'users', 'image_size')
+        }, 'scenarios': {}}
+        for name in names:
+            result = self._run(name, tokens[SCENARIOS[name][2]], options)
+            report['scenarios'][name] = result
+            self.stdout.write(
+                f"{name:12s} {result['requests_per_second']:8.1f} req/s  p50={result['latency'].get('p50_ms')}ms "
+                f"p95={result['latency'].get('p95_ms')}ms p99={result['latency'].get('p99_ms')}ms "
+                f"errors={result['errors']}"
+            )
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _call(self, method, path, token=None, body=None, content_type='application/json'):
+        req = urlrequest.Request(self.base_url + path, data=body, method=method)
+        if token:
+            req.add_header('Authorization', f'Bearer {token}')
+        if body is not None:
+            req.add_header('Content-Type', content_type)
+        with urlrequest.urlopen(req, timeout=self.timeout) as response:
+            return response.status, response.read()
+
+    def _login(self, username, password):
+        body = json.dumps({'username': username, 'password': password}).encode()
+        try:
+            _, payload = self._call('POST', 'login/', body=body)
+        except error.HTTPError as exc:
+            raise CommandError(f'Login failed for {username} ({exc.code}); run seed_data first.')
+        return json.loads(payload)['tokens']['access']
+
+    def _upload_targets(self, doctor_tokens):
+        """(patient_id, doctor_id) pairs taken from the doctors' rosters."""
+        pairs = []
+        for token in doctor_tokens:
+            _, payload = self._call('GET', 'doctor/patients/', token)
+            me = json.loads(self._call('GET', 'me/', token)[1])
+            pairs += [(patient['id'], me['id']) for patient in json.loads(payload)]
+        if not pairs:
+            raise CommandError('upload-scan needs seeded doctors with subscribed patients; run seed_data first.')
+        return pairs
+
+    def _request(self, name, token, rng):
+        method, path, _ = SCENARIOS[name]
+        if name == 'upload-scan':
+            patient_id, doctor_id = rng.choice(self.upload_targets)
+            body, content_type = _multipart(
+                {'patient_id': patient_id, 'doctor_id': doctor_id, 'patient_age': 60},
+                {'left_eye': ('left.png', self.image, 'image/png'),
+                 'right_eye': ('right.png', self.image, 'image/png')},
+            )
+            return self._call(method, path, token, body, content_type)
+        return self._call(method, path, token)
+
+    def _run(self, name, tokens, options):
+        latencies, errors = [], {}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def worker(index):
+            rng = random.Random(index)
+            token = tokens[index % len(tokens)]
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    self._request(name, token, rng)
+                    outcome = None
+                except error.HTTPError as exc:
+                    outcome = str(exc.code)
+                except (error.URLError, OSError) as exc:
+                    outcome = type(exc).__name__
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if outcome is None:
+                        latencies.append(elapsed)
+                    else:
+                        errors[outcome] = errors.get(outcome, 0) + 1
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return {
+            'latency': summarize_latencies(latencies),
+            'requests_per_second': round(len(latencies) / elapsed, 2),
+            'errors': errors,
+        }
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.models import RetinalScan
+from api.purge import delete_scans
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete scans (with their image rows, notes and worklist items) for a patient and/or '
+        'by creation date, in chunked transactions. Run gc_media afterwards to reclaim the files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, help='Only this patient id.')
+        parser.add_argument('--date-from', type=parse_date, help='YYYY-MM-DD, inclusive.')
+        parser.add_argument('--date-to', type=parse_date, help='YYYY-MM-DD, inclusive.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Scans per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the matching scans.')
+
+    def handle(self, *args, **options):
+        if not any(options[name] for name in ('patient', 'date_from', 'date_to')):
+            raise CommandError('Give --patient, --date-from and/or --date-to.')
+
+        scans = RetinalScan.objects.all()
+        if options['patient']:
+            scans = scans.filter(patient_id=options['patient'])
+        if options['date_from']:
+            scans = scans.filter(created_at__date__gte=options['date_from'])
+        if options['date_to']:
+            scans = scans.filter(created_at__date__lte=options['date_to'])
+
+        if options['dry_run']:
+            self.stdout.write(f'{scans.count()} scans would be deleted.')
+            return
+        totals = delete_scans(scans, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {totals['scans']} scans, {totals['images']} images and {totals['notes']} notes "
+            f"of {totals['patients']} patients."
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.search import get_engine
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the scan search index from the stored scans, patients and notes, e.g. after '
+        'importing or bulk-editing data outside the API.'
+    )
+
+    def handle(self, *args, **options):
+        engine = get_engine()
+        count = engine.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} scans ({engine.name} engine).'))
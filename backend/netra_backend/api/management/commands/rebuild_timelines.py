@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.models import RetinalScan
+from api.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute PatientTimeline rows from the stored scans, e.g. after importing '
+        'or bulk-editing scans outside the API.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('patient_ids', nargs='*', type=int, help='Only these patients (default: all).')
+
+    def handle(self, *args, **options):
+        patient_ids = options['patient_ids'] or (
+            RetinalScan.objects.order_by('patient_id').values_list('patient_id', flat=True).distinct().iterator()
+        )
+        count = 0
+        for patient_id in patient_ids:
+            rebuild_timeline(patient_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} patient timelines.'))
@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.inference import get_backend
+from api.model_loader import decode_array
+from api.models import RetinalScan, ScanImage
+from api.tiering import stored_path
+from api.timeline import rebuild_timeline
+from api.worklist import refresh_grades
+
+UPDATE_FIELDS = {
+    'left': ('left_eye_prediction', 'left_eye_prediction_class'),
+    'right': ('right_eye_prediction', 'right_eye_prediction_class'),
+}
+
+
+def _decode(source):
+    """Worker entry point; a missing or corrupt file yields None instead of failing the chunk."""
+    try:
+        return decode_array(source)
+    except Exception:
+        return None
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-run inference over every stored ScanImage with the configured backend '
+        'and write the predictions (and model version) back to RetinalScan. '
+        'Images are decoded in a process pool a bounded window ahead of the model '
+        'and dropped once scored; progress is checkpointed so an interrupted run resumes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Decode processes; 0 decodes in this process.')
+        parser.add_argument('--batch-size', type=int, default=32, help='Images per inference call.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Scans per decode round, bulk_update and checkpoint.')
+        parser.add_argument('--checkpoint', default='rescore_checkpoint.json')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+        parser.add_argument('--stale-only', action='store_true',
+                            help='Skip scans already scored by the current model version.')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if not backend.ready:
+            raise CommandError(f'Inference backend {backend.name!r} is not ready.')
+        self.backend = backend
+        self.batch_size = options['batch_size']
+        self.workers = options['workers']
+        self.storage = ScanImage._meta.get_field('image').storage
+
+        state = self._load_checkpoint(options['checkpoint'], options['restart'])
+        scans = RetinalScan.objects.filter(id__gt=state['last_scan_id'])
+        if options['stale_only']:
+            scans = scans.exclude(model_version=backend.version)
+        scan_ids = scans.order_by('id').values_list('id', flat=True).iterator(chunk_size=options['chunk_size'])
+
+        pool = ProcessPoolExecutor(options['workers']) if options['workers'] > 0 else None
+        # Decoded full-resolution arrays held at once: the in-flight window plus one batch.
+        self.window = max(self.batch_size, 2 * options['workers'])
+        started = time.perf_counter()
+        try:
+            for chunk in _chunks(scan_ids, options['chunk_size']):
+                self._rescore(pool, chunk, state, options['checkpoint'], started)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        state['completed'] = True
+        self._save_checkpoint(options['checkpoint'], state)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rescored {state['scans']} scans ({state['images']} images, {state['failed']} failed) "
+            f"with {backend.version}."
+        ))
+
+    def _load_checkpoint(self, path, restart):
+        fresh = {'model_version': self.backend.version, 'last_scan_id': 0,
+                 'scans': 0, 'images': 0, 'failed': 0, 'completed': False}
+        if restart or not os.path.exists(path):
+            return fresh
+        with open(path) as fh:
+            state = json.load(fh)
+        if state.get('model_version') != self.backend.version:
+            self.stdout.write(self.style.WARNING(
+                f"Checkpoint was written for {state.get('model_version')}; starting over."
+            ))
+            return fresh
+        self.stdout.write(f"Resuming after scan {state['last_scan_id']}.")
+        return state
+
+    def _save_checkpoint(self, path, state):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(state, fh)
+        os.replace(tmp, path)
+
+    def _source(self, name, storage_tier, cold_name):
+        try:
+            return stored_path(name, storage_tier, cold_name)
+        except NotImplementedError:
+            with self.storage.open(name) as fh:
+                return fh.read()
+
+    def _decoded(self, pool, names, sources):
+        """Yield ``(name, array)`` in order, with at most ``self.window`` decodes in flight."""
+        if pool is None:
+            for name, source in zip(names, sources):
+                yield name, _decode(source)
+            return
+        in_flight = deque()
+        for name, source in zip(names, sources):
+            in_flight.append((name, pool.submit(_decode, source)))
+            if len(in_flight) >= self.window:
+                done, future = in_flight.popleft()
+                yield done, future.result()
+        while in_flight:
+            done, future = in_flight.popleft()
+            yield done, future.result()
+
+    def _predict(self, batch, results):
+        names = [name for name, _ in batch]
+        results.update(zip(names, self.backend.predict_batch([array for _, array in batch])))
+
+    def _rescore(self, pool, chunk, state, checkpoint, started):
+        rows = list(
+            ScanImage.objects.filter(scan_id__in=chunk, eye_side__in=UPDATE_FIELDS)
+            .order_by('id').values_list('scan_id', 'eye_side', 'image', 'storage_tier', 'cold_name')
+        )
+        images = [(scan_id, side, name) for scan_id, side, name, _, _ in rows]
+        # Files shared between rows (re-uploads, seeded data) are decoded and scored once.
+        locations = {name: (tier, cold_name) for _, _, name, tier, cold_name in rows}
+        names = list(locations)
+        sources = (self._source(name, *locations[name]) for name in names)
+
+        results = {}
+        batch = []
+        for name, array in self._decoded(pool, names, sources):
+            if array is not None:
+                batch.append((name, array))
+            if len(batch) == self.batch_size:
+                self._predict(batch, results)
+                batch = []
+        if batch:
+            self._predict(batch, results)
+
+        scans = RetinalScan.objects.in_bulk(chunk)
+        scored, failed = set(), set()
+        for scan_id, side, name in images:
+            scan = scans[scan_id]
+            result = results.get(name)
+            if result is None:
+                failed.add(scan_id)
+                state['failed'] += 1
+                continue
+            prediction_field, class_field = UPDATE_FIELDS[side]
+            setattr(scan, prediction_field, result['prediction'])
+            setattr(scan, class_field, result['prediction_class'])
+            scan.ai_details = {**(scan.ai_details or {}), f'{side}_eye': result}
+            scored.add(scan_id)
+            state['images'] += 1
+
+        # Scans without a scored image keep the model_version they had.
+        updated = [scans[scan_id] for scan_id in sorted(scored - failed)]
+        for scan in updated:
+            scan.model_version = self.backend.version
+        with transaction.atomic():
+            RetinalScan.objects.bulk_update(
+                updated,
+                ['left_eye_prediction', 'left_eye_prediction_class', 'right_eye_prediction',
+                 'right_eye_prediction_class', 'ai_details', 'model_version'],
+            )
+            for patient_id in {scan.patient_id for scan in updated}:
+                rebuild_timeline(patient_id)
+            refresh_grades(updated)
+
+        state['scans'] += len(updated)
+        state['last_scan_id'] = chunk[-1]
+        self._save_checkpoint(checkpoint, state)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"scan {state['last_scan_id']}: {state['scans']} scans, {state['images']} images "
+            f"({state['images'] / elapsed:.1f} images/s), {state['failed']} failed"
+        )
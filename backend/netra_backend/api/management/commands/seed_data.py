@@ -0,0 +1,137 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.benchmarking import synthetic_fundus
+from api.model_loader import LABELS
+from api.models import DoctorNote, PatientDoctorSubscription, RetinalScan, ScanImage, User
+from api.search import rebuild_index
+from api.worklist import enqueue_scans
+
+PREFIX = 'bench'
+DEFAULT_PASSWORD = 'bench-password'
+
+NOTE_SNIPPETS = [
+    'Microaneurysms noted in the inferior temporal quadrant.',
+    'Hard exudates near the macula, recommend OCT.',
+    'No change since previous visit.',
+    'Neovascularization at the disc, refer to retina specialist.',
+    'Dot and blot hemorrhages present bilaterally.',
+    'Follow up in 12 months.',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed the database with benchmark users (bench_*), subscriptions, scans, '
+        'images and doctor notes. All seeded users share --password.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--doctors', type=int, default=20)
+        parser.add_argument('--nurses', type=int, default=10)
+        parser.add_argument('--subscriptions-per-patient', type=int, default=2)
+        parser.add_argument('--scans-per-patient', type=int, default=5)
+        parser.add_argument('--notes-per-scan', type=int, default=1)
+        parser.add_argument('--distinct-images', type=int, default=8,
+                            help='Image files generated and shared between ScanImage rows.')
+        parser.add_argument('--image-size', default='1024x768')
+        parser.add_argument('--password', default=DEFAULT_PASSWORD)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        password = make_password(options['password'])
+
+        with transaction.atomic():
+            admin = self._users('admin', 1, password)[0]
+            doctors = self._users('doctor', options['doctors'], password)
+            nurses = self._users('nurse', options['nurses'], password)
+            patients = self._users('patient', options['patients'], password)
+
+            subscriptions = []
+            assigned = {}
+            for patient in patients:
+                chosen = rng.sample(doctors, min(options['subscriptions_per_patient'], len(doctors)))
+                assigned[patient.id] = chosen
+                subscriptions += [PatientDoctorSubscription(patient=patient, doctor=d) for d in chosen]
+            PatientDoctorSubscription.objects.bulk_create(
+                subscriptions, batch_size=batch_size, ignore_conflicts=True,
+            )
+
+            now = timezone.now()
+            scans = []
+            for patient in patients:
+                for _ in range(options['scans_per_patient']):
+                    left, right = rng.randint(0, 4), rng.randint(0, 4)
+                    scans.append(RetinalScan(
+                        patient=patient,
+                        nurse=rng.choice(nurses) if nurses else None,
+                        doctor=rng.choice(assigned[patient.id]) if assigned[patient.id] else None,
+                        left_eye_prediction=LABELS[left], left_eye_prediction_class=left,
+                        right_eye_prediction=LABELS[right], right_eye_prediction_class=right,
+                        ai_details={'left_eye': {'prediction': LABELS[left], 'prediction_class': left},
+                                    'right_eye': {'prediction': LABELS[right], 'prediction_class': right}},
+                        priority=rng.choice(['low', 'medium', 'medium', 'high', 'urgent']),
+                        status=rng.choice(['pending', 'pending', 'reviewed', 'completed']),
+                        patient_age=rng.randint(25, 85),
+                        patient_diabetes_duration=rng.randint(0, 30),
+                    ))
+            scans = RetinalScan.objects.bulk_create(scans, batch_size=batch_size)
+            # auto_now_add ignores explicit values, so spread the history afterwards.
+            for scan in scans:
+                scan.created_at = now - timedelta(days=rng.randint(0, 720), minutes=rng.randint(0, 1440))
+            RetinalScan.objects.bulk_update(scans, ['created_at'], batch_size=batch_size)
+            enqueue_scans(scans, batch_size=batch_size)
+
+            image_names = self._image_files(options)
+            images = []
+            for scan in scans:
+                for side in ('left', 'right'):
+                    images.append(ScanImage(scan=scan, image=rng.choice(image_names), eye_side=side))
+            ScanImage.objects.bulk_create(images, batch_size=batch_size)
+
+            notes = []
+            for scan in scans:
+                if scan.doctor_id is None:
+                    continue
+                for _ in range(options['notes_per_scan']):
+                    notes.append(DoctorNote(scan=scan, doctor_id=scan.doctor_id, note_text=rng.choice(NOTE_SNIPPETS)))
+            DoctorNote.objects.bulk_create(notes, batch_size=batch_size)
+            rebuild_index()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded 1 admin ({admin.username}), {len(doctors)} doctors, {len(nurses)} nurses, '
+            f'{len(patients)} patients, {len(subscriptions)} subscriptions, {len(scans)} scans, '
+            f'{len(images)} images, {len(notes)} notes.'
+        ))
+
+    def _users(self, role, count, password):
+        """Create (or reuse) ``count`` users named bench_<role>_<n>."""
+        names = [f'{PREFIX}_{role}_{i}' for i in range(count)]
+        existing = set(User.objects.filter(username__in=names).values_list('username', flat=True))
+        User.objects.bulk_create([
+            User(username=name, email=f'{name}@example.com', full_name=f'{role.title()} {name.rsplit("_", 1)[-1]}',
+                 role=role, password=password)
+            for name in names if name not in existing
+        ])
+        return list(User.objects.filter(username__in=names).order_by('id'))
+
+    def _image_files(self, options):
+        width, height = (int(v) for v in options['image_size'].split('x'))
+        names = []
+        for i in range(options['distinct_images']):
+            name = f'retina_scans/{PREFIX}_{i}_{width}x{height}.png'
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(synthetic_fundus(options['seed'] + i, (width, height))))
+            names.append(name)
+        return names
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.tiering import tier_images
+
+
+class Command(BaseCommand):
+    help = (
+        'Move originals of old scans from MEDIA_ROOT to COLD_STORAGE_ROOT, recompressing them '
+        'losslessly where that saves space. Previews stay hot, and viewing an original restores it '
+        'automatically. Safe to run from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int,
+                            help='Only images whose newest scan is older than this (default: TIERING_AFTER_DAYS).')
+        parser.add_argument('--limit', type=int, help='Move at most this many files.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved.')
+
+    def handle(self, *args, **options):
+        result = tier_images(options['older_than_days'], options['limit'], options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(
+                f'{result.files} files ({result.bytes_before / 1024 / 1024:.1f} MB) would be moved, '
+                f'{result.skipped} skipped, {result.failed} missing.'
+            )
+            return
+        saved = result.bytes_before - result.bytes_after
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {result.files} files to cold storage ({result.bytes_before / 1024 / 1024:.1f} MB, '
+            f'{saved / 1024 / 1024:.1f} MB saved by recompression); {result.skipped} skipped, {result.failed} failed.'
+        ))
@@ -0,0 +1,82 @@
+import statistics
+import time
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarking import report_metadata, write_report
+
+
+class Command(BaseCommand):
+    help = (
+        'Time Argon2id over a grid of memory/time costs on this machine and '
+        'recommend the strongest parameters that hash within the target latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=150.0,
+                            help='Maximum median time for one hash.')
+        parser.add_argument('--memory-costs', default='19456,32768,47104,65536,131072',
+                            help='Comma-separated memory costs in KiB.')
+        parser.add_argument('--time-costs', default='1,2,3,4')
+        parser.add_argument('--parallelism', type=int, default=1)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--output', help='Write the JSON report to this path.')
+
+    def handle(self, *args, **options):
+        try:
+            from argon2.low_level import Type, hash_secret_raw
+        except ImportError:
+            raise CommandError('argon2-cffi is not installed (pip install argon2-cffi).')
+
+        def time_hash(fn):
+            samples = []
+            for _ in range(options['rounds']):
+                started = time.perf_counter()
+                fn()
+                samples.append(time.perf_counter() - started)
+            return statistics.median(samples) * 1000
+
+        pbkdf2 = PBKDF2PasswordHasher()
+        pbkdf2_ms = time_hash(lambda: pbkdf2.encode('correct horse battery', pbkdf2.salt()))
+        self.stdout.write(f'PBKDF2 ({pbkdf2.iterations} iterations): {pbkdf2_ms:.1f} ms')
+
+        results = []
+        for memory_cost in (int(v) for v in options['memory_costs'].split(',')):
+            for time_cost in (int(v) for v in options['time_costs'].split(',')):
+                median_ms = time_hash(lambda: hash_secret_raw(
+                    b'correct horse battery', b'0123456789abcdef',
+                    time_cost=time_cost, memory_cost=memory_cost,
+                    parallelism=options['parallelism'], hash_len=32, type=Type.ID,
+                ))
+                results.append({
+                    'memory_cost': memory_cost,
+                    'time_cost': time_cost,
+                    'parallelism': options['parallelism'],
+                    'median_ms': round(median_ms, 2),
+                })
+                self.stdout.write(f'm={memory_cost:>7} KiB t={time_cost} p={options["parallelism"]}: {median_ms:.1f} ms')
+
+        # Strongest = most total memory passes (m * t) within the budget.
+        within = [r for r in results if r['median_ms'] <= options['target_ms']]
+        best = max(within, key=lambda r: (r['memory_cost'] * r['time_cost'], r['memory_cost']), default=None)
+
+        report = {
+            'meta': report_metadata(),
+            'target_ms': options['target_ms'],
+            'pbkdf2_ms': round(pbkdf2_ms, 2),
+            'argon2': results,
+            'recommended': best,
+        }
+        if options['output']:
+            write_report(options['output'], report)
+
+        if best is None:
+            self.stdout.write(self.style.WARNING('No parameters fit the target; raise --target-ms.'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            '\nRecommended settings:\n'
+            f"NETRA_ARGON2_MEMORY_COST={best['memory_cost']}\n"
+            f"NETRA_ARGON2_TIME_COST={best['time_cost']}\n"
+            f"NETRA_ARGON2_PARALLELISM={best['parallelism']}"
+        ))
@@ -0,0 +1,137 @@
+"""
+Garbage collection of orphaned scan image files.
+
+Deleting scans only removes database rows (see ``api/purge.py``). This
+collector walks the scan image directories with ``os.scandir``, one directory
+at a time and without building a full listing. It checks files against
+``ScanImage`` in batches of ``batch_size`` names and removes those no row
+refers to:
+
+- originals under the ``ScanImage.image`` upload directory. Seeded scans share
+  files, so a file is kept as long as any row still names it.
+- preview renditions under ``derivatives/``, kept while a ``ScanImage``
+  names the original they were rendered from.
+- cold copies under ``COLD_STORAGE_ROOT`` (see ``api/tiering.py``), kept
+  while a row's ``cold_name`` points at them.
+
+Files modified within the grace period (``MEDIA_GC_GRACE_PERIOD``) are never
+touched, because an upload writes its file before the ``ScanImage`` row
+commits. Run it on a schedule (cron/systemd timer); ``--dry-run`` only reports.
+"""
+import logging
+import os
+import time
+from dataclasses import dataclass, fields
+
+from django.conf import settings
+
+from .image_derivatives import DERIVATIVE_ROOT
+from .models import ScanImage
+from .tiering import cold_storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class GCResult:
+    scanned: int = 0
+    recent: int = 0
+    orphaned: int = 0
+    orphaned_bytes: int = 0
+    deleted: int = 0
+    bytes_reclaimed: int = 0
+
+    def as_dict(self):
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+
+def walk_files(root):
+    """Yield ``os.DirEntry`` objects for every file below ``root``, depth first."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+def _referenced_originals(names):
+    return set(ScanImage.objects.filter(image__in=names).values_list('image', flat=True))
+
+
+def _referenced_cold(names):
+    return set(ScanImage.objects.filter(cold_name__in=names).values_list('cold_name', flat=True))
+
+
+class MediaGarbageCollector:
+    def __init__(self, grace_period=None, batch_size=200, dry_run=False):
+        self.storage = ScanImage._meta.get_field('image').storage
+        self.grace_period = (
+            grace_period if grace_period is not None else getattr(settings, 'MEDIA_GC_GRACE_PERIOD', 24 * 3600)
+        )
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+    def run(self):
+        cutoff = time.time() - self.grace_period
+        result = GCResult()
+        upload_to = ScanImage._meta.get_field('image').upload_to.strip('/')
+        self._collect(self.storage, upload_to, lambda name: name, _referenced_originals, cutoff, result)
+
+        for rendition_dir in self._listdir(DERIVATIVE_ROOT):
+            prefix = f'{DERIVATIVE_ROOT}/{rendition_dir}/'
+            self._collect(
+                self.storage, f'{prefix}{upload_to}', lambda name: os.path.splitext(name[len(prefix):])[0],
+                _referenced_originals, cutoff, result,
+            )
+
+        self._collect(cold_storage(), upload_to, lambda name: name, _referenced_cold, cutoff, result)
+        logger.info("Media garbage collection finished", extra={'fields': {
+            **result.as_dict(), 'dry_run': self.dry_run,
+        }})
+        return result
+
+    def _listdir(self, name):
+        try:
+            return [entry.name for entry in os.scandir(self.storage.path(name)) if entry.is_dir()]
+        except FileNotFoundError:
+            return []
+
+    def _collect(self, storage, directory, key, referenced, cutoff, result):
+        """Sweep ``directory``; ``key`` maps a storage name to what ``referenced`` checks."""
+        root = storage.path('')
+        batch = []
+        for entry in walk_files(storage.path(directory)):
+            result.scanned += 1
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > cutoff:
+                result.recent += 1
+                continue
+            name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+            batch.append((name, entry.path, stat.st_size))
+            if len(batch) >= self.batch_size:
+                self._sweep(batch, key, referenced, result)
+                batch = []
+        if batch:
+            self._sweep(batch, key, referenced, result)
+
+    def _sweep(self, batch, key, referenced, result):
+        kept = referenced({key(name) for name, _, _ in batch})
+        for name, path, size in batch:
+            if key(name) in kept:
+                continue
+            result.orphaned += 1
+            result.orphaned_bytes += size
+            if self.dry_run:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            result.deleted += 1
+            result.bytes_reclaimed += size
@@ -0,0 +1,158 @@
+"""
+Permission-checked delivery of scan image files.
+
+Django only decides *whether* a file may be served. The bytes are sent by the
+front server: nginx via ``X-Accel-Redirect`` or Apache/lighttpd via
+``X-Sendfile`` (both also answer HTTP Range requests themselves). The
+``django`` backend is meant for development and serves the file in-process.
+
+Stored names are never reused for different content, so a URL carrying the
+name's version token (``?v=``) can be cached as immutable. Clients revalidate
+anything else against a strong ETag.
+
+Signed ``?u=&access=`` URLs (for ``<img src>``) expire after
+``MEDIA_ACCESS_MAX_AGE`` seconds. Their timestamps are rounded down to half
+that, so a URL stays the same, and cacheable, for that long.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
+from django.utils.http import http_date, parse_etags, urlencode
+
+from .image_derivatives import derivative_name
+
+ACCESS_SALT = 'api.media_serving.access'
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def version_token(name):
+    """Short, stable token identifying the content behind a storage name."""
+    return hashlib.sha1(name.encode()).hexdigest()[:12]
+
+
+def access_max_age():
+    return getattr(settings, 'MEDIA_ACCESS_MAX_AGE', 3600)
+
+
+class AccessSigner(signing.TimestampSigner):
+    def timestamp(self):
+        window = max(1, access_max_age() // 2)
+        return signing.b62_encode(int(time.time()) // window * window)
+
+
+def access_token(user, scan_image):
+    """Expiring signature letting ``user`` fetch ``scan_image`` without an auth header (e.g. ``<img src>``)."""
+    return AccessSigner(salt=ACCESS_SALT).sign(f'{user.pk}:{scan_image.pk}').split(':', 2)[-1]
+
+
+def is_valid_access_token(token, user_id, scan_image_id):
+    """True if ``token`` was issued by ``access_token`` for this user and image and has not expired."""
+    try:
+        AccessSigner(salt=ACCESS_SALT).unsign(f'{user_id}:{scan_image_id}:{token}', max_age=access_max_age())
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def file_url(request, scan_image, rendition=None):
+    """Absolute URL of the protected file endpoint for ``scan_image``."""
+    name = scan_image.image.name
+    # Versioned by the name actually served, as serve_protected_file checks it.
+    params = {'v': version_token(derivative_name(name, rendition) if rendition else name)}
+    if rendition:
+        params['rendition'] = rendition
+    user = getattr(request, 'user', None) if request else None
+    if user is not None and user.is_authenticated:
+        params['u'] = user.pk
+        params['access'] = access_token(user, scan_image)
+    url = f"{reverse('scan_image_file', args=[scan_image.pk])}?{urlencode(params)}"
+    return request.build_absolute_uri(url) if request else url
+
+
+def _etag(name, stat):
+    digest = hashlib.sha1(f'{name}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def _parse_range(header, size):
+    """Single byte range as ``(start, end)`` inclusive, or None if unusable."""
+    match = _RANGE_RE.match(header or '')
+    if not match or size == 0:
+        return None
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+    if start == '':
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def _serve_in_process(request, path, size, response_headers):
+    byte_range = _parse_range(request.headers.get('Range'), size)
+    if byte_range is None:
+        # FileResponse hands the file to wsgi.file_wrapper (sendfile under gunicorn).
+        response = FileResponse(open(path, 'rb'))
+    else:
+        start, end = byte_range
+        with open(path, 'rb') as fh:
+            fh.seek(start)
+            response = HttpResponse(fh.read(end - start + 1), status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    for key, value in response_headers.items():
+        response[key] = value
+    return response
+
+
+def serve_protected_file(request, storage, name):
+    """Build the response for a stored file the caller has already been authorized for."""
+    path = storage.path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return HttpResponse(status=404)
+
+    etag = _etag(name, stat)
+    immutable = request.GET.get('v') == version_token(name)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+        'Content-Type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponse(status=304)
+        for key in ('ETag', 'Last-Modified', 'Cache-Control'):
+            response[key] = headers[key]
+        return response
+
+    backend = getattr(settings, 'MEDIA_SENDFILE_BACKEND', 'django')
+    if backend == 'nginx':
+        response = HttpResponse()
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + name
+    elif backend in ('apache', 'lighttpd'):
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+    else:
+        return _serve_in_process(request, path, stat.st_size, headers)
+
+    for key, value in headers.items():
+        response[key] = value
+    return response
@@ -0,0 +1,209 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Counters and histograms are kept per worker process and exposed by the
+``metrics/`` endpoint. Scrape every worker (or run a single-worker metrics
+sidecar) to aggregate across processes.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(labels[name] for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts, sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, n) for key, (counts, total, n) in self._values.items()]
+        lines = []
+        for key, counts, total, n in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames + ('le',), key + (repr(float(bound)),))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labelnames + ('le',), key + ('+Inf',))
+            lines.append(f'{self.name}_bucket{labels} {n}')
+            plain = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{plain} {total}')
+            lines.append(f'{self.name}_count{plain} {n}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# ----- Inference -----
+INFERENCE_STAGE_SECONDS = registry.histogram(
+    'netra_inference_stage_seconds',
+    'Time spent per inference stage.',
+    ['stage'],
+)
+INFERENCE_BATCH_SIZE = registry.histogram(
+    'netra_inference_batch_size',
+    'Number of images per model forward pass.',
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+INFERENCE_QUEUE_WAIT_SECONDS = registry.histogram(
+    'netra_inference_queue_wait_seconds',
+    'Time a request waited for an inference slot.',
+    ['lane'],
+)
+ADMISSION_REJECTIONS_TOTAL = registry.counter(
+    'netra_admission_rejections_total',
+    'Inference requests turned away, by lane and reason (queue_full/timeout/rate_limited).',
+    ['lane', 'reason'],
+)
+PREDICTIONS_TOTAL = registry.counter(
+    'netra_predictions_total',
+    'Predictions returned, by predicted label.',
+    ['label'],
+)
+INFERENCE_ERRORS_TOTAL = registry.counter(
+    'netra_inference_errors_total',
+    'Inference calls that raised.',
+    ['stage'],
+)
+SHADOW_PREDICTIONS_TOTAL = registry.counter(
+    'netra_shadow_predictions_total',
+    'Shadow model predictions by outcome (agree/disagree/error/skipped).',
+    ['result'],
+)
+INFERENCE_OOM_TOTAL = registry.counter(
+    'netra_inference_oom_total',
+    'Batches that ran out of device memory and were retried smaller, by device.',
+    ['device'],
+)
+MODEL_SWAPS_TOTAL = registry.counter(
+    'netra_model_swaps_total',
+    'Active model replacements, by the version swapped in.',
+    ['version'],
+)
+
+# ----- Storage -----
+STORAGE_TIER_MOVES_TOTAL = registry.counter(
+    'netra_storage_tier_moves_total',
+    'Scan image files moved between storage tiers, by destination (cold/hot).',
+    ['tier'],
+)
+STORAGE_TIER_BYTES_SAVED_TOTAL = registry.counter(
+    'netra_storage_tier_bytes_saved_total',
+    'Bytes saved by recompressing originals on their way to cold storage.',
+)
+
+# ----- Caches -----
+CACHE_REQUESTS_TOTAL = registry.counter(
+    'netra_cache_requests_total',
+    'Cache lookups by cache and result (hit/miss).',
+    ['cache', 'result'],
+)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS_TOTAL.inc(cache=cache, result='hit' if hit else 'miss')
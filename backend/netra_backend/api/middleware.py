@@ -0,0 +1,167 @@
+"""
+Opt-in request profiling.
+
+With ``REQUEST_PROFILING_ENABLED`` every request records its wall time, DB
+query count and time, view time not spent in the DB (mostly serialization),
+render time and response size; these are returned in a ``Server-Timing``
+header. A ``REQUEST_PROFILING_SAMPLE_RATE`` fraction of requests also runs
+under a profiler. The slowest profiled requests per endpoint are kept in
+memory for the admin ``admin/profiles/`` endpoint.
+
+When profiling is disabled the middleware removes itself at startup
+(``MiddlewareNotUsed``), so it costs nothing.
+"""
+import cProfile
+import heapq
+import io
+import itertools
+import pstats
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:
+    PyinstrumentProfiler = None
+
+
+class ProfileStore:
+    """Keeps the ``keep`` slowest sampled requests for each endpoint."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self._samples = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, record):
+        entry = (record['wall_ms'], next(self._counter), record)
+        with self._lock:
+            heap = self._samples.setdefault(endpoint, [])
+            if len(heap) < self.keep:
+                heapq.heappush(heap, entry)
+            elif entry[0] > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: [record for _, _, record in sorted(heap, reverse=True)]
+                for endpoint, heap in self._samples.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+profile_store = ProfileStore(getattr(settings, 'REQUEST_PROFILING_KEEP', 10))
+
+
+class _QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class _Profiler:
+    """cProfile by default, pyinstrument if installed and selected."""
+
+    def __init__(self, kind):
+        self.kind = 'pyinstrument' if kind == 'pyinstrument' and PyinstrumentProfiler else 'cprofile'
+        self._profiler = PyinstrumentProfiler() if self.kind == 'pyinstrument' else cProfile.Profile()
+
+    def start(self):
+        if self.kind == 'pyinstrument':
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self.kind == 'pyinstrument':
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def report(self, limit=40):
+        if self.kind == 'pyinstrument':
+            return self._profiler.output_text(unicode=False, color=False)
+        out = io.StringIO()
+        pstats.Stats(self._profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+
+class RequestProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 0.0)
+        self.profiler_kind = getattr(settings, 'REQUEST_PROFILER', 'cprofile')
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        profiler = None
+        if self.sample_rate and random.random() < self.sample_rate:
+            profiler = _Profiler(self.profiler_kind)
+            try:
+                profiler.start()
+            except ValueError:
+                # Another profiler is already active on this thread.
+                profiler = None
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        finished = time.perf_counter()
+
+        if profiler is not None:
+            profiler.stop()
+
+        view_done = getattr(request, '_profiling_view_done', finished)
+        wall = finished - started
+        view = view_done - started
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'wall_ms': round(wall * 1000, 3),
+            'db_queries': timer.count,
+            'db_ms': round(timer.seconds * 1000, 3),
+            'serialization_ms': round(max(0.0, view - timer.seconds) * 1000, 3),
+            'render_ms': round((finished - view_done) * 1000, 3),
+            'response_bytes': len(response.content) if not response.streaming else None,
+        }
+        response['Server-Timing'] = (
+            f"db;dur={record['db_ms']}, app;dur={record['serialization_ms']}, "
+            f"render;dur={record['render_ms']}, total;dur={record['wall_ms']}"
+        )
+
+        if profiler is not None:
+            match = request.resolver_match
+            endpoint = f"{request.method} {match.route if match else request.path}"
+            record['profiler'] = profiler.kind
+            record['profile'] = profiler.report()
+            profile_store.add(endpoint, record)
+        return response
+
+    def process_template_response(self, request, response):
+        # Called after the view returns and before DRF renders the response.
+        request._profiling_view_done = time.perf_counter()
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-19 01:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_add_admin_role'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='retinalscan',
+            name='model_version',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-19 01:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_retinalscan_model_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientTimeline',
+            fields=[
+                ('patient', models.OneToOneField(limit_choices_to={'role': 'patient'}, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='timeline', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_scan_at', models.DateTimeField(blank=True, null=True)),
+                ('previous_scan_at', models.DateTimeField(blank=True, null=True)),
+                ('scan_count', models.IntegerField(default=0)),
+                ('left_grade', models.IntegerField(blank=True, null=True)),
+                ('left_grade_delta', models.IntegerField(blank=True, null=True)),
+                ('right_grade', models.IntegerField(blank=True, null=True)),
+                ('right_grade_delta', models.IntegerField(blank=True, null=True)),
+                ('progressed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_scan', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.retinalscan')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['progressed', '-last_scan_at'], name='timeline_progressed_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.2 on 2026-10-19 01:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+PRIORITY_RANKS = {'low': 0, 'medium': 1, 'high': 2, 'urgent': 3}
+
+
+def enqueue_pending_scans(apps, schema_editor):
+    RetinalScan = apps.get_model('api', 'RetinalScan')
+    WorklistItem = apps.get_model('api', 'WorklistItem')
+    pending = RetinalScan.objects.filter(status='pending', doctor__isnull=False).values_list(
+        'id', 'doctor_id', 'priority', 'left_eye_prediction_class', 'right_eye_prediction_class', 'created_at',
+    )
+    items = []
+    for scan_id, doctor_id, priority, left, right, created_at in pending.iterator():
+        grades = [grade for grade in (left, right) if grade is not None]
+        items.append(WorklistItem(
+            scan_id=scan_id, doctor_id=doctor_id, priority_rank=PRIORITY_RANKS.get(priority, 1),
+            grade=max(grades, default=-1), queued_at=created_at,
+        ))
+        if len(items) >= 1000:
+            WorklistItem.objects.bulk_create(items)
+            items = []
+    WorklistItem.objects.bulk_create(items)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_patienttimeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorklistItem',
+            fields=[
+                ('scan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='worklist_item', serialize=False, to='api.retinalscan')),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('claimed', 'Claimed')], default='queued', max_length=10)),
+                ('priority_rank', models.SmallIntegerField()),
+                ('grade', models.SmallIntegerField()),
+                ('queued_at', models.DateTimeField()),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('doctor', models.ForeignKey(limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, related_name='worklist', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', 'state', '-priority_rank', '-grade', 'queued_at'], name='worklist_next_idx')],
+            },
+        ),
+        migrations.RunPython(enqueue_pending_scans, migrations.RunPython.noop),
+    ]
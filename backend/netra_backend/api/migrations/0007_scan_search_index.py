@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Mirrors api/search.py (FTS5SearchEngine); only created on SQLite builds with
+# FTS5. Other databases use the 'basic' search engine.
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE api_scan_search USING fts5(
+    patient_name, patient_username, notes,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+POPULATE_INDEX = """
+INSERT INTO api_scan_search (rowid, patient_name, patient_username, notes)
+SELECT s.id, u.full_name, u.username,
+       COALESCE((SELECT group_concat(n.note_text, ' ') FROM api_doctornote n WHERE n.scan_id = s.id), '')
+FROM api_retinalscan s JOIN api_user u ON u.id = s.patient_id
+"""
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(CREATE_INDEX)
+        except OperationalError:
+            return  # SQLite compiled without FTS5
+        cursor.execute(POPULATE_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS api_scan_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_worklistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-19 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_scan_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanimage',
+            name='cold_name',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='scanimage',
+            name='storage_tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('cold', 'Cold')], default='hot', max_length=10),
+        ),
+    ]
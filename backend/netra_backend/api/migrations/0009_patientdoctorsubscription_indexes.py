@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-19 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_scanimage_storage_tier'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patientdoctorsubscription',
+            index=models.Index(fields=['doctor', 'is_active'], name='subscription_doctor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientdoctorsubscription',
+            index=models.Index(fields=['patient', 'is_active'], name='subscription_patient_idx'),
+        ),
+    ]
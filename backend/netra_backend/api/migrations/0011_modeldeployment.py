@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-19 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_ratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelDeployment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('active', models.JSONField(blank=True, null=True)),
+                ('shadow', models.JSONField(blank=True, null=True)),
+                ('revision', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.1.2 on 2026-10-19 02:34
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_modeldeployment'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='RateLimitBucket',
+        ),
+    ]
@@ -1,17 +1,28 @@
-import random
+"""
+Model loading, preprocessing and prediction for the eager PyTorch backend.
+
+torch, timm and numpy are imported inside the functions that use them, never
+at module level. Web processes and management commands that only touch the
+database (or predict through the ``remote``/``stub`` backends) therefore
+never pay for importing the ML stack; the first inference-path call does,
+once. ``TORCH_AVAILABLE`` is answered from the import system without
+importing anything.
+"""
+import importlib.util
+import logging
 import os
+import threading
 import time
+from io import BytesIO
 
-try:
-    import torch
-    import torch.nn as nn
-    from PIL import Image
-    import timm
-    import numpy as np
-    TORCH_AVAILABLE = True
-except ImportError:
-    TORCH_AVAILABLE = False
-    print("⚠️  PyTorch not installed. Using mock predictions for demo.")
+from django.conf import settings
+
+from .image_validation import open_for_inference
+from .metrics import INFERENCE_BATCH_SIZE, INFERENCE_ERRORS_TOTAL, INFERENCE_STAGE_SECONDS, PREDICTIONS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+TORCH_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ('torch', 'timm'))
 
 # ----- SETTINGS -----
 IMG_SIZE = 224
@@ -24,34 +35,60 @@ LABELS = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
 # If your training used a different order, update LABELS accordingly
 # Some datasets use reverse order: [4=Proliferative, 3=Severe, 2=Moderate, 1=Mild, 0=No DR]
 
-if TORCH_AVAILABLE:
-    DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-else:
-    DEVICE = None
+# Predictions below this softmax confidence are flagged in the logs.
+LOW_CONFIDENCE_THRESHOLD = 0.70
+
+_device = None
+_device_lock = threading.Lock()
+
+
+def get_device():
+    """The torch device models run on (CUDA when available), or None without PyTorch."""
+    global _device
+    if _device is None and TORCH_AVAILABLE:
+        with _device_lock:
+            if _device is None:
+                import torch
+
+                _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    return _device
+
+
+def debug_tensors_enabled():
+    """Per-tensor dumps are expensive to format; only produce them when asked."""
+    return getattr(settings, 'INFERENCE_DEBUG', False) and logger.isEnabledFor(logging.DEBUG)
 
 
 # ----- LOAD MODEL -----
-def load_model():
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(__file__), "netra_dr_best.pth")
+
+
+def load_model(model_path=None, device=None):
     """
-    Loads the trained PyTorch model from netra_dr_best.pth.
+    Loads the trained PyTorch model from netra_dr_best.pth (or ``model_path``)
+    onto ``device`` (default ``get_device()``).
     Uses EfficientNet architecture fine-tuned for 5 classes.
     """
     if not TORCH_AVAILABLE:
-        print("⚠️  PyTorch not available. Using mock predictions.")
+        logger.warning("PyTorch not available. Model not loaded.")
         return None
 
     try:
-        model_path = os.path.join(os.path.dirname(__file__), "netra_dr_best.pth")
+        import timm
+        import torch
+
+        device = device or get_device()
+        model_path = model_path or DEFAULT_MODEL_PATH
 
         if not os.path.exists(model_path):
-            print(f"⚠️  Model file not found at {model_path}. Using mock predictions.")
+            logger.warning("Model file not found at %s.", model_path)
             return None
 
-        checkpoint = torch.load(model_path, map_location=DEVICE, weights_only=False)
+        checkpoint = torch.load(model_path, map_location=device, weights_only=False)
 
         # Check if this is a full checkpoint with metadata
         if isinstance(checkpoint, dict):
-            print(f"Checkpoint keys: {checkpoint.keys()}")
+            logger.debug("Checkpoint keys: %s", list(checkpoint.keys()))
             if 'state_dict' in checkpoint:
                 state_dict = checkpoint['state_dict']
             elif 'model_state_dict' in checkpoint:
@@ -64,22 +101,22 @@ def load_model():
             state_dict = checkpoint
 
         first_key = list(state_dict.keys())[0]
-        print(f"First model key: {first_key}")
+        logger.debug("First model key: %s", first_key)
 
         if 'backbone' in first_key:
-            print("Detected EfficientNet architecture with custom wrapper")
+            logger.info("Detected EfficientNet architecture with custom wrapper")
 
             # Check dimensions to determine model variant
             # B3 with width_mult 1.2: conv_stem is 40 channels (vs 32 for standard B0)
             first_weight_shape = state_dict['backbone.conv_stem.weight'].shape
-            print(f"First conv layer shape: {first_weight_shape}")
+            logger.debug("First conv layer shape: %s", tuple(first_weight_shape))
 
             if first_weight_shape[0] == 40:
-                print("Detected EfficientNet-B3 with width multiplier 1.2")
+                logger.info("Detected EfficientNet-B3 with width multiplier 1.2")
                 # This matches tf_efficientnet_b3 which uses width_mult=1.2
                 model = timm.create_model('tf_efficientnet_b3', pretrained=False, num_classes=5)
             else:
-                print("Detected standard EfficientNet-B3")
+                logger.info("Detected standard EfficientNet-B3")
                 model = timm.create_model('efficientnet_b3', pretrained=False, num_classes=5)
 
             # Map the keys from the custom wrapper to timm's structure
@@ -94,25 +131,65 @@ def load_model():
 
             missing_keys, unexpected_keys = model.load_state_dict(new_state_dict, strict=False)
             if missing_keys:
-                print(f"Missing keys (will use random init): {missing_keys[:5]}...")
+                logger.warning("Missing keys (will use random init): %s...", missing_keys[:5])
             if unexpected_keys:
-                print(f"Unexpected keys (ignored): {unexpected_keys[:5]}...")
+                logger.warning("Unexpected keys (ignored): %s...", unexpected_keys[:5])
         else:
-            print("Detected standard architecture, loading directly")
+            logger.info("Detected standard architecture, loading directly")
             model = timm.create_model('efficientnet_b3', pretrained=False, num_classes=5)
             model.load_state_dict(state_dict, strict=False)
 
         model.eval()
-        model.to(DEVICE)
+        model.to(device)
 
-        print(f"✓ Model loaded successfully from {model_path}")
+        logger.info("Model loaded from %s", model_path, extra={'fields': {'device': str(device)}})
         return model
-    except Exception as e:
-        print(f"⚠️  Could not load model: {e}. Using mock predictions.")
+    except Exception:
+        logger.exception("Could not load model.")
         return None
 
 
 # ----- IMAGE PREPROCESSING -----
+def decode_image(image_file):
+    """
+    Decode an uploaded file into an RGB PIL image, validated and downscaled
+    to the inference memory budget first (see image_validation.py).
+    """
+    return open_for_inference(image_file)
+
+
+def decode_array(source):
+    """
+    Decode a file path, bytes or file object into an HxWx3 uint8 array.
+    Needs only PIL and numpy, so it can run in worker processes.
+    """
+    import numpy as np
+
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    return np.asarray(open_for_inference(source))
+
+
+def image_to_tensor(image):
+    """Convert an RGB image to a 1xCxHxW float tensor of raw pixel values."""
+    import numpy as np
+    import torch
+
+    array = np.array(image)
+    return torch.from_numpy(array).permute(2, 0, 1).unsqueeze(0).float()
+
+
+def write_tensor(image, out):
+    """
+    Write an RGB image into ``out``, a preallocated 3xHxW array (e.g. a ring
+    buffer slot, see shm_ring.py), with the values ``image_to_tensor`` gives.
+    """
+    import numpy as np
+
+    np.copyto(out, np.asarray(image).transpose(2, 0, 1), casting='unsafe')
+    return out
+
+
 def preprocess_image(image_file):
     """
     Loads the uploaded image and converts it directly to a tensor without
@@ -121,17 +198,14 @@ def preprocess_image(image_file):
     if not TORCH_AVAILABLE:
         return None
 
-    image = Image.open(image_file).convert("RGB")
-    print(f"Original image size: {image.size}")
-
-    array = np.array(image)
-    tensor = torch.from_numpy(array).permute(2, 0, 1).unsqueeze(0).float()
-    print(f"Raw tensor shape: {tensor.shape}")
+    tensor = image_to_tensor(decode_image(image_file))
+    if debug_tensors_enabled():
+        logger.debug("Raw tensor shape: %s", tuple(tensor.shape))
     return tensor
 
 
 # ----- PREDICTION FUNCTION -----
-def predict_image(model, image_file):
+def predict_image(model, image_file, device=None):
     """
     Runs inference on the uploaded image and returns the predicted class (0-4).
     Model outputs: 0=No DR, 1=Mild, 2=Moderate, 3=Severe, 4=Proliferative DR
@@ -140,41 +214,117 @@ def predict_image(model, image_file):
     if not TORCH_AVAILABLE or model is None:
         raise RuntimeError("Model not available. PyTorch and model file required for predictions.")
 
-    tensor = preprocess_image(image_file).to(DEVICE)
-    attempt = 0
-    start_time = time.time()
+    import torch
+
+    timings = {}
+    stage = 'decode'
+    try:
+        started = time.perf_counter()
+        image = decode_image(image_file)
+        timings['decode'] = time.perf_counter() - started
+
+        stage = 'preprocess'
+        started = time.perf_counter()
+        tensor = image_to_tensor(image).to(device or get_device())
+        timings['preprocess'] = time.perf_counter() - started
 
-    while True:
-        attempt += 1
+        stage = 'forward'
+        started = time.perf_counter()
         with torch.no_grad():
             outputs = model(tensor)
-            print(f"Model raw outputs (attempt {attempt}): {outputs}")
-            print(f"Output shape: {outputs.shape}")
+        timings['forward'] = time.perf_counter() - started
+
+        stage = 'postprocess'
+        started = time.perf_counter()
+        probabilities = torch.nn.functional.softmax(outputs, dim=1)
+        pred_class = int(torch.argmax(outputs, dim=1).item())
+        confidence = probabilities[0][pred_class].item()
+        timings['postprocess'] = time.perf_counter() - started
+    except Exception:
+        INFERENCE_ERRORS_TOTAL.inc(stage=stage)
+        raise
+
+    for name, seconds in timings.items():
+        INFERENCE_STAGE_SECONDS.observe(seconds, stage=name)
+    INFERENCE_BATCH_SIZE.observe(tensor.shape[0])
+    PREDICTIONS_TOTAL.inc(label=LABELS[pred_class])
+
+    if debug_tensors_enabled():
+        logger.debug("Model raw outputs: %s", outputs)
+        logger.debug("Probabilities: %s", probabilities)
+
+    logger.info("prediction", extra={'fields': {
+        'prediction_class': pred_class,
+        'prediction': LABELS[pred_class],
+        'confidence': round(confidence, 4),
+        'low_confidence': confidence < LOW_CONFIDENCE_THRESHOLD,
+        'image_size': list(image.size),
+        **{f'{name}_ms': round(seconds * 1000, 2) for name, seconds in timings.items()},
+    }})
 
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            print(f"Probabilities (attempt {attempt}): {probabilities}")
+    return {
+        "prediction": LABELS[pred_class],
+        "prediction_class": pred_class
+    }
 
-            pred = torch.argmax(outputs, dim=1)
-            pred_class = pred.item()
-            confidence = probabilities[0][pred_class].item()
 
-            print(f"Predicted class: {pred_class} ({LABELS[pred_class]})")
-            print(f"Confidence: {confidence:.4f}")
+def predict_batch(model, arrays, device=None):
+    """
+    Batched variant of ``predict_image`` for already decoded HxWx3 arrays.
+    Arrays of the same shape share one forward pass; results keep input order.
+    """
+    if not TORCH_AVAILABLE or model is None:
+        raise RuntimeError("Model not available. PyTorch and model file required for predictions.")
 
-            if confidence >= 0.70:
-                break
+    import numpy as np
+    import torch
 
-            print("Confidence below 70%, rerunning inference with the same raw image.")
+    groups = {}
+    for index, array in enumerate(arrays):
+        groups.setdefault(array.shape, []).append(index)
+
+    results = [None] * len(arrays)
+    for indices in groups.values():
+        try:
+            started = time.perf_counter()
+            batch = torch.from_numpy(np.stack([arrays[i] for i in indices])).permute(0, 3, 1, 2).float()
+            INFERENCE_STAGE_SECONDS.observe(time.perf_counter() - started, stage='preprocess')
+        except Exception:
+            INFERENCE_ERRORS_TOTAL.inc(stage='preprocess')
+            raise
+        for index, result in zip(indices, predict_tensors(model, batch, device)):
+            results[index] = result
+    return results
+
+
+def predict_tensors(model, batch, device=None):
+    """
+    Classify an Nx3xHxW float batch in one forward pass. Numpy input, such as
+    ``ShmRing.batch`` slots, is wrapped without a copy on CPU devices.
+    """
+    if not TORCH_AVAILABLE or model is None:
+        raise RuntimeError("Model not available. PyTorch and model file required for predictions.")
 
-            elapsed = time.time() - start_time
-            if elapsed >= 10:
-                print(
-                    "Confidence threshold not met within 10 seconds. "
-                    "Returning the most recent prediction."
-                )
-                break
+    import torch
 
-    return {
-        "prediction": LABELS[pred_class],
-        "prediction_class": pred_class
-    }
+    stage = 'forward'
+    try:
+        if not isinstance(batch, torch.Tensor):
+            batch = torch.from_numpy(batch)
+        started = time.perf_counter()
+        with torch.no_grad():
+            outputs = model(batch.to(device or get_device()))
+        INFERENCE_STAGE_SECONDS.observe(time.perf_counter() - started, stage='forward')
+
+        stage = 'postprocess'
+        classes = torch.argmax(outputs, dim=1).tolist()
+    except Exception:
+        INFERENCE_ERRORS_TOTAL.inc(stage=stage)
+        raise
+
+    INFERENCE_BATCH_SIZE.observe(len(classes))
+    results = []
+    for pred_class in classes:
+        PREDICTIONS_TOTAL.inc(label=LABELS[pred_class])
+        results.append({"prediction": LABELS[pred_class], "prediction_class": pred_class})
+    return results
@@ -0,0 +1,417 @@
+"""
+Versioned models with background loading, hot swap and shadow traffic.
+
+The registry owns the active inference backend. New checkpoints from
+``settings.MODEL_REGISTRY_DIR`` are loaded and warmed on a background
+thread, then either swapped in atomically (requests already running
+finish on the model they started with) or attached as a shadow. A shadow
+model sees a ``SHADOW_SAMPLE_RATE`` fraction of traffic on its own
+thread, so the primary response never waits for it; disagreements are
+logged and counted.
+
+Up to ``MODEL_REGISTRY_KEEP`` loaded versions stay in memory, which
+makes a rollback to the previous version instant.
+
+Worker processes build the registry on a background thread at startup
+(see ``netra_backend/wsgi.py``); ``health()`` backs the readiness probe
+so traffic is only routed to workers whose model is loaded and warmed.
+
+Each worker has its own registry. ``deploy`` applies an admin's change
+locally and records it in the ``ModelDeployment`` row; every other
+worker picks it up within ``MODEL_SYNC_INTERVAL`` seconds (``sync``),
+switching to a version it already holds or loading it in the background.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .inference import create_backend
+from .metrics import MODEL_SWAPS_TOTAL, SHADOW_PREDICTIONS_TOTAL
+from .models import ModelDeployment
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_EXTENSIONS = {'.pth': 'torch', '.pt': 'exported', '.onnx': 'exported'}
+
+# Backend options ``load`` accepts from a caller. Anything naming a file
+# or a host (checkpoint, url) comes only from settings or
+# MODEL_REGISTRY_DIR.
+LOAD_OPTIONS = frozenset({'seed', 'latency_ms', 'jitter_ms', 'timeout'})
+
+
+def parse_sample_rate(value):
+    """``value`` as a shadow sample rate between 0 and 1; raises ``ValueError``."""
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        rate = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('sample_rate must be a number between 0 and 1.') from None
+    if not 0 <= rate <= 1:  # NaN fails this too
+        raise ValueError('sample_rate must be a number between 0 and 1.')
+    return rate
+
+
+def warm_up(backend, batches, size, batch_sizes=(1,)):
+    """
+    Run ``batches`` dummy batches at each of ``batch_sizes`` so kernel
+    selection, allocator growth and any JIT happen before real traffic.
+    """
+    import numpy as np
+
+    width, height = size
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    for batch_size in batch_sizes:
+        for _ in range(batches):
+            backend.predict_batch([image] * batch_size)
+    backend.warmed = True
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.active = None
+        self.shadow = None
+        self.shadow_sample_rate = getattr(settings, 'SHADOW_SAMPLE_RATE', 0.1)
+        self._loaded = OrderedDict()
+        self._specs = {}  # version -> the checkpoint/options it was loaded from
+        self._loading = {}
+        self.revision = 0  # last ModelDeployment revision applied
+        self.next_sync = 0.0
+        self._lock = threading.Lock()
+        self._shadow_slots = threading.BoundedSemaphore(getattr(settings, 'SHADOW_MAX_PENDING', 4))
+        self._shadow_executor = ThreadPoolExecutor(1, thread_name_prefix='shadow-model')
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    # ----- Loading -----
+    def load_default(self):
+        """Load the backend configured in settings and make it active (blocking)."""
+        backend = create_backend()
+        if backend.ready:
+            warm_up(backend, *self._warmup_config())
+        self._register(backend, {'checkpoint': None, 'options': {}})
+        self.active = backend
+        return backend
+
+    def available(self):
+        """Checkpoint files in ``MODEL_REGISTRY_DIR`` that ``load`` accepts."""
+        directory = settings.MODEL_REGISTRY_DIR
+        if not os.path.isdir(directory):
+            return []
+        checkpoints = []
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_file() and os.path.splitext(entry.name)[1] in CHECKPOINT_EXTENSIONS:
+                stat = entry.stat()
+                checkpoints.append({'checkpoint': entry.name, 'size': stat.st_size, 'modified': stat.st_mtime})
+        return checkpoints
+
+    def load(self, checkpoint=None, options=None, mode='activate', sample_rate=None):
+        """
+        Load ``checkpoint`` (a file name from ``available()``) and/or backend
+        ``options`` (keys from ``LOAD_OPTIONS``) on a background thread, warm
+        it, then activate or shadow it (at ``sample_rate``, if given).
+        Returns the thread.
+        """
+        if mode not in ('activate', 'shadow'):
+            raise ValueError(f'Unknown mode {mode!r}.')
+        if sample_rate is not None:
+            sample_rate = parse_sample_rate(sample_rate)
+        if options is not None and not isinstance(options, dict):
+            raise ValueError('options must be an object.')
+        refused = sorted(set(options or {}) - LOAD_OPTIONS)
+        if refused:
+            raise ValueError(f"Options cannot set {', '.join(refused)}.")
+        spec = {'checkpoint': checkpoint, 'options': dict(options or {})}
+        name = settings.INFERENCE_BACKEND
+        options = {**settings.INFERENCE_BACKEND_OPTIONS, **(options or {})}
+        if checkpoint is not None:
+            if checkpoint not in {c['checkpoint'] for c in self.available()}:
+                raise ValueError(f'Unknown checkpoint {checkpoint!r}.')
+            if name in ('torch', 'exported'):
+                name = CHECKPOINT_EXTENSIONS[os.path.splitext(checkpoint)[1]]
+            options['checkpoint'] = os.path.join(settings.MODEL_REGISTRY_DIR, checkpoint)
+
+        label = checkpoint or name
+        with self._lock:
+            if self._loading.get(label, {}).get('state') in ('loading', 'warming'):
+                raise ValueError(f'{label} is already loading.')
+            self._loading[label] = {'state': 'loading', 'mode': mode}
+        thread = threading.Thread(
+            target=self._load, args=(label, spec, name, options, mode, sample_rate),
+            name=f'load-model-{label}', daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _load(self, label, spec, name, options, mode, sample_rate):
+        status = self._loading[label]
+        try:
+            backend = create_backend(name, options)
+            if not backend.ready:
+                raise RuntimeError(f'{label} could not be loaded.')
+            status['state'] = 'warming'
+            warm_up(backend, *self._warmup_config())
+        except Exception as exc:
+            logger.exception("Model load failed", extra={'fields': {'checkpoint': label}})
+            status.update(state='failed', error=str(exc))
+            return
+        self._register(backend, spec)
+        status.update(state='ready', version=backend.version)
+        if mode == 'activate':
+            self.activate(backend.version)
+        else:
+            self.start_shadow(backend.version, sample_rate)
+
+    def _warmup_config(self):
+        width, height = (int(v) for v in settings.MODEL_WARMUP_SIZE.split('x'))
+        return settings.MODEL_WARMUP_BATCHES, (width, height), settings.MODEL_WARMUP_BATCH_SIZES
+
+    def _register(self, backend, spec):
+        with self._lock:
+            self._loaded[backend.version] = backend
+            self._specs[backend.version] = spec
+            self._loaded.move_to_end(backend.version)
+            keep = max(1, getattr(settings, 'MODEL_REGISTRY_KEEP', 2))
+            for version in list(self._loaded):
+                if len(self._loaded) <= keep:
+                    break
+                if self._loaded[version] not in (self.active, self.shadow, backend):
+                    self._loaded.pop(version).close()
+
+    # ----- Switching -----
+    def activate(self, version):
+        """Swap a loaded version in; in-flight requests keep the backend they started with."""
+        with self._lock:
+            backend = self._loaded[version]
+            previous, self.active = self.active, backend
+            if self.shadow is backend:
+                self.shadow = None
+        MODEL_SWAPS_TOTAL.inc(version=version)
+        logger.info("Model activated", extra={'fields': {
+            'version': version, 'previous_version': previous.version if previous else None,
+        }})
+
+    def start_shadow(self, version, sample_rate=None):
+        if sample_rate is not None:
+            sample_rate = parse_sample_rate(sample_rate)
+        with self._lock:
+            self.shadow = self._loaded[version]
+            if sample_rate is not None:
+                self.shadow_sample_rate = sample_rate
+        logger.info("Shadow model started", extra={'fields': {
+            'version': version, 'sample_rate': self.shadow_sample_rate,
+        }})
+
+    def stop_shadow(self):
+        self.shadow = None
+
+    def spec_of(self, version):
+        """The checkpoint/options a loaded ``version`` came from; raises ``KeyError``."""
+        with self._lock:
+            self._loaded[version]
+            return dict(self._specs[version])
+
+    def apply(self, active=None, shadow=None):
+        """
+        Converge on a deployment another worker published: switch to versions
+        loaded here already and load the rest in the background (the current
+        model keeps serving meanwhile). Returns the threads started.
+        """
+        threads = []
+        for mode, spec in (('activate', active), ('shadow', shadow)):
+            if spec is None:
+                if mode == 'shadow' and self.shadow is not None:
+                    self.stop_shadow()
+                continue
+            sample_rate = spec.get('sample_rate') if mode == 'shadow' else None
+            wanted = {'checkpoint': spec.get('checkpoint'), 'options': spec.get('options') or {}}
+            with self._lock:
+                version = next((v for v, s in self._specs.items() if s == wanted and v in self._loaded), None)
+            try:
+                if version is None:
+                    threads.append(self.load(wanted['checkpoint'], wanted['options'], mode, sample_rate))
+                elif mode == 'shadow':
+                    self.start_shadow(version, sample_rate)
+                elif self.active is not self._loaded.get(version):
+                    self.activate(version)
+            except (KeyError, ValueError) as exc:
+                logger.warning("Deployed model not applied", extra={'fields': {
+                    'mode': mode, 'checkpoint': wanted['checkpoint'], 'error': str(exc),
+                }})
+        return threads
+
+    # ----- Inference -----
+    def predict(self, image_file):
+        """Predict with the active model; returns ``(result, version)``."""
+        backend = self.active
+        with self._in_flight_lock:
+            self._in_flight += 1
+        try:
+            result = backend.predict(image_file)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+        shadow = self.shadow
+        if shadow is not None and random.random() < self.shadow_sample_rate:
+            self._submit_shadow(shadow, image_file, result, backend.version)
+        return result, backend.version
+
+    def _submit_shadow(self, shadow, image_file, result, primary_version):
+        if not self._shadow_slots.acquire(blocking=False):
+            SHADOW_PREDICTIONS_TOTAL.inc(result='skipped')
+            return
+        image_file.seek(0)
+        content = image_file.read()
+        image_file.seek(0)
+        future = self._shadow_executor.submit(self._run_shadow, shadow, content, result, primary_version)
+        future.add_done_callback(lambda _: self._shadow_slots.release())
+
+    def _run_shadow(self, shadow, content, primary, primary_version):
+        try:
+            candidate = shadow.predict(BytesIO(content))
+        except Exception:
+            SHADOW_PREDICTIONS_TOTAL.inc(result='error')
+            logger.exception("Shadow prediction failed", extra={'fields': {'shadow_version': shadow.version}})
+            return
+        if candidate['prediction_class'] == primary['prediction_class']:
+            SHADOW_PREDICTIONS_TOTAL.inc(result='agree')
+            return
+        SHADOW_PREDICTIONS_TOTAL.inc(result='disagree')
+        logger.info("Shadow disagreement", extra={'fields': {
+            'version': primary_version,
+            'prediction_class': primary['prediction_class'],
+            'shadow_version': shadow.version,
+            'shadow_prediction_class': candidate['prediction_class'],
+        }})
+
+    @property
+    def queue_depth(self):
+        """Predictions currently running or waiting on this worker."""
+        return self._in_flight
+
+    def health(self):
+        active = self.active
+        loaded = active is not None and active.ready
+        warmed = loaded and active.warmed
+        return {
+            'ready': warmed,
+            'loaded': loaded,
+            'warmed': warmed,
+            'backend': active.name if active else settings.INFERENCE_BACKEND,
+            'version': active.version if active else None,
+            'queue_depth': self.queue_depth,
+        }
+
+    def describe(self):
+        with self._lock:
+            return {
+                'active': self.active.describe() if self.active else None,
+                'shadow': {**self.shadow.describe(), 'sample_rate': self.shadow_sample_rate} if self.shadow else None,
+                'loaded': list(self._loaded),
+                'loading': {label: dict(status) for label, status in self._loading.items()},
+                'available': self.available(),
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The process-wide registry; its first use loads the configured backend."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = ModelRegistry()
+                registry.load_default()
+                _registry = registry
+    sync(_registry)
+    return _registry
+
+
+def deploy(registry, mode='activate', version=None, checkpoint=None, options=None, sample_rate=None):
+    """
+    Activate or shadow ``version`` (already loaded) or start loading
+    ``checkpoint``/``options`` on this worker, then publish that so every
+    other worker follows.
+    """
+    if mode not in ('activate', 'shadow'):
+        raise ValueError(f'Unknown mode {mode!r}.')
+    if version:
+        if mode == 'shadow':
+            registry.start_shadow(version, sample_rate)
+        else:
+            registry.activate(version)
+        spec = registry.spec_of(version)
+    else:
+        registry.load(checkpoint, options, mode, sample_rate)
+        spec = {'checkpoint': checkpoint, 'options': dict(options or {})}
+    if mode == 'activate':
+        publish(registry, active=spec)
+    else:
+        rate = registry.shadow_sample_rate if sample_rate is None else parse_sample_rate(sample_rate)
+        publish(registry, shadow={**spec, 'sample_rate': rate})
+
+
+def publish(registry, **fields):
+    """Record ``active``/``shadow`` specs that ``registry`` has already applied."""
+    with transaction.atomic():
+        ModelDeployment.objects.get_or_create(pk=1)
+        ModelDeployment.objects.filter(pk=1).update(revision=F('revision') + 1, updated_at=timezone.now(), **fields)
+        registry.revision = ModelDeployment.objects.values_list('revision', flat=True).get(pk=1)
+
+
+def sync(registry):
+    """Apply a deployment published since ``registry`` last looked; checks every MODEL_SYNC_INTERVAL seconds."""
+    now = time.monotonic()
+    if now < registry.next_sync:
+        return []
+    registry.next_sync = now + settings.MODEL_SYNC_INTERVAL
+    try:
+        deployment = ModelDeployment.objects.filter(pk=1).exclude(revision=registry.revision).first()
+    except DatabaseError:
+        logger.warning("Model deployment could not be read", exc_info=True)
+        return []
+    if deployment is None:
+        return []
+    registry.revision = deployment.revision
+    return registry.apply(deployment.active, deployment.shadow)
+
+
+def warm_up_in_background():
+    """Build (load and warm) the registry on a daemon thread; used at worker startup."""
+    thread = threading.Thread(target=get_registry, name='model-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def health():
+    """Readiness of this worker's inference path, without triggering a load."""
+    registry = _registry
+    if registry is None:
+        return {
+            'ready': False, 'loaded': False, 'warmed': False,
+            'backend': settings.INFERENCE_BACKEND, 'version': None, 'queue_depth': 0,
+        }
+    return registry.health()
+
+
+def _reset_registry(setting, **kwargs):
+    global _registry
+    if setting in ('INFERENCE_BACKEND', 'INFERENCE_BACKEND_OPTIONS'):
+        _registry = None
+
+
+setting_changed.connect(_reset_registry)
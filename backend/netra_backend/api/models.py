@@ -32,6 +32,10 @@ class PatientDoctorSubscription(models.Model):
 
     class Meta:
         unique_together = ('patient', 'doctor')
+        indexes = [
+            models.Index(fields=['doctor', 'is_active'], name='subscription_doctor_idx'),
+            models.Index(fields=['patient', 'is_active'], name='subscription_patient_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient.username} -> Dr. {self.doctor.username}"
@@ -72,6 +76,7 @@ class RetinalScan(models.Model):
     right_eye_prediction = models.CharField(max_length=255, blank=True, null=True)
     right_eye_prediction_class = models.IntegerField(blank=True, null=True)
     ai_details = models.JSONField(blank=True, null=True)
+    model_version = models.CharField(max_length=100, blank=True, null=True)
 
     priority = models.CharField(max_length=20, choices=PRIORITY_CHOICES, default='medium')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -96,11 +101,21 @@ class ScanImage(models.Model):
         ('both', 'Both'),
     ]
 
+    TIER_CHOICES = [
+        ('hot', 'Hot'),
+        ('cold', 'Cold'),
+    ]
+
     scan = models.ForeignKey(RetinalScan, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='retina_scans/')
     eye_side = models.CharField(max_length=10, choices=EYE_CHOICES, default='both')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Old originals move to cold storage (see api/tiering.py); ``image`` keeps
+    # the hot name they are restored to, ``cold_name`` locates the cold copy.
+    storage_tier = models.CharField(max_length=10, choices=TIER_CHOICES, default='hot')
+    cold_name = models.CharField(max_length=255, blank=True, null=True)
+
     def __str__(self):
         return f"{self.scan.patient.username} - {self.eye_side} - {self.created_at.strftime('%Y-%m-%d')}"
 
@@ -121,3 +136,89 @@ class DoctorNote(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+
+
+class PatientTimeline(models.Model):
+    """
+    Latest grade per eye for a patient, maintained incrementally as scans are
+    analyzed (see api/timeline.py). Deltas compare with the patient's previous
+    graded scan; positive means the retinopathy grade got worse.
+    """
+    patient = models.OneToOneField(
+        User, on_delete=models.CASCADE,
+        primary_key=True, related_name='timeline',
+        limit_choices_to={'role': 'patient'}
+    )
+    last_scan = models.ForeignKey(RetinalScan, on_delete=models.SET_NULL, null=True, related_name='+')
+    last_scan_at = models.DateTimeField(blank=True, null=True)
+    previous_scan_at = models.DateTimeField(blank=True, null=True)
+    scan_count = models.IntegerField(default=0)
+
+    left_grade = models.IntegerField(blank=True, null=True)
+    left_grade_delta = models.IntegerField(blank=True, null=True)
+    right_grade = models.IntegerField(blank=True, null=True)
+    right_grade_delta = models.IntegerField(blank=True, null=True)
+    progressed = models.BooleanField(default=False)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Timeline of {self.patient_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['progressed', '-last_scan_at'], name='timeline_progressed_idx'),
+        ]
+
+
+class WorklistItem(models.Model):
+    """
+    A pending scan in its doctor's review queue (see api/worklist.py). Rows
+    exist only while the scan awaits review; the composite index serves the
+    "next N" query as a single index range scan.
+    """
+    STATE_CHOICES = [
+        ('queued', 'Queued'),
+        ('claimed', 'Claimed'),
+    ]
+
+    scan = models.OneToOneField(
+        RetinalScan, on_delete=models.CASCADE,
+        primary_key=True, related_name='worklist_item'
+    )
+    doctor = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='worklist',
+        limit_choices_to={'role': 'doctor'}
+    )
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='queued')
+    priority_rank = models.SmallIntegerField()
+    grade = models.SmallIntegerField()
+    queued_at = models.DateTimeField()
+    claimed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Scan {self.scan_id} for Dr. {self.doctor_id} ({self.state})"
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['doctor', 'state', '-priority_rank', '-grade', 'queued_at'],
+                name='worklist_next_idx',
+            ),
+        ]
+
+
+class ModelDeployment(models.Model):
+    """
+    The model every worker should serve and shadow (see
+    api/model_registry.py). A single row: the admin models endpoint bumps
+    ``revision`` and each worker reconciles its own registry against it.
+    """
+    active = models.JSONField(null=True, blank=True)  # {"checkpoint": ..., "options": {...}}
+    shadow = models.JSONField(null=True, blank=True)  # the same plus "sample_rate"; null when stopped
+    revision = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Deployment r{self.revision}"
@@ -0,0 +1,47 @@
+"""
+Bulk deletion of scans.
+
+``delete_scans`` removes scans ``chunk_size`` at a time, each chunk in its own
+short transaction. Within a chunk, Django's collector deletes the dependent
+``ScanImage``, ``DoctorNote`` and ``WorklistItem`` rows with one
+``DELETE ... WHERE scan_id IN (...)`` per table and detaches timelines with a
+single UPDATE, instead of cascading row by row. Because the lock is released
+between chunks, a retention purge never blocks uploads for long.
+
+Image files are left on disk. Seeded scans share image files and uploads
+race with deletes, so deciding which files are orphaned is the job of the
+media garbage collector (``api/media_gc.py``, ``manage.py gc_media``).
+"""
+import logging
+
+from .models import RetinalScan
+from .search import remove_scans
+from .timeline import rebuild_timeline
+
+logger = logging.getLogger(__name__)
+
+
+def delete_scans(scans, chunk_size=500):
+    """Delete ``scans`` (a queryset) in chunks; returns counts of deleted rows."""
+    scans = scans.order_by('id')
+    totals = {'scans': 0, 'images': 0, 'notes': 0}
+    patient_ids = set()
+    last_id = 0
+    while True:
+        chunk = list(scans.filter(id__gt=last_id).values_list('id', 'patient_id')[:chunk_size])
+        if not chunk:
+            break
+        ids = [scan_id for scan_id, _ in chunk]
+        last_id = ids[-1]
+        _, deleted = RetinalScan.objects.filter(id__in=ids).delete()
+        totals['scans'] += deleted.get('api.RetinalScan', 0)
+        totals['images'] += deleted.get('api.ScanImage', 0)
+        totals['notes'] += deleted.get('api.DoctorNote', 0)
+        patient_ids.update(patient_id for _, patient_id in chunk)
+        remove_scans(ids)
+
+    for patient_id in patient_ids:
+        rebuild_timeline(patient_id)
+    totals['patients'] = len(patient_ids)
+    logger.info("Scans deleted", extra={'fields': totals})
+    return totals
@@ -0,0 +1,254 @@
+"""
+Full-text and faceted search over scans, their patients and doctor notes.
+
+Text matching is delegated to a pluggable engine chosen by
+``settings.SEARCH_ENGINE``:
+
+- ``fts5``: an SQLite FTS5 index (``api_scan_search``, created by migration
+  0007) with one row per scan holding the patient's name and username and the
+  scan's notes, keyed by the scan id. Matches are ranked by BM25.
+- ``basic``: ``icontains`` lookups through the ORM; works on any database but
+  scans the tables, so it suits development or small installs.
+- ``auto`` (default) picks ``fts5`` when the index exists, else ``basic``.
+
+A dotted path to a ``SearchEngine`` subclass plugs in another engine.
+
+The index is kept current incrementally: ``index_scans`` after an upload or a
+new note, ``index_patient`` when a patient's name changes (a ``post_save``
+receiver, see ``api/apps.py``) and ``remove_scans`` on delete. Rows of deleted
+scans never surface anyway, since matches are always joined back to
+``RetinalScan``. ``manage.py rebuild_search_index`` rebuilds it from scratch.
+
+Grade, priority, status and date filters and the facet counts are plain SQL
+over the matched scans, so they behave identically with every engine.
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections, router, transaction
+from django.db.models import Count, IntegerField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.module_loading import import_string
+
+from .models import DoctorNote, RetinalScan, User
+
+FTS_TABLE = 'api_scan_search'
+
+
+def search_terms(text):
+    """Words of a free-text query; punctuation and operators are dropped."""
+    return re.findall(r'\w+', text or '')
+
+
+class SearchEngine:
+    name = 'base'
+
+    def filter(self, scans, text):
+        """Restrict ``scans`` to those matching every term of ``text``."""
+        raise NotImplementedError
+
+    def order(self, scans, text):
+        """Order matched ``scans`` by relevance to ``text``."""
+        return scans.order_by('-created_at')
+
+    def index_scans(self, scan_ids):
+        pass
+
+    def index_patient(self, patient_id):
+        pass
+
+    def remove_scans(self, scan_ids):
+        pass
+
+    def rebuild(self):
+        """Rebuild the whole index; returns the number of scans indexed."""
+        return 0
+
+
+class BasicSearchEngine(SearchEngine):
+    """``icontains`` over the source tables; no index to maintain."""
+
+    name = 'basic'
+
+    def filter(self, scans, text):
+        for term in search_terms(text):
+            matching = RetinalScan.objects.filter(
+                Q(patient__full_name__icontains=term)
+                | Q(patient__username__icontains=term)
+                | Q(doctor_notes__note_text__icontains=term)
+            ).values('id')
+            scans = scans.filter(id__in=matching)
+        return scans
+
+
+class FTS5SearchEngine(SearchEngine):
+    """SQLite FTS5 index with one row per scan, rowid = scan id."""
+
+    name = 'fts5'
+
+    _SOURCE = (
+        "SELECT s.id, u.full_name, u.username, "
+        "COALESCE((SELECT group_concat(n.note_text, ' ') FROM {notes} n WHERE n.scan_id = s.id), '') "
+        "FROM {scans} s JOIN {users} u ON u.id = s.patient_id"
+    ).format(
+        notes=DoctorNote._meta.db_table, scans=RetinalScan._meta.db_table, users=User._meta.db_table,
+    )
+    _INSERT = f"INSERT INTO {FTS_TABLE} (rowid, patient_name, patient_username, notes) {_SOURCE}"
+    _CHUNK = 500  # ids per statement, well under SQLite's variable limit
+
+    @staticmethod
+    def match_expression(text):
+        """Quote every term (so user input is never FTS syntax) and prefix-match it; terms are ANDed."""
+        return ' '.join(f'"{term}"*' for term in search_terms(text))
+
+    def filter(self, scans, text):
+        if not search_terms(text):
+            return scans
+        return scans.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [self.match_expression(text)],
+        ))
+
+    def order(self, scans, text):
+        if not search_terms(text):
+            return super().order(scans, text)
+        rank = RawSQL(
+            f"SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"AND rowid = {RetinalScan._meta.db_table}.id",
+            [self.match_expression(text)],
+        )
+        return scans.annotate(search_rank=rank).order_by('search_rank', '-created_at')
+
+    def _execute(self, *statements):
+        alias = router.db_for_write(RetinalScan)
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            for sql, params in statements:
+                cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def index_scans(self, scan_ids):
+        scan_ids = list(scan_ids)
+        for start in range(0, len(scan_ids), self._CHUNK):
+            chunk = scan_ids[start:start + self._CHUNK]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            self._execute(
+                (f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", chunk),
+                (f"{self._INSERT} WHERE s.id IN ({placeholders})", chunk),
+            )
+
+    def index_patient(self, patient_id):
+        self._execute(
+            (f"DELETE FROM {FTS_TABLE} WHERE rowid IN "
+             f"(SELECT id FROM {RetinalScan._meta.db_table} WHERE patient_id = %s)", [patient_id]),
+            (f"{self._INSERT} WHERE s.patient_id = %s", [patient_id]),
+        )
+
+    def remove_scans(self, scan_ids):
+        scan_ids = list(scan_ids)
+        for start in range(0, len(scan_ids), self._CHUNK):
+            chunk = scan_ids[start:start + self._CHUNK]
+            self._execute((f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk))
+
+    def rebuild(self):
+        count = self._execute((f"DELETE FROM {FTS_TABLE}", []), (self._INSERT, []))
+        self._execute((f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')", []))
+        return count
+
+
+ENGINES = {'basic': BasicSearchEngine, 'fts5': FTS5SearchEngine}
+
+
+def _fts5_available():
+    connection = connections[router.db_for_write(RetinalScan)]
+    return connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+
+def create_engine(name=None):
+    name = name or getattr(settings, 'SEARCH_ENGINE', 'auto')
+    if name == 'auto':
+        name = 'fts5' if _fts5_available() else 'basic'
+    engine_class = ENGINES[name] if name in ENGINES else import_string(name)
+    return engine_class()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine()
+        return _engine
+
+
+def index_scans(scan_ids):
+    get_engine().index_scans(scan_ids)
+
+
+def index_patient(patient_id):
+    get_engine().index_patient(patient_id)
+
+
+def remove_scans(scan_ids):
+    get_engine().remove_scans(scan_ids)
+
+
+def rebuild_index():
+    return get_engine().rebuild()
+
+
+def reindex_patient_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """``post_save`` receiver for users: re-index a patient's scans when their name changes."""
+    if created or instance.role != 'patient':
+        return
+    if update_fields is not None and not {'full_name', 'username'} & set(update_fields):
+        return  # e.g. last_login or password updates
+    index_patient(instance.pk)
+
+
+def with_grade(scans):
+    """Annotate ``grade``: the worse eye's predicted class, -1 if ungraded."""
+    return scans.annotate(grade=Greatest(
+        Coalesce('left_eye_prediction_class', -1),
+        Coalesce('right_eye_prediction_class', -1),
+        output_field=IntegerField(),
+    ))
+
+
+def search(scans, text='', priority=None, status=None, grade=None, date_from=None, date_to=None):
+    """
+    Match ``scans`` against ``text`` and the filters. Returns the matching
+    scans ordered by relevance (newest first without text) and the facet
+    counts of the whole match: ``{'priority': {...}, 'status': {...}, 'grade': {...}}``.
+    """
+    engine = get_engine()
+    scans = with_grade(engine.filter(scans, text))
+    if priority:
+        scans = scans.filter(priority=priority)
+    if status:
+        scans = scans.filter(status=status)
+    if grade is not None:
+        scans = scans.filter(grade=grade)
+    if date_from:
+        scans = scans.filter(created_at__date__gte=date_from)
+    if date_to:
+        scans = scans.filter(created_at__date__lte=date_to)
+
+    facets = {}
+    for field in ('priority', 'status', 'grade'):
+        counts = scans.order_by().values(field).annotate(count=Count('id')).values_list(field, 'count')
+        facets[field] = {value: count for value, count in counts}
+    return engine.order(scans, text), facets
+
+
+def _reset_engine(setting, **kwargs):
+    global _engine
+    if setting == 'SEARCH_ENGINE':
+        _engine = None
+
+
+setting_changed.connect(_reset_engine)
@@ -1,5 +1,11 @@
+from django.db.models import Prefetch
+from django.utils import timezone
 from rest_framework import serializers
-from .models import RetinalScan, ScanImage, DoctorNote, PatientDoctorSubscription, User
+from .media_serving import file_url
+from .model_loader import LABELS
+from .models import (
+    RetinalScan, ScanImage, DoctorNote, PatientDoctorSubscription, PatientTimeline, User, WorklistItem
+)
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -32,20 +38,44 @@ class RegisterSerializer(serializers.ModelSerializer):
 
 class ScanImageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
+    file_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    medium_url = serializers.SerializerMethodField()
     image_filename = serializers.SerializerMethodField()
 
     class Meta:
         model = ScanImage
-        fields = ['id', 'image', 'image_url', 'image_filename', 'eye_side', 'created_at']
+        fields = [
+            'id', 'image', 'image_url', 'file_url', 'thumbnail_url', 'medium_url',
+            'image_filename', 'eye_side', 'storage_tier', 'created_at'
+        ]
 
     def get_image_url(self, obj):
         request = self.context.get('request')
+        if obj.storage_tier == 'cold':
+            # Not under MEDIA_URL any more; the file endpoint rehydrates it.
+            return self.get_file_url(obj)
         if obj.image and hasattr(obj.image, 'url'):
             if request:
                 return request.build_absolute_uri(obj.image.url)
             return obj.image.url
         return None
 
+    def get_file_url(self, obj):
+        if obj.image:
+            return file_url(self.context.get('request'), obj)
+        return None
+
+    def get_thumbnail_url(self, obj):
+        if obj.image:
+            return file_url(self.context.get('request'), obj, 'thumbnail')
+        return None
+
+    def get_medium_url(self, obj):
+        if obj.image:
+            return file_url(self.context.get('request'), obj, 'medium')
+        return None
+
     def get_image_filename(self, obj):
         if obj.image:
             return obj.image.name.split('/')[-1]
@@ -73,10 +103,17 @@ class RetinalScanSerializer(serializers.ModelSerializer):
             'id', 'patient', 'nurse', 'doctor',
             'left_eye_prediction', 'left_eye_prediction_class',
             'right_eye_prediction', 'right_eye_prediction_class',
-            'ai_details', 'priority', 'status', 'patient_age', 'patient_diabetes_duration',
+            'ai_details', 'model_version', 'priority', 'status', 'patient_age', 'patient_diabetes_duration',
             'created_at', 'updated_at', 'images', 'doctor_notes'
         ]
 
+    @staticmethod
+    def eager_load(scans):
+        """``scans`` with every nested user, image and note loaded up front (three queries in total)."""
+        return scans.select_related('patient', 'nurse', 'doctor').prefetch_related(
+            'images', Prefetch('doctor_notes', queryset=DoctorNote.objects.select_related('doctor')),
+        )
+
 
 class PatientDoctorSubscriptionSerializer(serializers.ModelSerializer):
     patient = UserSerializer(read_only=True)
@@ -85,3 +122,77 @@ class PatientDoctorSubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = PatientDoctorSubscription
         fields = ['id', 'patient', 'doctor', 'is_active', 'created_at']
+
+
+class PatientTimelineSerializer(serializers.ModelSerializer):
+    left_grade_label = serializers.SerializerMethodField()
+    right_grade_label = serializers.SerializerMethodField()
+    days_since_last_scan = serializers.SerializerMethodField()
+    days_between_last_scans = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PatientTimeline
+        fields = [
+            'patient', 'scan_count', 'last_scan', 'last_scan_at', 'previous_scan_at',
+            'days_since_last_scan', 'days_between_last_scans',
+            'left_grade', 'left_grade_label', 'left_grade_delta',
+            'right_grade', 'right_grade_label', 'right_grade_delta',
+            'progressed', 'updated_at'
+        ]
+
+    def get_left_grade_label(self, obj):
+        return LABELS[obj.left_grade] if obj.left_grade is not None else None
+
+    def get_right_grade_label(self, obj):
+        return LABELS[obj.right_grade] if obj.right_grade is not None else None
+
+    def get_days_since_last_scan(self, obj):
+        if obj.last_scan_at:
+            return (timezone.now() - obj.last_scan_at).days
+        return None
+
+    def get_days_between_last_scans(self, obj):
+        if obj.last_scan_at and obj.previous_scan_at:
+            return (obj.last_scan_at - obj.previous_scan_at).days
+        return None
+
+
+class WorklistItemSerializer(serializers.ModelSerializer):
+    patient = serializers.SerializerMethodField()
+    priority = serializers.CharField(source='scan.priority')
+    grade_label = serializers.SerializerMethodField()
+    waiting_minutes = serializers.SerializerMethodField()
+
+    class Meta:
+        model = WorklistItem
+        fields = ['scan', 'patient', 'priority', 'grade', 'grade_label', 'state', 'queued_at', 'waiting_minutes']
+
+    def get_patient(self, obj):
+        patient = obj.scan.patient
+        return {'id': patient.id, 'full_name': patient.full_name, 'username': patient.username}
+
+    def get_grade_label(self, obj):
+        return LABELS[obj.grade] if obj.grade >= 0 else None
+
+    def get_waiting_minutes(self, obj):
+        return int((timezone.now() - obj.queued_at).total_seconds() // 60)
+
+
+class ScanSearchResultSerializer(serializers.ModelSerializer):
+    patient = serializers.SerializerMethodField()
+    grade = serializers.IntegerField()
+    grade_label = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RetinalScan
+        fields = [
+            'id', 'patient', 'priority', 'status', 'left_eye_prediction', 'right_eye_prediction',
+            'grade', 'grade_label', 'created_at'
+        ]
+
+    def get_patient(self, obj):
+        patient = obj.patient
+        return {'id': patient.id, 'full_name': patient.full_name, 'username': patient.username}
+
+    def get_grade_label(self, obj):
+        return LABELS[obj.grade] if obj.grade >= 0 else None
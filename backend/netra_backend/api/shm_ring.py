@@ -0,0 +1,210 @@
+"""
+Shared-memory ring of model input slots, for handing decoded uploads from
+web workers to a separate inference process without pickling pixels.
+
+One ``multiprocessing.shared_memory`` segment holds a small header, a state
+byte and shape per slot, and ``slots`` preallocated arrays of ``slot_shape``
+(by default float32 3xHxW, the layout ``image_to_tensor`` produces). The
+inference process creates the ring; a web worker attaches to it by name:
+
+- ``put_image`` decodes an upload once and writes its pixels straight into a
+  free slot as the model's input, with no intermediate tensor (``put`` does
+  the same for an already decoded image). Only the slot index (and the
+  inference process's reply) crosses the IPC channel.
+- ``batch(slots)`` gives the consumer a numpy view of consecutive full-size
+  slots, which ``torch.from_numpy`` wraps without copying (see
+  ``model_loader.predict_tensors``). Smaller images are viewed in place too,
+  but different shapes can only be batched by stacking.
+- ``release(slots)`` hands the slots back once the forward pass is done.
+
+Slot states move FREE -> WRITING -> READY on the producer side and
+READY -> FREE on the consumer side, so each state byte has one writer at a
+time. That only holds for one producer process per ring: give every web
+worker its own ring (e.g. named after its pid) rather than sharing one.
+Threads within that process may share it; ``acquire`` and ``publish`` hold
+a lock.
+"""
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+FREE, WRITING, READY = 0, 1, 2
+
+MAGIC = 0x4E455452  # "NETR"
+DTYPES = ('uint8', 'float16', 'float32')
+MAX_NDIM = 4
+HEADER_FIELDS = 4 + MAX_NDIM  # magic, slots, dtype, ndim, dims
+ALIGNMENT = 64
+
+
+class RingFull(Exception):
+    """No free slot became available within the timeout."""
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _layout(slots, slot_shape, dtype):
+    """Byte offsets of the slot states, slot shapes and slot data, and the total size."""
+    import numpy as np
+
+    states = HEADER_FIELDS * 8
+    shapes = _align(states + slots)
+    data = _align(shapes + slots * MAX_NDIM * 8)
+    slot_bytes = int(np.prod(slot_shape)) * np.dtype(dtype).itemsize
+    return states, shapes, data, data + slots * slot_bytes
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Before Python 3.13 attaching registers the segment too. A process with
+    # its own resource tracker (a web worker) would have the segment unlinked
+    # when it exits; children of the creator share its tracker and must not
+    # unregister the creator's entry.
+    shared_tracker = resource_tracker._resource_tracker._fd is not None
+    shm = shared_memory.SharedMemory(name=name)
+    if not shared_tracker:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class ShmRing:
+    def __init__(self, shm, owner=False):
+        import numpy as np
+
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        if header[0] != MAGIC:
+            raise ValueError(f'{shm.name} is not a slot ring.')
+        self.shm = shm
+        self.owner = owner
+        self.slots = int(header[1])
+        self.dtype = np.dtype(DTYPES[header[2]])
+        self.slot_shape = tuple(int(dim) for dim in header[4:4 + header[3]])
+        states, shapes, data, _ = _layout(self.slots, self.slot_shape, self.dtype)
+        self._states = np.ndarray((self.slots,), dtype=np.uint8, buffer=shm.buf, offset=states)
+        self._shapes = np.ndarray((self.slots, MAX_NDIM), dtype=np.int64, buffer=shm.buf, offset=shapes)
+        self._data = np.ndarray((self.slots, *self.slot_shape), dtype=self.dtype, buffer=shm.buf, offset=data)
+        self._slot_size = int(np.prod(self.slot_shape))
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, slots, slot_shape, dtype='float32', name=None):
+        """Allocate a ring of ``slots`` arrays of ``slot_shape``; the creator unlinks it on close."""
+        import numpy as np
+
+        if len(slot_shape) > MAX_NDIM:
+            raise ValueError(f'Slots have at most {MAX_NDIM} dimensions.')
+        _, _, _, size = _layout(slots, slot_shape, dtype)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[:4] = (MAGIC, slots, DTYPES.index(np.dtype(dtype).name), len(slot_shape))
+        header[4:4 + len(slot_shape)] = slot_shape
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Open a ring another process created, reading its geometry from the header."""
+        return cls(_attach(name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # ----- producer -----
+    def acquire(self, timeout=None):
+        """Claim a free slot for writing and return its index; raises ``RingFull``."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                for step in range(self.slots):
+                    slot = (self._cursor + step) % self.slots
+                    if self._states[slot] == FREE:
+                        self._states[slot] = WRITING
+                        self._cursor = (slot + 1) % self.slots
+                        return slot
+            if deadline is None or time.monotonic() >= deadline:
+                raise RingFull(f'All {self.slots} slots of {self.name} are in use.')
+            time.sleep(0.001)
+
+    def publish(self, slot, shape=None):
+        """Mark ``slot`` as written, holding an array of ``shape`` (the full slot by default)."""
+        shape = tuple(shape or self.slot_shape)
+        with self._lock:
+            self._shapes[slot] = 0
+            self._shapes[slot, :len(shape)] = shape
+            self._states[slot] = READY
+
+    def put(self, image, timeout=None):
+        """Write a decoded RGB image into a free slot as the model's 3xHxW input; returns the slot."""
+        from .model_loader import write_tensor
+
+        shape = (3, image.height, image.width)
+        slot = self.acquire(timeout)
+        try:
+            write_tensor(image, self.view(slot, shape))
+        except BaseException:
+            self.release([slot])
+            raise
+        self.publish(slot, shape)
+        return slot
+
+    def put_image(self, image_file, timeout=None):
+        """Decode an upload once, straight into a free slot; returns the slot."""
+        from .model_loader import decode_image
+
+        return self.put(decode_image(image_file), timeout)
+
+    # ----- consumer -----
+    def shape_of(self, slot):
+        shape = self._shapes[slot]
+        return tuple(int(dim) for dim in shape[:len(self.slot_shape)])
+
+    def view(self, slot, shape=None):
+        """Writable array of ``shape`` over the start of ``slot``, sharing the segment's memory."""
+        if shape is None or tuple(shape) == self.slot_shape:
+            return self._data[slot]
+        size = 1
+        for dim in shape:
+            size *= dim
+        if size > self._slot_size:
+            raise ValueError(f'An array of shape {tuple(shape)} does not fit a {self.slot_shape} slot.')
+        return self._data[slot].reshape(-1)[:size].reshape(shape)
+
+    def batch(self, slots):
+        """
+        Published ``slots`` as one N x ... array. Consecutive full-size slots
+        come back as a view of the segment; anything else has to be stacked.
+        """
+        import numpy as np
+
+        slots = list(slots)
+        if not slots:
+            return np.empty((0, *self.slot_shape), dtype=self.dtype)
+        shapes = {self.shape_of(slot) for slot in slots}
+        if shapes == {self.slot_shape} and slots == list(range(slots[0], slots[0] + len(slots))):
+            return self._data[slots[0]:slots[-1] + 1]
+        if len(shapes) > 1:
+            raise ValueError('Slots of different shapes cannot be batched.')
+        return np.stack([self.view(slot, self.shape_of(slot)) for slot in slots])
+
+    def release(self, slots):
+        """Return ``slots`` to the producer once nothing reads them any more."""
+        for slot in slots:
+            self._states[slot] = FREE
+
+    def in_use(self):
+        return int((self._states != FREE).sum())
+
+    def close(self):
+        # Views into the buffer have to go before the mapping can be closed.
+        self._states = self._shapes = self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
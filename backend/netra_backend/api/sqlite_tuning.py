@@ -0,0 +1,53 @@
+"""
+Connection-level tuning for SQLite deployments.
+
+Every new SQLite connection gets the pragmas from ``settings.SQLITE_PRAGMAS``
+(WAL journaling, relaxed fsync, busy timeout, mmap and page cache size) so
+readers no longer block behind a nurse's upload transaction. ``PRAGMA optimize``
+is re-run on long-lived connections every ``SQLITE_OPTIMIZE_INTERVAL`` seconds.
+"""
+import time
+
+from django.conf import settings
+from django.db import connections
+
+_last_optimized = {}
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', {})
+
+
+def apply_pragmas(cursor, pragmas):
+    """Run ``PRAGMA name=value`` for each entry on a DB-API cursor."""
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """``connection_created`` receiver: tune freshly opened SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, pragmas)
+    _last_optimized[id(connection)] = time.monotonic()
+
+
+def optimize_sqlite_connections(sender=None, **kwargs):
+    """``request_finished`` receiver: periodically refresh query planner stats."""
+    interval = getattr(settings, 'SQLITE_OPTIMIZE_INTERVAL', 3600)
+    if not interval:
+        return
+    now = time.monotonic()
+    for connection in connections.all(initialized_only=True):
+        if connection.vendor != 'sqlite' or connection.connection is None:
+            continue
+        last = _last_optimized.setdefault(id(connection), now)
+        if now - last < interval:
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA optimize')
+        _last_optimized[id(connection)] = now
@@ -0,0 +1,83 @@
+"""
+Patient/doctor subscription lookups.
+
+Every question the API asks about subscriptions is answered by a single
+query on the ``(doctor, is_active)`` or ``(patient, is_active)`` index,
+however many patients a doctor has:
+
+- ``roster(doctor)``: the doctor's subscribed patients, as one join.
+- ``is_subscribed(doctor_id, patient_id)``: answered from a per-process
+  TTL/LRU cache of each doctor's patient ids. A miss (or a negative answer,
+  which may be a subscription made in another worker) reloads the set once.
+- ``get_subscription(patient_id, doctor_id)``: authorization and fetch in one
+  query, returning the active subscription with both users loaded, or None.
+
+Saving or deleting a subscription invalidates the doctor's cached set in
+this process; the TTL bounds how long other workers can keep allowing a
+patient who has unsubscribed.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .caching import TTLCache
+from .metrics import record_cache
+from .models import PatientDoctorSubscription
+
+patient_set_cache = TTLCache(
+    maxsize=getattr(settings, 'SUBSCRIPTION_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'SUBSCRIPTION_CACHE_TTL', 60),
+)
+
+
+def roster(doctor):
+    """Patients actively subscribed to ``doctor``, in subscription order."""
+    return get_user_model().objects.filter(
+        doctor_subscriptions__doctor=doctor,
+        doctor_subscriptions__is_active=True,
+        role='patient',
+    ).order_by('doctor_subscriptions__id')
+
+
+def _load_patient_ids(doctor_id):
+    patient_ids = frozenset(
+        PatientDoctorSubscription.objects.filter(doctor_id=doctor_id, is_active=True)
+        .values_list('patient_id', flat=True)
+    )
+    patient_set_cache.set(doctor_id, patient_ids)
+    return patient_ids
+
+
+def patient_ids(doctor_id):
+    """Frozenset of the ids of patients actively subscribed to ``doctor_id``."""
+    cached = patient_set_cache.get(doctor_id)
+    record_cache('subscriptions', hit=cached is not None)
+    return cached if cached is not None else _load_patient_ids(doctor_id)
+
+
+def is_subscribed(doctor_id, patient_id):
+    try:
+        patient_id = int(patient_id)
+    except (TypeError, ValueError):
+        return False
+    cached = patient_set_cache.get(doctor_id)
+    record_cache('subscriptions', hit=cached is not None)
+    if cached is not None and patient_id in cached:
+        return True
+    return patient_id in _load_patient_ids(doctor_id)
+
+
+def get_subscription(patient_id, doctor_id):
+    """The active subscription of ``patient_id`` to ``doctor_id`` with both users, or None."""
+    return (
+        PatientDoctorSubscription.objects.select_related('patient', 'doctor')
+        .filter(
+            patient_id=patient_id, doctor_id=doctor_id, is_active=True,
+            patient__role='patient', doctor__role='doctor',
+        )
+        .first()
+    )
+
+
+def invalidate_patient_set(sender, instance, **kwargs):
+    """``post_save``/``post_delete`` receiver for ``PatientDoctorSubscription``."""
+    patient_set_cache.delete(instance.doctor_id)
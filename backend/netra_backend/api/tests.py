@@ -1,3 +1,1301 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .admission import BucketStore, InferenceGate, Overloaded, TokenBucket
+from .authentication import tokens_for_user, user_cache
+from .benchmarking import parse_importtime
+from .db_router import PrimaryReplicaRouter, reading_from_replica
+from .export import export_chunks, stream_tar
+from . import devices
+from .devices import Device, Replica, ReplicaPool, probe_devices, safe_batch_size
+from .image_derivatives import derivative_name, derivative_url, generate_derivatives
+from .image_validation import ImageRejected, inspect_image, open_for_inference
+from .inference import StubBackend
+from .login_pool import LoginBusy, LoginPool
+from .media_gc import MediaGarbageCollector
+from .media_serving import IMMUTABLE_CACHE_CONTROL, file_url
+from .metrics import INFERENCE_OOM_TOTAL, SHADOW_PREDICTIONS_TOTAL, Registry
+from .middleware import profile_store
+from .model_registry import ModelRegistry, get_registry, sync
+from .models import (
+    DoctorNote, PatientDoctorSubscription, PatientTimeline, RetinalScan, ScanImage, User, WorklistItem,
+)
+from .purge import delete_scans
+from .search import get_engine, index_scans
+from .serializers import ScanImageSerializer
+from .shm_ring import RingFull, ShmRing
+from .subscriptions import is_subscribed, patient_set_cache
+from .tiering import ensure_hot, lock_path, name_lock, tier_images
+from .timeline import record_scan
+from .worklist import sync_scan
+
+
+def make_png(name='scan.png', size=(640, 480), color=(180, 60, 30)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MediaTestCase(TestCase):
+    """Runs each test against a throwaway MEDIA_ROOT."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(
+            MEDIA_ROOT=self.media_root, COLD_STORAGE_ROOT=os.path.join(self.media_root, 'cold'),
+            RATE_LIMIT_DB=os.path.join(self.media_root, 'ratelimit.sqlite3'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+        self.patient = User.objects.create_user(username='pat', password='pw', role='patient')
+        self.nurse = User.objects.create_user(username='nurse', password='pw', role='nurse')
+        self.doctor = User.objects.create_user(username='doc', password='pw', role='doctor')
+        self.admin = User.objects.create_user(username='admin', password='pw', role='admin')
+
+    def auth_for(self, user):
+        return {'HTTP_AUTHORIZATION': f"Bearer {tokens_for_user(user)['access']}"}
+
+
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_use_primary_by_default(self):
+        with patch('api.db_router.replica_configured', return_value=True):
+            self.assertEqual(self.router.db_for_read(RetinalScan), 'default')
+
+    def test_opted_in_reads_use_replica(self):
+        with patch('api.db_router.replica_configured', return_value=True), reading_from_replica():
+            self.assertEqual(self.router.db_for_read(RetinalScan), 'replica')
+
+    def test_replica_reads_fall_back_without_replica_alias(self):
+        with reading_from_replica():
+            self.assertEqual(self.router.db_for_read(RetinalScan), 'default')
+
+    def test_writes_always_use_primary(self):
+        with patch('api.db_router.replica_configured', return_value=True), reading_from_replica():
+            self.assertEqual(self.router.db_for_write(RetinalScan), 'default')
+
+
+class SQLiteTuningTests(TestCase):
+    def test_connection_gets_configured_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+
+class ImageDerivativeTests(MediaTestCase):
+    def test_missing_renditions_are_generated_lazily(self):
+        scan = RetinalScan.objects.create(patient=self.patient, nurse=self.nurse, doctor=self.doctor)
+        image = ScanImage.objects.create(scan=scan, image=make_png(), eye_side='left')
+        name = derivative_name(image.image.name, 'thumbnail')
+        self.assertFalse(image.image.storage.exists(name))
+
+        url = derivative_url(image, 'thumbnail')
+
+        self.assertTrue(url.endswith(name))
+        with image.image.storage.open(name) as fh, Image.open(fh) as thumb:
+            self.assertEqual(max(thumb.size), settings.SCAN_IMAGE_RENDITIONS['thumbnail'])
+
+    def test_originals_sharing_a_stem_get_their_own_renditions(self):
+        scan = RetinalScan.objects.create(patient=self.patient, nurse=self.nurse, doctor=self.doctor)
+        png = ScanImage.objects.create(scan=scan, image=make_png('same.png', color=(200, 0, 0)), eye_side='left')
+        jpg = ScanImage.objects.create(scan=scan, image=make_png('same.jpg', color=(0, 0, 200)), eye_side='right')
+        generate_derivatives(png)
+        generate_derivatives(jpg)
+
+        names = [derivative_name(image.image.name, 'thumbnail') for image in (png, jpg)]
+        self.assertNotEqual(*names)
+        for name, channel in zip(names, (0, 2)):
+            with png.image.storage.open(name) as fh, Image.open(fh) as thumb:
+                self.assertGreater(thumb.convert('RGB').getpixel((0, 0))[channel], 150)
+
+    def test_serializer_exposes_rendition_urls(self):
+        scan = RetinalScan.objects.create(patient=self.patient, nurse=self.nurse, doctor=self.doctor)
+        image = ScanImage.objects.create(scan=scan, image=make_png(), eye_side='right')
+        data = ScanImageSerializer(image).data
+        self.assertIn('rendition=thumbnail', data['thumbnail_url'])
+        self.assertIn('rendition=medium', data['medium_url'])
+
+
+class ScanImageFileTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        scan = RetinalScan.objects.create(patient=self.patient, nurse=self.nurse, doctor=self.doctor)
+        self.image = ScanImage.objects.create(scan=scan, image=make_png(), eye_side='left')
+        self.url = reverse('scan_image_file', args=[self.image.id])
+
+    def signed_url(self, user, **extra):
+        request = RequestFactory().get('/')
+        request.user = user
+        return file_url(request, self.image, **extra)
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_signed_url_applies_scan_access_rules(self):
+        other = User.objects.create_user(username='other', password='pw', role='patient')
+        self.assertEqual(self.client.get(self.signed_url(self.patient)).status_code, 200)
+        self.assertEqual(self.client.get(self.signed_url(other)).status_code, 403)
+
+    def test_versioned_url_is_immutable_and_revalidates(self):
+        response = self.client.get(self.signed_url(self.doctor))
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        cached = self.client.get(self.signed_url(self.doctor), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_rendition_url_is_immutable(self):
+        response = self.client.get(self.signed_url(self.doctor, rendition='thumbnail'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+    @override_settings(MEDIA_ACCESS_MAX_AGE=600)
+    def test_signed_url_expires(self):
+        url = self.signed_url(self.doctor)
+        self.assertEqual(url, self.signed_url(self.doctor))
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with patch('time.time', return_value=time.time() + 601):
+            self.assertEqual(self.client.get(url).status_code, 401)
+            self.assertEqual(self.client.get(self.signed_url(self.doctor)).status_code, 200)
+
+    def test_range_request(self):
+        response = self.client.get(self.signed_url(self.nurse), HTTP_RANGE='bytes=0-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'\x89PNG\r\n\x1a\n')
+
+    @override_settings(MEDIA_SENDFILE_BACKEND='nginx')
+    def test_nginx_offload(self):
+        response = self.client.get(self.signed_url(self.doctor, rendition='thumbnail'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertTrue(response['X-Accel-Redirect'].startswith('/protected-media/derivatives/thumbnail/'))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.doctor = User.objects.create_user(username='doc', password='pw', role='doctor')
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {tokens_for_user(self.doctor)['access']}"}
+
+    def test_repeat_requests_skip_user_query(self):
+        self.client.get(reverse('current_user'), **self.auth)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('current_user'), **self.auth)
+        self.assertEqual(response.json()['role'], 'doctor')
+
+    def test_saving_user_invalidates_cache(self):
+        self.client.get(reverse('current_user'), **self.auth)
+        self.doctor.full_name = 'Dr. Who'
+        self.doctor.save()
+        response = self.client.get(reverse('current_user'), **self.auth)
+        self.assertEqual(response.json()['full_name'], 'Dr. Who')
+
+
+class LoginPoolTests(SimpleTestCase):
+    def test_rejects_when_saturated(self):
+        pool = LoginPool(workers=1, max_pending=0)
+        release = threading.Event()
+        blocker = threading.Thread(target=pool.run, args=(release.wait,))
+        blocker.start()
+        try:
+            with self.assertRaises(LoginBusy):
+                pool.run(lambda: None, retry_after=3)
+        finally:
+            release.set()
+            blocker.join()
+        self.assertEqual(pool.run(lambda: 'ok'), 'ok')
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    LOGIN_HASH_WORKERS=0,
+)
+class LoginTests(TestCase):
+    def test_login_returns_role_claim_tokens(self):
+        User.objects.create_user(username='nurse', password='pw', role='nurse')
+        response = self.client.post(reverse('login'), {'username': 'nurse', 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.json()['tokens']['access'])['role'], 'nurse')
+
+    def test_login_busy_returns_503(self):
+        with patch('api.views.run_login_hash', side_effect=LoginBusy(4)):
+            response = self.client.post(reverse('login'), {'username': 'x', 'password': 'y'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '4')
+
+
+class MetricsTests(TestCase):
+    def test_prometheus_rendering(self):
+        registry = Registry()
+        stages = registry.histogram('stage_seconds', 'Stage time.', ['stage'], buckets=(0.1, 1.0))
+        predictions = registry.counter('predictions_total', 'Predictions.', ['label'])
+        stages.observe(0.5, stage='forward')
+        predictions.inc(label='No DR')
+
+        text = registry.render()
+
+        self.assertIn('stage_seconds_bucket{stage="forward",le="0.1"} 0', text)
+        self.assertIn('stage_seconds_bucket{stage="forward",le="1.0"} 1', text)
+        self.assertIn('stage_seconds_bucket{stage="forward",le="+Inf"} 1', text)
+        self.assertIn('predictions_total{label="No DR"} 1', text)
+
+    def test_endpoint_is_restricted_to_allowed_ips(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE netra_inference_stage_seconds histogram', response.content.decode())
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.9').status_code, 403)
+
+    def test_proxied_requests_are_refused(self):
+        # nginx on the same host connects from loopback, so REMOTE_ADDR alone is not enough.
+        for header in ('HTTP_X_FORWARDED_FOR', 'HTTP_X_REAL_IP'):
+            response = self.client.get(reverse('metrics'), **{header: '203.0.113.7'})
+            self.assertEqual(response.status_code, 403, header)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        wrong = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer nope')
+        self.assertEqual(wrong.status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    REQUEST_PROFILING_ENABLED=True,
+    REQUEST_PROFILING_SAMPLE_RATE=1.0,
+)
+class RequestProfilingTests(TestCase):
+    def setUp(self):
+        profile_store.clear()
+        self.doctor = User.objects.create_user(username='doc', password='pw', role='doctor')
+        self.admin = User.objects.create_user(username='root', password='pw', role='admin')
+
+    def auth(self, user):
+        return {'HTTP_AUTHORIZATION': f"Bearer {tokens_for_user(user)['access']}"}
+
+    def test_sampled_requests_are_profiled(self):
+        response = self.client.get(reverse('scan_stats'), **self.auth(self.doctor))
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+        profiles = self.client.get(
+            reverse('admin_profiles') + '?include_profile=1', **self.auth(self.admin)
+        ).json()['endpoints']
+
+        [record] = profiles['GET api/scan-stats/']
+        self.assertGreaterEqual(record['db_queries'], 3)
+        self.assertIn('function calls', record['profile'])
+
+    def test_profiles_are_admin_only(self):
+        response = self.client.get(reverse('admin_profiles'), **self.auth(self.doctor))
+        self.assertEqual(response.status_code, 403)
+
+
+class ImageValidationTests(SimpleTestCase):
+    def test_inspection_reads_only_the_header(self):
+        with patch('PIL.ImageFile.ImageFile.load', side_effect=AssertionError('decoded')):
+            info = inspect_image(make_png(size=(300, 200)))
+        self.assertEqual((info.format, info.width, info.height), ('PNG', 300, 200))
+
+    def test_rejects_unreadable_and_unsupported_files(self):
+        with self.assertRaises(ImageRejected) as ctx:
+            inspect_image(SimpleUploadedFile('scan.png', b'not an image'))
+        self.assertEqual(ctx.exception.status_code, 400)
+
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, format='GIF')
+        with self.assertRaises(ImageRejected):
+            inspect_image(SimpleUploadedFile('scan.gif', buffer.getvalue()))
+
+    @override_settings(IMAGE_MAX_PIXELS=10_000)
+    def test_rejects_too_many_pixels(self):
+        with self.assertRaises(ImageRejected) as ctx:
+            inspect_image(make_png(size=(200, 100)))
+        self.assertEqual(ctx.exception.status_code, 413)
+
+    @override_settings(INFERENCE_MAX_PIXELS=20_000)
+    def test_large_jpeg_is_downscaled_while_decoding(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 1200), (90, 40, 20)).save(buffer, format='JPEG')
+        upload = SimpleUploadedFile('scan.jpg', buffer.getvalue())
+
+        image = open_for_inference(upload)
+
+        self.assertLessEqual(image.width * image.height, 20_000)
+        self.assertAlmostEqual(image.width / image.height, 4 / 3, places=1)
+        self.assertEqual(upload.tell(), 0)
+
+
+class StubBackendTests(SimpleTestCase):
+    def test_predictions_are_deterministic_per_seed(self):
+        upload = make_png()
+        first = StubBackend(seed=1).predict(upload)
+        self.assertEqual(StubBackend(seed=1).predict(upload), first)
+        self.assertIn(first['prediction_class'], range(5))
+        self.assertEqual(upload.tell(), 0)
+
+
+@override_settings(
+    INFERENCE_BACKEND='stub', INFERENCE_BACKEND_OPTIONS={'seed': 1},
+    MODEL_WARMUP_BATCHES=1, SHADOW_SAMPLE_RATE=1.0,
+)
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = ModelRegistry()
+        self.registry.load_default()
+
+    def test_background_load_swaps_and_rolls_back(self):
+        with self.assertLogs('api.model_registry', 'INFO'):
+            self.registry.load(options={'seed': 2}).join()
+
+        result, version = self.registry.predict(make_png())
+        self.assertEqual(version, 'stub-2')
+        self.assertEqual(result, StubBackend(seed=2).predict(make_png()))
+        self.assertEqual(self.registry.describe()['loaded'], ['stub-1', 'stub-2'])
+
+        with self.assertLogs('api.model_registry', 'INFO'):
+            self.registry.activate('stub-1')
+        self.assertEqual(self.registry.predict(make_png())[1], 'stub-1')
+
+    def test_shadow_model_runs_off_the_request_path(self):
+        with self.assertLogs('api.model_registry', 'INFO'):
+            self.registry.load(options={'seed': 2}, mode='shadow').join()
+        compared = lambda: sum(SHADOW_PREDICTIONS_TOTAL.value(result=r) for r in ('agree', 'disagree'))
+        before = compared()
+
+        with self.assertLogs('api.model_registry', 'INFO') as logs:
+            _, version = self.registry.predict(make_png())
+            self.registry._shadow_executor.shutdown(wait=True)
+
+        self.assertEqual(version, 'stub-1')
+        self.assertEqual(compared(), before + 1)
+        self.assertIn('Shadow disagreement', logs.output[0])
+
+    @override_settings(MODEL_WARMUP_BATCH_SIZES=[1, 4])
+    def test_warm_up_runs_each_batch_size(self):
+        registry = ModelRegistry()
+        with patch.object(StubBackend, 'predict_batch', autospec=True, return_value=[]) as predict_batch:
+            backend = registry.load_default()
+
+        self.assertEqual([len(call.args[1]) for call in predict_batch.call_args_list], [1, 4])
+        self.assertTrue(backend.warmed)
+        self.assertTrue(registry.health()['ready'])
+
+    def test_rejects_unknown_checkpoint(self):
+        with self.assertRaises(ValueError):
+            self.registry.load('../settings.py')
+
+    def test_rejects_options_naming_files_or_hosts(self):
+        for options in ({'checkpoint': '/tmp/evil.pth'}, {'url': 'http://example.com/'}, {'unknown': 1}, ['seed']):
+            with self.subTest(options=options), self.assertRaises(ValueError):
+                self.registry.load(options=options)
+
+
+@override_settings(INFERENCE_BACKEND='stub', INFERENCE_BACKEND_OPTIONS={'seed': 3})
+class UploadScanTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        PatientDoctorSubscription.objects.create(patient=self.patient, doctor=self.doctor)
+
+    def test_upload_runs_inference_through_backend(self):
+        auth = self.auth_for(self.nurse)
+        response = self.client.post(reverse('upload_scan'), {
+            'patient_id': self.patient.id,
+            'doctor_id': self.doctor.id,
+            'left_eye': make_png('left.png'),
+        }, **auth)
+
+        self.assertEqual(response.status_code, 201)
+        scan = RetinalScan.objects.get()
+        expected = StubBackend(seed=3).predict(make_png('left.png'))
+        self.assertEqual(scan.left_eye_prediction_class, expected['prediction_class'])
+        self.assertIsNone(scan.right_eye_prediction)
+
+    @override_settings(IMAGE_MAX_PIXELS=10_000)
+    def test_oversized_image_is_rejected_before_saving(self):
+        auth = self.auth_for(self.nurse)
+        response = self.client.post(reverse('upload_scan'), {
+            'patient_id': self.patient.id,
+            'doctor_id': self.doctor.id,
+            'left_eye': make_png('left.png'),
+        }, **auth)
+
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(RetinalScan.objects.exists())
+
+    def test_upload_requires_active_subscription(self):
+        PatientDoctorSubscription.objects.update(is_active=False)
+        auth = self.auth_for(self.nurse)
+        response = self.client.post(reverse('upload_scan'), {
+            'patient_id': self.patient.id,
+            'doctor_id': self.doctor.id,
+            'left_eye': make_png('left.png'),
+        }, **auth)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(RetinalScan.objects.exists())
+
+
+@override_settings(INFERENCE_BACKEND='stub', INFERENCE_BACKEND_OPTIONS={'seed': 5})
+class RescoreScansTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = os.path.join(self.media_root, 'rescore.json')
+        self.scans = []
+        for color in ('red', 'green'):
+            scan = RetinalScan.objects.create(patient=self.patient, doctor=self.doctor, left_eye_prediction='No DR')
+            ScanImage.objects.create(scan=scan, image=make_png(f'{color}.png', color=color), eye_side='left')
+            self.scans.append(scan)
+
+    def rescore(self, *args):
+        call_command('rescore_scans', '--workers=0', '--chunk-size=1', f'--checkpoint={self.checkpoint}',
+                     *args, stdout=StringIO())
+
+    def test_rescores_and_records_model_version(self):
+        self.rescore()
+
+        for scan, color in zip(self.scans, ('red', 'green')):
+            scan.refresh_from_db()
+            expected = StubBackend(seed=5).predict(make_png(color=color))
+            self.assertEqual(scan.left_eye_prediction_class, expected['prediction_class'])
+            self.assertEqual(scan.ai_details['left_eye'], expected)
+            self.assertEqual(scan.model_version, 'stub-5')
+        with open(self.checkpoint) as fh:
+            state = json.load(fh)
+        self.assertEqual(state['last_scan_id'], self.scans[-1].id)
+        self.assertTrue(state['completed'])
+
+    def test_resumes_after_checkpoint(self):
+        with open(self.checkpoint, 'w') as fh:
+            json.dump({'model_version': 'stub-5', 'last_scan_id': self.scans[0].id,
+                       'scans': 1, 'images': 1, 'failed': 0, 'completed': False}, fh)
+        self.rescore()
+
+        self.assertQuerySetEqual(
+            RetinalScan.objects.order_by('id').values_list('model_version', flat=True), [None, 'stub-5'],
+        )
+
+    def test_decodes_in_a_pool_and_skips_scans_without_images(self):
+        empty = RetinalScan.objects.create(patient=self.patient, doctor=self.doctor)
+        call_command('rescore_scans', '--workers=2', '--batch-size=1', f'--checkpoint={self.checkpoint}',
+                     stdout=StringIO())
+
+        self.assertQuerySetEqual(
+            RetinalScan.objects.order_by('id').values_list('model_version', flat=True), ['stub-5', 'stub-5', None],
+        )
+        empty.refresh_from_db()
+        self.assertIsNone(empty.left_eye_prediction_class)
+
+
+@override_settings(INFERENCE_BACKEND='stub', INFERENCE_BACKEND_OPTIONS={}, MODEL_WARMUP_BATCHES=1)
+class HealthTests(TestCase):
+    def test_liveness(self):
+        self.assertEqual(self.client.get(reverse('health_live')).json(), {'status': 'ok'})
+
+    def test_readiness_waits_for_warm_model(self):
+        response = self.client.get(reverse('health_ready'))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['loaded'])
+
+        get_registry()
+        response = self.client.get(reverse('health_ready'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'ready': True, 'loaded': True, 'warmed': True,
+            'backend': 'stub', 'version': 'stub-0', 'queue_depth': 0,
+            'lanes': {'clinical': {'active': 0, 'waiting': 0}, 'public': {'active': 0, 'waiting': 0}},
+        })
+
+
+class InferenceGateTests(SimpleTestCase):
+    def wait_for(self, gate, lane, waiting):
+        for _ in range(500):
+            if gate.snapshot()[lane]['waiting'] == waiting:
+                return
+            threading.Event().wait(0.01)
+        self.fail(f'{lane} never had {waiting} waiting')
+
+    def test_clinical_waiters_are_served_first(self):
+        lanes = {'clinical': {'max_queued': 2, 'timeout': 5}, 'public': {'max_queued': 2, 'timeout': 5}}
+        gate = InferenceGate(1, lanes)
+        gate.acquire('clinical')
+        order = []
+
+        def request(lane):
+            with gate.slot(lane):
+                order.append(lane)
+
+        public = threading.Thread(target=request, args=('public',))
+        public.start()
+        self.wait_for(gate, 'public', 1)
+        clinical = threading.Thread(target=request, args=('clinical',))
+        clinical.start()
+        self.wait_for(gate, 'clinical', 1)
+        gate.release('clinical', 0.1)
+        public.join()
+        clinical.join()
+
+        self.assertEqual(order, ['clinical', 'public'])
+
+    def test_full_queue_is_rejected_immediately(self):
+        gate = InferenceGate(1, {'public': {'max_queued': 0, 'timeout': 5}})
+        gate.acquire('public')
+        with self.assertRaises(Overloaded) as ctx:
+            gate.acquire('public')
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.store = BucketStore(os.path.join(directory, 'ratelimit.sqlite3'))
+
+    def bucket(self, name='test', rate=0.01, burst=2):
+        return TokenBucket(rate=rate, burst=burst, name=name, store=self.store)
+
+    def test_token_bucket(self):
+        bucket = self.bucket(rate=0.5)
+        self.assertEqual([bucket.consume('bucket-test') for _ in range(3)], [0, 0, 2])
+
+    def test_buckets_are_shared_between_workers(self):
+        first, second = self.bucket(), self.bucket()
+        self.assertEqual([first.consume('key'), second.consume('key'), first.consume('key')], [0, 0, 100])
+        self.assertEqual(self.bucket(name='other').consume('key'), 0)
+
+    def test_refusals_known_locally_skip_the_shared_store(self):
+        bucket = self.bucket()
+        with patch.object(self.store, 'spend', wraps=self.store.spend) as spend:
+            results = [bucket.consume('flood') for _ in range(50)]
+        self.assertEqual(results, [0, 0] + [100] * 48)
+        self.assertEqual(spend.call_count, 2)
+
+
+@override_settings(
+    INFERENCE_BACKEND='stub', INFERENCE_BACKEND_OPTIONS={},
+    RATE_LIMITS={'public': {'rate': 0.01, 'burst': 1}, 'clinical': {'rate': 0.01, 'burst': 1}},
+    TRUSTED_PROXIES=['10.0.0.2'],
+)
+class PredictAdmissionTests(MediaTestCase):
+    def test_anonymous_burst_is_rate_limited(self):
+        self.assertEqual(self.client.post(reverse('predict'), {'image': make_png()}).status_code, 200)
+
+        response = self.client.post(reverse('predict'), {'image': make_png()})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '100')
+
+    def test_clients_behind_a_trusted_proxy_get_their_own_bucket(self):
+        proxied = {'REMOTE_ADDR': '10.0.0.2'}
+        for client in ('203.0.113.7', '203.0.113.8'):
+            response = self.client.post(reverse('predict'), {'image': make_png()},
+                                        HTTP_X_FORWARDED_FOR=f'198.51.100.1, {client}', **proxied)
+            self.assertEqual(response.status_code, 200)
+        # Spoofed leftmost hops do not buy a fresh bucket.
+        response = self.client.post(reverse('predict'), {'image': make_png()},
+                                    HTTP_X_FORWARDED_FOR='192.0.2.99, 203.0.113.7', **proxied)
+        self.assertEqual(response.status_code, 429)
+
+    def test_upload_role_is_checked_before_rate_limiting(self):
+        auth = self.auth_for(self.doctor)
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('upload_scan'), {}, **auth).status_code, 403)
+        self.assertFalse(os.path.exists(settings.RATE_LIMIT_DB))
+
+
+@override_settings(INFERENCE_BACKEND='stub', INFERENCE_BACKEND_OPTIONS={}, MODEL_WARMUP_BATCHES=0)
+class AdminModelsTests(MediaTestCase):
+    def test_admin_only(self):
+        response = self.client.get(reverse('admin_models'), **self.auth_for(self.admin))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['active']['version'], 'stub-0')
+
+        response = self.client.get(reverse('admin_models'), **self.auth_for(self.doctor))
+        self.assertEqual(response.status_code, 403)
+
+    def test_checkpoint_outside_registry_dir_is_refused(self):
+        auth = self.auth_for(self.admin)
+        outside = os.path.join(self.media_root, 'evil.pth')
+        for body in ({'checkpoint': outside}, {'options': {'checkpoint': outside}}):
+            with self.subTest(body=body), patch('api.model_registry.threading.Thread') as thread:
+                response = self.client.post(reverse('admin_models'), body, content_type='application/json', **auth)
+                self.assertEqual(response.status_code, 400)
+                thread.assert_not_called()
+
+    def test_shadow_sample_rate_and_mode_are_validated(self):
+        auth = self.auth_for(self.admin)
+        url = reverse('admin_models')
+        self.addCleanup(get_registry().stop_shadow)
+        bad = (
+            {'version': 'stub-0', 'mode': 'shadow', 'sample_rate': 'often'},
+            {'version': 'stub-0', 'mode': 'shadow', 'sample_rate': '1.5'},
+            {'version': 'stub-0', 'mode': 'bogus'},
+            {'options': {'seed': 2}, 'mode': 'shadow', 'sample_rate': -1},
+        )
+        for body in bad:
+            with self.subTest(body=body), patch('api.model_registry.threading.Thread') as thread:
+                response = self.client.post(url, body, content_type='application/json', **auth)
+                self.assertEqual(response.status_code, 400)
+                thread.assert_not_called()
+        self.assertIsNone(get_registry().shadow)
+
+        # Form-encoded values arrive as strings.
+        with self.assertLogs('api.model_registry', 'INFO'):
+            response = self.client.post(url, {'version': 'stub-0', 'mode': 'shadow', 'sample_rate': '0.5'}, **auth)
+        self.assertEqual(response.json()['shadow']['sample_rate'], 0.5)
+        self.assertEqual(get_registry().predict(make_png())[1], 'stub-0')
+
+    def test_deployment_reaches_other_workers(self):
+        auth = self.auth_for(self.admin)
+        url = reverse('admin_models')
+        with patch('api.model_registry.threading.Thread'):
+            response = self.client.post(url, {'options': {'seed': 2}}, content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 202)
+
+        worker = ModelRegistry()  # another gunicorn worker's registry
+        worker.load_default()
+        with self.assertLogs('api.model_registry', 'INFO'):
+            for thread in sync(worker):
+                thread.join()
+        self.assertEqual(worker.active.version, 'stub-2')
+        self.assertEqual(sync(worker), [])  # not due again yet
+
+        # A rollback on the admin's worker switches the others without a reload.
+        with self.assertLogs('api.model_registry', 'INFO'):
+            self.client.post(url, {'version': 'stub-0'}, content_type='application/json', **auth)
+        worker.next_sync = 0
+        with self.assertLogs('api.model_registry', 'INFO'):
+            self.assertEqual(sync(worker), [])
+        self.assertEqual(worker.active.version, 'stub-0')
+
+
+class PatientTimelineTests(MediaTestCase):
+    def scan(self, left, right, days_ago):
+        scan = RetinalScan.objects.create(
+            patient=self.patient, doctor=self.doctor,
+            left_eye_prediction_class=left, right_eye_prediction_class=right,
+        )
+        RetinalScan.objects.filter(id=scan.id).update(created_at=timezone.now() - timedelta(days=days_ago))
+        scan.refresh_from_db()
+        return scan
+
+    def test_incremental_updates_match_rebuild(self):
+        record_scan(self.scan(1, 0, days_ago=200))
+        record_scan(self.scan(2, None, days_ago=20))
+        last = self.scan(2, 1, days_ago=10)
+        timeline = record_scan(last)
+
+        self.assertEqual((timeline.left_grade, timeline.left_grade_delta), (2, 0))
+        self.assertEqual((timeline.right_grade, timeline.right_grade_delta), (1, 1))
+        self.assertTrue(timeline.progressed)
+        self.assertEqual((timeline.scan_count, timeline.last_scan_id), (3, last.id))
+
+        # A scan older than the latest one forces a rebuild in date order.
+        record_scan(self.scan(4, 4, days_ago=100))
+        timeline = PatientTimeline.objects.get(patient=self.patient)
+        self.assertEqual((timeline.scan_count, timeline.left_grade, timeline.left_grade_delta), (4, 2, 0))
+        self.assertEqual((timeline.right_grade, timeline.right_grade_delta), (1, -3))
+        self.assertFalse(timeline.progressed)
+
+    def test_endpoint_reads_single_row(self):
+        self.scan(0, 0, days_ago=40)
+        self.scan(3, 0, days_ago=5)
+        PatientDoctorSubscription.objects.create(patient=self.patient, doctor=self.doctor)
+        auth = self.auth_for(self.doctor)
+        url = reverse('patient_timeline', args=[self.patient.id])
+
+        # Scans created outside the API: the first read builds the row.
+        self.assertEqual(self.client.get(url, **auth).json()['left_grade_delta'], 3)
+        with self.assertNumQueries(1):  # the user and the subscription check are cached
+            data = self.client.get(url, **auth).json()
+        self.assertEqual(data['left_grade_label'], 'Severe')
+        self.assertEqual((data['days_since_last_scan'], data['days_between_last_scans']), (5, 35))
+        self.assertTrue(data['progressed'])
+
+    def test_doctors_only_see_subscribed_patients(self):
+        record_scan(self.scan(2, 2, days_ago=5))
+        other = User.objects.create_user(username='other', password='pw', role='doctor')
+        auth = self.auth_for(other)
+        response = self.client.get(reverse('patient_timeline', args=[self.patient.id]), **auth)
+        self.assertEqual(response.status_code, 404)
+
+
+class WorklistTests(MediaTestCase):
+    def scan(self, priority, grade, **fields):
+        scan = RetinalScan.objects.create(
+            patient=self.patient, doctor=self.doctor, priority=priority,
+            left_eye_prediction_class=grade, **fields,
+        )
+        sync_scan(scan)
+        return scan
+
+    def test_next_items_are_ranked_by_priority_grade_and_age(self):
+        oldest_medium = self.scan('medium', 1)
+        self.scan('low', 4)
+        severe_medium = self.scan('medium', 3)
+        urgent = self.scan('urgent', 0)
+        self.scan('high', 2, status='reviewed')  # not pending: never queued
+
+        response = self.client.get(reverse('doctor_worklist'), {'limit': 3}, **self.auth_for(self.doctor))
+
+        self.assertEqual([item['scan'] for item in response.json()], [urgent.id, severe_medium.id, oldest_medium.id])
+
+    def test_claim_and_complete(self):
+        auth = self.auth_for(self.doctor)
+        first = self.scan('high', 2)
+        second = self.scan('medium', 2)
+
+        claimed = self.client.post(reverse('worklist_claim'), **auth).json()
+        self.assertEqual(claimed['id'], first.id)
+        # A second claim skips the already claimed scan.
+        self.assertEqual(self.client.post(reverse('worklist_claim'), **auth).json()['id'], second.id)
+        self.assertEqual(self.client.post(reverse('worklist_claim'), **auth).status_code, 409)
+
+        url = reverse('worklist_complete', args=[first.id])
+        self.assertEqual(self.client.post(url, {'status': 'completed'}, **auth).status_code, 200)
+        self.assertEqual(self.client.post(url, **auth).status_code, 409)
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'completed')
+        self.assertEqual(self.client.get(reverse('doctor_worklist'), **auth).json(), [])
+
+    def test_bad_limit_and_scan_id_are_client_errors(self):
+        auth = self.auth_for(self.doctor)
+        scan = self.scan('high', 2)
+        response = self.client.get(reverse('doctor_worklist'), {'limit': -1}, **auth)
+        self.assertEqual([item['scan'] for item in response.json()], [scan.id])
+
+        for scan_id in ('abc', -1, True):
+            response = self.client.post(reverse('worklist_claim'), {'scan_id': scan_id},
+                                        content_type='application/json', **auth)
+            self.assertEqual(response.status_code, 400, scan_id)
+        response = self.client.post(reverse('worklist_claim'), {'scan_id': str(scan.id)},
+                                    content_type='application/json', **auth)
+        self.assertEqual(response.json()['id'], scan.id)
+
+
+class SearchTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient.full_name = 'Amara Okafor'
+        self.patient.save()
+        other = User.objects.create_user(username='jdoe', password='pw', role='patient', full_name='John Doe')
+        self.noted = self.scan(self.patient, 'urgent', 3, note='Microaneurysms in the superior arcade.')
+        self.plain = self.scan(self.patient, 'low', 0)
+        self.other = self.scan(other, 'urgent', 1, note='Follow up: possible microaneurysm.')
+
+    def scan(self, patient, priority, grade, note=None):
+        scan = RetinalScan.objects.create(
+            patient=patient, doctor=self.doctor, priority=priority, left_eye_prediction_class=grade,
+        )
+        if note:
+            DoctorNote.objects.create(scan=scan, doctor=self.doctor, note_text=note)
+        index_scans([scan.id])
+        return scan
+
+    def search(self, **params):
+        return self.client.get(reverse('search_scans'), params, **self.auth_for(self.doctor)).json()
+
+    def test_matches_names_and_note_prefixes_with_facets(self):
+        self.assertEqual(get_engine().name, 'fts5')
+        data = self.search(q='microaneurysm')
+        self.assertEqual({r['id'] for r in data['results']}, {self.noted.id, self.other.id})
+        self.assertEqual(data['facets']['priority'], {'urgent': 2})
+        self.assertEqual(data['facets']['grade'], {'1': 1, '3': 1})
+
+        self.assertEqual([r['id'] for r in self.search(q='okaf', grade=3)['results']], [self.noted.id])
+        self.assertEqual(self.search(q='"okafor')['count'], 2)  # stray FTS syntax is ignored
+        self.assertEqual(self.search(date_to='2000-01-01')['count'], 0)
+
+    def test_negative_limit_is_clamped(self):
+        data = self.search(q='microaneurysm', limit=-5)
+        self.assertEqual((data['count'], len(data['results'])), (2, 1))
+
+    def test_index_follows_writes(self):
+        note_url = reverse('add_doctor_note', args=[self.plain.id])
+        self.client.post(note_url, {'note_text': 'Drusen noted'}, **self.auth_for(self.doctor))
+        self.assertEqual([r['id'] for r in self.search(q='drusen')['results']], [self.plain.id])
+
+        self.patient.full_name = 'Amara Nwosu'
+        self.patient.save(update_fields=['full_name'])
+        self.assertEqual(self.search(q='okafor')['count'], 0)
+        self.assertEqual(self.search(q='nwosu')['count'], 2)
+
+    @override_settings(SEARCH_ENGINE='basic')
+    def test_basic_engine_matches_fts5(self):
+        self.assertEqual(get_engine().name, 'basic')
+        data = self.search(q='microaneurysm', status='pending')
+        self.assertEqual({r['id'] for r in data['results']}, {self.noted.id, self.other.id})
+        self.assertEqual(self.search(q='amara okafor')['count'], 2)
+
+
+class ExportTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scans = []
+        for index in range(3):
+            scan = RetinalScan.objects.create(
+                patient=self.patient, doctor=self.doctor, left_eye_prediction_class=index,
+                ai_details={'left_eye': {'prediction_class': index}},
+            )
+            ScanImage.objects.create(scan=scan, image=make_png(f'export{index}.png'), eye_side='left')
+            self.scans.append(scan)
+        DoctorNote.objects.create(scan=self.scans[0], doctor=self.doctor, note_text='Refer, line 1\nline 2')
+
+    def export(self, **params):
+        response = self.client.get(reverse('admin_export'), params, **self.auth_for(self.admin))
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_chunks_page_through_all_scans(self):
+        with self.assertNumQueries(3 * 2 + 1):  # scans, images, notes per chunk; then an empty page
+            chunks = list(export_chunks(chunk_size=2))
+        self.assertEqual([len(rows) for rows in chunks], [2, 1])
+        first = chunks[0][0]
+        self.assertEqual((first['id'], first['patient_username']), (self.scans[0].id, 'pat'))
+        self.assertEqual(first['notes'][0]['note_text'], 'Refer, line 1\nline 2')
+        self.assertTrue(first['images'][0]['path'].startswith('retina_scans/export0'))
+
+    def test_jsonl_and_csv(self):
+        response, body = self.export(type='jsonl')
+        self.assertIn('attachment; filename="netra-scans-', response['Content-Disposition'])
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['left_eye_prediction_class'] for row in rows], [0, 1, 2])
+
+        _, body = self.export(type='csv', status='pending')
+        rows = list(csv.DictReader(body.decode().splitlines(keepends=True)))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(json.loads(rows[0]['notes'])[0]['note_text'], 'Refer, line 1\nline 2')
+
+        response = self.client.get(reverse('admin_export'), {'type': 'xml'}, **self.auth_for(self.admin))
+        self.assertEqual(response.status_code, 400)
+
+    def test_tar_includes_images(self):
+        _, body = self.export(images='1')
+        with tarfile.open(fileobj=BytesIO(body)) as archive:
+            names = archive.getnames()
+            self.assertEqual(names[0], 'scans/part-00001.jsonl')
+            self.assertEqual(len(archive.extractfile(names[0]).read().splitlines()), 3)
+            image = archive.extractfile(f'images/{self.scans[1].images.get().image.name}')
+            self.assertEqual(Image.open(image).size, (640, 480))
+
+    def test_tar_adds_shared_files_once(self):
+        shared = self.scans[0].images.get().image.name
+        for scan in self.scans[1:]:
+            scan.images.update(image=shared)  # seeded scans share files like this
+        body = b''.join(stream_tar('jsonl', chunk_size=1))
+        with tarfile.open(fileobj=BytesIO(body)) as archive:
+            self.assertEqual([name for name in archive.getnames() if name.startswith('images/')], [f'images/{shared}'])
+
+
+class BulkDeleteAndMediaGCTests(MediaTestCase):
+    def scan(self, patient, image):
+        scan = RetinalScan.objects.create(patient=patient, doctor=self.doctor, left_eye_prediction_class=1)
+        ScanImage.objects.create(scan=scan, image=image, eye_side='left')
+        DoctorNote.objects.create(scan=scan, doctor=self.doctor, note_text='ok')
+        sync_scan(scan)
+        record_scan(scan)
+        return scan
+
+    def age(self, *names):
+        for name in names:
+            path = os.path.join(self.media_root, name)
+            os.utime(path, (0, 0))
+
+    def test_bulk_delete_by_patient(self):
+        auth = self.auth_for(self.admin)
+        other = User.objects.create_user(username='pat2', password='pw', role='patient')
+        for _ in range(3):
+            self.scan(self.patient, make_png())
+        kept = self.scan(other, make_png())
+        url = reverse('admin_bulk_delete_scans')
+
+        self.assertEqual(self.client.post(url, {}, content_type='application/json', **auth).status_code, 400)
+        dry_run = self.client.post(url, {'patient_id': self.patient.id, 'dry_run': True},
+                                   content_type='application/json', **auth).json()
+        self.assertEqual(dry_run['scans'], 3)
+
+        with self.assertLogs('api.purge', 'INFO'):
+            totals = self.client.post(url, {'patient_id': self.patient.id},
+                                      content_type='application/json', **auth).json()
+        self.assertEqual(totals, {'scans': 3, 'images': 3, 'notes': 3, 'patients': 1})
+        self.assertEqual(list(RetinalScan.objects.values_list('id', flat=True)), [kept.id])
+        self.assertEqual(list(WorklistItem.objects.values_list('scan_id', flat=True)), [kept.id])
+        self.assertFalse(PatientTimeline.objects.filter(patient=self.patient).exists())
+
+    def test_bulk_delete_parses_flags_and_ids_strictly(self):
+        auth = self.auth_for(self.admin)
+        scan = self.scan(self.patient, make_png())
+        url = reverse('admin_bulk_delete_scans')
+
+        for body in ({'patient_id': True}, {'scan_ids': [True]}, {'patient_id': self.patient.id, 'dry_run': 'maybe'}):
+            response = self.client.post(url, body, content_type='application/json', **auth)
+            self.assertEqual(response.status_code, 400, body)
+        self.assertTrue(RetinalScan.objects.filter(id=scan.id).exists())
+
+        dry_run = self.client.post(url, {'patient_id': self.patient.id, 'dry_run': 'true'}, **auth).json()
+        self.assertEqual(dry_run['scans'], 1)
+        self.assertTrue(RetinalScan.objects.filter(id=scan.id).exists())
+
+        with self.assertLogs('api.purge', 'INFO'):
+            totals = self.client.post(url, {'patient_id': self.patient.id, 'dry_run': 'false'}, **auth).json()
+        self.assertEqual(totals['scans'], 1)
+        self.assertFalse(RetinalScan.objects.filter(id=scan.id).exists())
+
+    def test_gc_keeps_shared_recent_and_referenced_files(self):
+        shared = self.scan(self.patient, make_png('shared.png'))
+        shared_name = shared.images.get().image.name
+        generate_derivatives(shared.images.get())
+        reuser = self.scan(self.patient, shared_name)  # seeded scans share files like this
+        orphan = self.scan(self.patient, make_png('orphan.png'))
+        orphan_image = orphan.images.get()
+        generate_derivatives(orphan_image)
+        orphan_names = [orphan_image.image.name] + [
+            derivative_name(orphan_image.image.name, rendition) for rendition in ('thumbnail', 'medium')
+        ]
+        young = self.scan(self.patient, make_png('recent.png'))
+        recent = young.images.get().image.name
+
+        self.age(shared_name, *orphan_names, derivative_name(shared_name, 'thumbnail'))
+        with self.assertLogs('api', 'INFO') as logs:
+            delete_scans(RetinalScan.objects.filter(id__in=[shared.id, orphan.id, young.id]))
+            dry_run = MediaGarbageCollector(dry_run=True).run()
+            result = MediaGarbageCollector(batch_size=2).run()
+        self.assertIn('Media garbage collection finished', logs.output[-1])
+
+        self.assertEqual((dry_run.orphaned, dry_run.deleted), (3, 0))
+        self.assertEqual((result.deleted, result.recent), (3, 2))
+        for name in orphan_names:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+        # Still named by the reusing scan, or too young to collect.
+        for name in (shared_name, derivative_name(shared_name, 'thumbnail'), recent):
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, name)), name)
+        self.assertTrue(reuser.images.exists())
+
+
+class StorageTieringTests(MediaTestCase):
+    def image(self, upload, days_ago):
+        scan = RetinalScan.objects.create(patient=self.patient, doctor=self.doctor)
+        RetinalScan.objects.filter(id=scan.id).update(created_at=timezone.now() - timedelta(days=days_ago))
+        scan_image = ScanImage.objects.create(scan=scan, image=upload, eye_side='left')
+        os.utime(scan_image.image.path, (0, 0))
+        return scan_image
+
+    def test_old_png_is_recompressed_and_rehydrated_on_demand(self):
+        gradient = Image.linear_gradient('L').resize((640, 480)).convert('RGB')
+        buffer = BytesIO()
+        gradient.save(buffer, format='PNG')
+        old = self.image(SimpleUploadedFile('old.png', buffer.getvalue()), days_ago=800)
+        recent = self.image(make_png('recent.png'), days_ago=10)
+
+        with self.assertLogs('api.tiering', 'INFO'):
+            result = tier_images(older_than_days=365)
+        self.assertEqual((result.files, result.failed), (1, 0))
+        self.assertLess(result.bytes_after, result.bytes_before)
+        old.refresh_from_db()
+        self.assertEqual((old.storage_tier, old.cold_name), ('cold', f'{old.image.name}.webp'))
+        self.assertFalse(os.path.exists(old.image.path))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, derivative_name(old.image.name, 'thumbnail'))))
+        recent.refresh_from_db()
+        self.assertEqual(recent.storage_tier, 'hot')
+
+        auth = self.auth_for(self.doctor)
+        data = self.client.get(reverse('scan_detail', args=[old.scan_id]), **auth).json()
+        self.assertEqual(data['images'][0]['storage_tier'], 'cold')
+        self.assertEqual(data['images'][0]['image_url'], data['images'][0]['file_url'])
+
+        with self.assertLogs('api.tiering', 'INFO'):
+            response = self.client.get(reverse('scan_image_file', args=[old.id]), **auth)
+        restored = Image.open(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(restored.format, 'PNG')
+        self.assertEqual(restored.tobytes(), gradient.tobytes())
+        old.refresh_from_db()
+        self.assertEqual((old.storage_tier, old.cold_name), ('hot', None))
+
+    def test_color_profile_and_metadata_survive_the_cold_tier(self):
+        from PIL import ImageCms, PngImagePlugin
+
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        gradient = Image.linear_gradient('L').resize((640, 480)).convert('RGB')
+        uploads = {}
+        for name, options in (('icc.png', {'icc_profile': icc}), ('text.png', {'pnginfo': PngImagePlugin.PngInfo()})):
+            if 'pnginfo' in options:
+                options['pnginfo'].add_text('Camera', 'Topcon TRC-NW400')
+            buffer = BytesIO()
+            gradient.save(buffer, format='PNG', **options)
+            uploads[name] = self.image(SimpleUploadedFile(name, buffer.getvalue()), days_ago=800)
+
+        with self.assertLogs('api.tiering', 'INFO'):
+            tier_images(older_than_days=365)
+        profiled, annotated = (ScanImage.objects.get(id=image.id) for image in uploads.values())
+        self.assertEqual(profiled.cold_name, f'{profiled.image.name}.webp')
+        self.assertEqual(annotated.cold_name, annotated.image.name)  # WebP cannot carry text chunks
+
+        for scan_image in (profiled, annotated):
+            with self.assertLogs('api.tiering', 'INFO'):
+                ensure_hot(scan_image)
+        with Image.open(profiled.image.path) as restored:
+            self.assertEqual(restored.info['icc_profile'], icc)
+            self.assertEqual(restored.tobytes(), gradient.tobytes())
+        with Image.open(annotated.image.path) as restored:
+            self.assertEqual(restored.info['Camera'], 'Topcon TRC-NW400')
+
+    def test_moves_and_restores_are_serialized_across_processes(self):
+        probe = (
+            'import fcntl, sys\n'
+            'with open(sys.argv[1], "a") as fh:\n'
+            '    try:\n'
+            '        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)\n'
+            '    except BlockingIOError:\n'
+            '        sys.exit(1)\n'
+        )
+        name = 'retina_scans/old.png'
+        with name_lock(name):
+            held = subprocess.run([sys.executable, '-c', probe, lock_path(name)])
+        free = subprocess.run([sys.executable, '-c', probe, lock_path(name)])
+        self.assertEqual((held.returncode, free.returncode), (1, 0))
+
+    def test_jpeg_moves_byte_for_byte(self):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), (10, 120, 200)).save(buffer, format='JPEG')
+        old = self.image(SimpleUploadedFile('old.jpg', buffer.getvalue()), days_ago=800)
+
+        with self.assertLogs('api.tiering', 'INFO'):
+            tier_images(older_than_days=365)
+        old.refresh_from_db()
+        self.assertEqual(old.cold_name, old.image.name)
+        with open(os.path.join(self.media_root, 'cold', old.cold_name), 'rb') as fh:
+            self.assertEqual(fh.read(), buffer.getvalue())
+
+
+class SubscriptionAccessTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        patient_set_cache.clear()
+        self.addCleanup(patient_set_cache.clear)
+
+    def add_patients(self, count):
+        for _ in range(count):
+            patient = User.objects.create_user(username=f'pat{User.objects.count()}', role='patient')
+            PatientDoctorSubscription.objects.create(patient=patient, doctor=self.doctor)
+            scan = RetinalScan.objects.create(patient=patient, nurse=self.nurse, doctor=self.doctor)
+            ScanImage.objects.create(scan=scan, image=f'retinal_scans/{patient.username}.png', eye_side='left')
+            DoctorNote.objects.create(scan=scan, doctor=self.doctor, note_text='ok')
+
+    def count_queries(self, url):
+        auth = self.auth_for(self.doctor)
+        self.client.get(url, **auth)  # warm the JWT user cache
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, **auth).status_code, 200)
+        return len(queries)
+
+    def test_rosters_and_scan_lists_take_constant_queries(self):
+        self.add_patients(2)
+        few = [self.count_queries(reverse(name)) for name in ('doctor_patients', 'all_scans')]
+        self.add_patients(8)
+        many = [self.count_queries(reverse(name)) for name in ('doctor_patients', 'all_scans')]
+        self.assertEqual(few, many)
+        self.assertEqual(len(self.client.get(reverse('doctor_patients'), **self.auth_for(self.doctor)).json()), 10)
+
+    def test_history_is_limited_to_subscribed_patients(self):
+        auth = self.auth_for(self.doctor)
+        subscription = PatientDoctorSubscription.objects.create(patient=self.patient, doctor=self.doctor)
+        RetinalScan.objects.create(patient=self.patient, doctor=self.doctor)
+        url = reverse('patient_history', args=[self.patient.id])
+        self.assertEqual(len(self.client.get(url, **auth).json()), 1)
+
+        subscription.is_active = False
+        subscription.save()
+        self.assertFalse(is_subscribed(self.doctor.id, self.patient.id))
+        self.assertEqual(self.client.get(url, **auth).status_code, 404)
+
+    def test_subscription_made_elsewhere_is_seen_despite_cached_set(self):
+        self.assertFalse(is_subscribed(self.doctor.id, self.patient.id))
+        # bulk_create sends no signals, like a write from another worker.
+        PatientDoctorSubscription.objects.bulk_create([
+            PatientDoctorSubscription(patient=self.patient, doctor=self.doctor),
+        ])
+        self.assertTrue(is_subscribed(self.doctor.id, self.patient.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_subscribed(self.doctor.id, self.patient.id))
+
+
+class StartupImportTests(SimpleTestCase):
+    def test_web_profile_starts_without_the_ml_stack(self):
+        code = (
+            'import sys, django; django.setup(); import netra_backend.urls; '
+            'print(sorted(name for name in ("torch", "timm", "numpy", "PIL") if name in sys.modules))'
+        )
+        proc = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'netra_backend.settings_web'},
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertEqual(proc.stdout.strip().splitlines()[-1], '[]')
+
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |     numpy.core\n'
+            'import time:      1878 |      78032 |   numpy\n'
+        )
+        self.assertEqual(parse_importtime(output), [('numpy.core', 120, 120), ('numpy', 1878, 78032)])
+
+
+@override_settings(INFERENCE_MEMORY_HEADROOM=0.2, INFERENCE_MAX_BATCH_SIZE=32, INFERENCE_CONCURRENCY=2)
+class DeviceManagerTests(SimpleTestCase):
+    def write(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            fh.write(text)
+
+    def test_numa_nodes_and_cgroup_limits_are_probed_from_sysfs(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        for node, cpus in ((0, '0-1'), (1, '2-3,6')):
+            self.write(f'{root}/node/node{node}/cpulist', cpus)
+            self.write(f'{root}/node/node{node}/meminfo',
+                       f'Node {node} MemTotal: 8192 kB\nNode {node} MemFree: {1024 * (node + 1)} kB\n')
+        self.write(f'{root}/meminfo', 'MemTotal: 16384 kB\nMemFree: 1024 kB\nMemAvailable: 12288 kB\n')
+        self.write(f'{root}/cgroup/memory.max', str(8 * 1024 * 1024))
+        self.write(f'{root}/cgroup/memory.current', str(2 * 1024 * 1024))
+
+        with patch.object(devices, 'NUMA_ROOT', f'{root}/node'), \
+                patch.object(devices, 'PROC_MEMINFO', f'{root}/meminfo'), \
+                patch.object(devices, 'CGROUP_ROOT', f'{root}/cgroup'):
+            nodes = probe_devices('numa')
+            self.assertEqual([(d.numa_node, d.cpus) for d in nodes], [(0, (0, 1)), (1, (2, 3, 6))])
+            self.assertEqual(nodes[1].memory(), (2048 * 1024, 8192 * 1024))
+            self.assertEqual(Device('cpu').memory(), (6 * 1024 * 1024, 8 * 1024 * 1024))
+        self.assertEqual([d.name for d in probe_devices('cuda:0, cuda:1')], ['cuda:0', 'cuda:1'])
+
+    def test_batch_size_fits_free_memory(self):
+        mb = 1024 * 1024
+        self.assertEqual(safe_batch_size(100 * mb, mb), 32)
+        self.assertEqual(safe_batch_size(100 * mb, mb, sharers=4), 16)
+        self.assertEqual(safe_batch_size(mb, 10 * mb), 1)
+        self.assertEqual(safe_batch_size(None, mb, cap=8), 8)
+
+    def test_replica_halves_its_batch_size_after_out_of_memory(self):
+        import numpy as np
+
+        batches = []
+
+        def predict(model, arrays, device):
+            if len(arrays) > 4:
+                raise MemoryError
+            batches.append(len(arrays))
+            return [int(a[0, 0, 0]) for a in arrays]
+
+        replica = Replica(Device('cpu'), model=object())
+        self.addCleanup(replica.close)
+        arrays = [np.full((8, 8, 3), i, dtype=np.uint8) for i in range(10)]
+        before = INFERENCE_OOM_TOTAL.value(device='cpu')
+        with patch.object(Device, 'memory', return_value=None), self.assertLogs('api.devices', 'WARNING'):
+            self.assertEqual(replica.predict_batch(predict, arrays), list(range(10)))
+        self.assertEqual((replica.max_batch_size, batches), (4, [4, 4, 2]))
+        self.assertEqual(INFERENCE_OOM_TOTAL.value(device='cpu') - before, 1)
+
+    def test_pool_dispatches_to_least_loaded_replica(self):
+        with self.assertLogs('api.devices', 'INFO'):
+            pool = ReplicaPool.load(lambda device: object(), devices=[Device('cpu')], per_device=2)
+        self.addCleanup(pool.close)
+        busy, idle = pool.replicas
+        release = threading.Event()
+        blocked = busy.submit(release.wait)
+
+        for _ in range(3):
+            self.assertIs(pool.predict(lambda model, image, device: model, 'image'), idle.model)
+        release.set()
+        blocked.result()
+
+        import numpy as np
+
+        arrays = [np.full((2, 2, 3), i, dtype=np.uint8) for i in range(5)]
+        with patch.object(Device, 'memory', return_value=None):
+            results = pool.predict_batch(lambda model, batch, device: [int(a[0, 0, 0]) for a in batch], arrays)
+        self.assertEqual(results, list(range(5)))
+
+
+class ShmRingTests(SimpleTestCase):
+    def make_ring(self, slots=3):
+        ring = ShmRing.create(slots, (3, 6, 8))
+        self.addCleanup(ring.close)
+        return ring
+
+    def test_uploads_are_written_into_slots_and_batched_without_copies(self):
+        import numpy as np
+
+        ring = self.make_ring()
+        slots = [ring.put_image(make_png(size=(8, 6), color=(10 * i, 20, 30))) for i in range(2)]
+        self.assertEqual(slots, [0, 1])
+
+        consumer = ShmRing.attach(ring.name)
+        self.addCleanup(consumer.close)
+        self.assertEqual((consumer.slots, consumer.slot_shape, consumer.dtype), (3, (3, 6, 8), np.float32))
+        batch = consumer.batch(slots)
+        self.assertEqual(batch.shape, (2, 3, 6, 8))
+        self.assertTrue(np.shares_memory(batch, consumer.view(0)))
+        self.assertEqual(batch[1, :, 0, 0].tolist(), [10.0, 20.0, 30.0])
+
+        consumer.release(slots)
+        self.assertEqual(ring.in_use(), 0)
+
+    def test_smaller_images_fit_a_slot_and_a_full_ring_refuses_more(self):
+        from PIL import Image
+
+        ring = self.make_ring(slots=2)
+        slot = ring.put(Image.new('RGB', (4, 2), (1, 2, 3)))
+        self.assertEqual(ring.shape_of(slot), (3, 2, 4))
+        self.assertEqual(ring.batch([slot]).shape, (1, 3, 2, 4))
+        with self.assertRaises(ValueError):
+            ring.put(Image.new('RGB', (16, 16)))
+
+        ring.acquire()
+        with self.assertRaises(RingFull):
+            ring.acquire(timeout=0.01)
+        ring.release([slot])
+        self.assertEqual(ring.acquire(), slot)
+
+    def test_threads_claim_distinct_slots_and_empty_batches_are_empty(self):
+        ring = self.make_ring(slots=64)
+        claimed = []
+
+        def claim():
+            for _ in range(16):
+                claimed.append(ring.acquire(timeout=1))
+
+        threads = [threading.Thread(target=claim) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), list(range(64)))
+        self.assertEqual(ring.batch([]).shape, (0, 3, 6, 8))
@@ -0,0 +1,288 @@
+"""
+Tiered storage for scan image originals.
+
+``manage.py tier_scan_images`` (run from cron) moves originals whose newest
+scan is older than ``TIERING_AFTER_DAYS`` from MEDIA_ROOT to
+``COLD_STORAGE_ROOT``. RGB/RGBA PNG, TIFF and BMP files are re-encoded as
+lossless WebP on the way, but only when that is smaller, decodes to
+identical pixels and restores with the same metadata. WebP carries the ICC
+profile and EXIF; files with anything else (text chunks, a custom DPI,
+gamma) keep their original bytes. JPEGs, which cannot be transcoded
+without loss, and anything else are moved byte for byte. Preview renditions are rendered
+before the move and stay hot, so dashboards and thumbnails never touch the
+cold tier.
+
+Rehydration is transparent. The ``scan-images/<id>/file/`` endpoint calls
+``ensure_hot``, which restores the original under its hot name (converted
+back to its original format if it was transcoded) before serving it, so
+serializer URLs never change. A restored file is not moved out again for
+``TIERING_KEEP_REHYDRATED_DAYS``.
+
+Seeded scans share image files, so tiering works per stored name: every
+``ScanImage`` row naming a file moves with it. Moving a name out and
+restoring it hold the same file lock (``name_lock``), so the cron job and
+web workers in other processes never interleave on one original.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Max
+from django.utils import timezone
+
+from .image_derivatives import ensure_derivative, renditions
+from .metrics import STORAGE_TIER_BYTES_SAVED_TOTAL, STORAGE_TIER_MOVES_TOTAL
+from .models import ScanImage
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TRANSCODE_FORMATS = ('PNG', 'TIFF', 'BMP')
+COLD_SUFFIX = '.webp'
+
+LOCK_STRIPES = 64
+
+_thread_lock = threading.Lock()
+
+
+@dataclass
+class TieringResult:
+    files: int = 0
+    skipped: int = 0
+    failed: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+    def as_dict(self):
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+
+def hot_storage():
+    return ScanImage._meta.get_field('image').storage
+
+
+def cold_storage():
+    return FileSystemStorage(location=settings.COLD_STORAGE_ROOT)
+
+
+def stored_path(name, storage_tier='hot', cold_name=None):
+    """Filesystem path currently holding the bytes of the original called ``name``."""
+    if storage_tier == 'cold':
+        return cold_storage().path(cold_name)
+    return hot_storage().path(name)
+
+
+def open_original(scan_image):
+    """Open ``scan_image``'s original for reading, from whichever tier holds it."""
+    return open(stored_path(scan_image.image.name, scan_image.storage_tier, scan_image.cold_name), 'rb')
+
+
+def lock_path(name):
+    """Lock file guarding the original called ``name`` (names share one of ``LOCK_STRIPES`` files)."""
+    stripe = zlib.crc32(name.encode()) % LOCK_STRIPES
+    return os.path.join(settings.COLD_STORAGE_ROOT, '.locks', f'{stripe:02d}.lock')
+
+
+@contextmanager
+def name_lock(name):
+    """Hold the cross-process lock for moving or restoring the original called ``name``."""
+    if fcntl is None:
+        with _thread_lock:
+            yield
+        return
+    path = lock_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _write_atomic(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}'
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _save_as(image, fp, fmt):
+    """Write ``image`` as ``fmt`` the way a restore does, keeping its ICC profile and EXIF."""
+    options = {key: image.info[key] for key in ('icc_profile', 'exif') if image.info.get(key)}
+    if fmt == 'TIFF':
+        options['compression'] = 'tiff_adobe_deflate'
+    image.save(fp, format=fmt, **options)
+
+
+def _metadata(image):
+    # How the pixels are compressed is not metadata; a restored TIFF may use another codec.
+    return {key: value for key, value in image.info.items() if key != 'compression'}
+
+
+def encode_for_cold(data):
+    """Return ``(bytes, suffix)`` to store: lossless WebP with suffix ``.webp`` if smaller, else ``data``."""
+    from PIL import Image, features
+
+    if not features.check('webp'):
+        return data, ''
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if (image.format not in TRANSCODE_FORMATS or image.mode not in ('RGB', 'RGBA')
+                    or getattr(image, 'n_frames', 1) > 1):
+                return data, ''
+            image.load()
+            buffer = BytesIO()
+            # Lossless effort: higher settings cost ~50% more time on fundus images for <0.1% smaller files.
+            carried = {key: image.info[key] for key in ('icc_profile', 'exif') if image.info.get(key)}
+            image.save(buffer, format='WEBP', lossless=True, quality=50, method=3, **carried)
+            encoded = buffer.getvalue()
+            if len(encoded) >= len(data):
+                return data, ''
+            restored = BytesIO()
+            with Image.open(BytesIO(encoded)) as check:
+                if check.mode != image.mode or check.tobytes() != image.tobytes():
+                    return data, ''
+                _save_as(check, restored, image.format)
+            with Image.open(restored) as check:
+                if _metadata(check) != _metadata(image):
+                    return data, ''
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return data, ''
+    return encoded, COLD_SUFFIX
+
+
+def move_to_cold(name):
+    """Move the original called ``name`` to cold storage; returns ``(bytes_before, bytes_after)``."""
+    hot_path = hot_storage().path(name)
+    with open(hot_path, 'rb') as fh:
+        original = fh.read()
+    data, suffix = encode_for_cold(original)
+    cold_name = name + suffix
+    cold_path = cold_storage().path(cold_name)
+
+    def write(tmp):
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    # A restore between flipping the row and unlinking the hot file would
+    # otherwise lose the file it just wrote.
+    with name_lock(name):
+        _write_atomic(cold_path, write)
+        moved = ScanImage.objects.filter(image=name, storage_tier='hot').update(
+            storage_tier='cold', cold_name=cold_name,
+        )
+        if not moved:
+            os.remove(cold_path)
+            return 0, 0
+        os.remove(hot_path)
+    STORAGE_TIER_MOVES_TOTAL.inc(tier='cold')
+    STORAGE_TIER_BYTES_SAVED_TOTAL.inc(len(original) - len(data))
+    return len(original), len(data)
+
+
+def _restore(name, cold_name):
+    from PIL import Image
+
+    cold_path = cold_storage().path(cold_name)
+    hot_path = hot_storage().path(name)
+    if cold_name == name:
+        _write_atomic(hot_path, lambda tmp: shutil.copyfile(cold_path, tmp))
+    else:
+        fmt = Image.registered_extensions()[os.path.splitext(name)[1].lower()]
+
+        def write(tmp):
+            with Image.open(cold_path) as image:
+                _save_as(image, tmp, fmt)
+        _write_atomic(hot_path, write)
+    ScanImage.objects.filter(image=name, storage_tier='cold').update(storage_tier='hot', cold_name=None)
+    try:
+        os.remove(cold_path)
+    except FileNotFoundError:
+        pass
+    STORAGE_TIER_MOVES_TOTAL.inc(tier='hot')
+
+
+def ensure_hot(scan_image):
+    """Restore ``scan_image``'s original to the hot tier if needed; returns its storage name."""
+    name = scan_image.image.name
+    if scan_image.storage_tier != 'cold':
+        return name
+    with name_lock(name):
+        # Another worker may have restored it while this one waited.
+        row = ScanImage.objects.filter(id=scan_image.id).values('storage_tier', 'cold_name').first()
+        if row and row['storage_tier'] == 'cold':
+            _restore(name, row['cold_name'])
+            logger.info("Scan image rehydrated", extra={'fields': {'scan_image_id': scan_image.id, 'name': name}})
+    scan_image.storage_tier = 'hot'
+    scan_image.cold_name = None
+    return name
+
+
+def tiering_candidates(older_than_days):
+    """Hot originals whose newest scan is older than ``older_than_days``, oldest first."""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return (
+        ScanImage.objects.filter(storage_tier='hot')
+        .values('image').annotate(newest=Max('scan__created_at')).filter(newest__lt=cutoff)
+        .order_by('newest').values_list('image', flat=True)
+    )
+
+
+def tier_images(older_than_days=None, limit=None, dry_run=False):
+    """Move eligible originals to cold storage; returns a ``TieringResult``."""
+    if older_than_days is None:
+        older_than_days = settings.TIERING_AFTER_DAYS
+    keep_rehydrated = time.time() - settings.TIERING_KEEP_REHYDRATED_DAYS * 86400
+    result = TieringResult()
+    names = tiering_candidates(older_than_days)
+    if limit:
+        names = names[:limit]
+    # Materialized first: rows leave the candidate set as they are moved.
+    for name in list(names):
+        try:
+            stat = os.stat(hot_storage().path(name))
+        except FileNotFoundError:
+            result.failed += 1
+            continue
+        if stat.st_mtime > keep_rehydrated:
+            result.skipped += 1  # restored recently, or uploaded late for an old scan
+            continue
+        if dry_run:
+            result.files += 1
+            result.bytes_before += stat.st_size
+            continue
+        try:
+            scan_image = ScanImage.objects.filter(image=name).first()
+            for rendition in renditions():
+                ensure_derivative(scan_image, rendition)
+            before, after = move_to_cold(name)
+        except Exception:
+            logger.exception("Could not move scan image to cold storage", extra={'fields': {'name': name}})
+            result.failed += 1
+            continue
+        if before:
+            result.files += 1
+            result.bytes_before += before
+            result.bytes_after += after
+    logger.info("Scan images tiered", extra={'fields': {**result.as_dict(), 'dry_run': dry_run}})
+    return result
@@ -0,0 +1,60 @@
+"""
+Per-patient scan timeline (``PatientTimeline``).
+
+``record_scan`` folds a newly analyzed scan into the patient's row in
+constant time, so the timeline endpoint reads a single row instead of
+serializing the whole history. Anything that rewrites history, such as
+re-scoring, deleting a scan or a scan arriving out of order, calls
+``rebuild_timeline`` to refold the patient's scans from scratch.
+"""
+from django.db import transaction
+
+from .models import PatientTimeline, RetinalScan
+
+
+def _fold(timeline, scan_id, created_at, left, right):
+    """Advance ``timeline`` by one scan (the newest so far)."""
+    timeline.left_grade_delta = (
+        left - timeline.left_grade if left is not None and timeline.left_grade is not None else None
+    )
+    timeline.right_grade_delta = (
+        right - timeline.right_grade if right is not None and timeline.right_grade is not None else None
+    )
+    if left is not None:
+        timeline.left_grade = left
+    if right is not None:
+        timeline.right_grade = right
+    timeline.progressed = any(
+        delta is not None and delta > 0 for delta in (timeline.left_grade_delta, timeline.right_grade_delta)
+    )
+    timeline.previous_scan_at = timeline.last_scan_at
+    timeline.last_scan_id = scan_id
+    timeline.last_scan_at = created_at
+    timeline.scan_count += 1
+
+
+def record_scan(scan):
+    """Fold a freshly analyzed ``scan`` into its patient's timeline."""
+    with transaction.atomic():
+        timeline, _ = PatientTimeline.objects.select_for_update().get_or_create(patient_id=scan.patient_id)
+        if timeline.last_scan_at is not None and scan.created_at < timeline.last_scan_at:
+            return rebuild_timeline(scan.patient_id)
+        _fold(timeline, scan.id, scan.created_at, scan.left_eye_prediction_class, scan.right_eye_prediction_class)
+        timeline.save()
+    return timeline
+
+
+def rebuild_timeline(patient_id):
+    """Recompute a patient's timeline from all their scans; returns None if they have none."""
+    scans = RetinalScan.objects.filter(patient_id=patient_id).order_by('created_at', 'id').values_list(
+        'id', 'created_at', 'left_eye_prediction_class', 'right_eye_prediction_class',
+    )
+    with transaction.atomic():
+        timeline = PatientTimeline(patient_id=patient_id)
+        for row in scans.iterator():
+            _fold(timeline, *row)
+        if not timeline.scan_count:
+            PatientTimeline.objects.filter(patient_id=patient_id).delete()
+            return None
+        timeline.save()
+    return timeline
@@ -20,6 +20,7 @@ urlpatterns = [
     path('scans/<int:scan_id>/update/', views.update_scan, name='update_scan'),
     path('scans/<int:scan_id>/notes/', views.add_doctor_note, name='add_doctor_note'),
     path('scan-stats/', views.scan_stats, name='scan_stats'),
+    path('scan-images/<int:image_id>/file/', views.scan_image_file, name='scan_image_file'),
 
     # Patient-Doctor subscriptions
     path('subscriptions/', views.patient_subscriptions, name='patient_subscriptions'),
@@ -28,10 +29,26 @@ urlpatterns = [
 
     # Doctor features
     path('doctor/patients/', views.doctor_patients, name='doctor_patients'),
+    path('doctor/worklist/', views.doctor_worklist, name='doctor_worklist'),
+    path('doctor/worklist/claim/', views.worklist_claim, name='worklist_claim'),
+    path('doctor/worklist/<int:scan_id>/complete/', views.worklist_complete, name='worklist_complete'),
+    path('doctor/worklist/<int:scan_id>/release/', views.worklist_release, name='worklist_release'),
+    path('doctor/search/', views.search_scans, name='search_scans'),
     path('doctor/patients/<int:patient_id>/history/', views.patient_scan_history, name='patient_history'),
+    path('doctor/patients/<int:patient_id>/timeline/', views.patient_timeline, name='patient_timeline'),
 
     # Admin features
     path('admin/scans/', views.admin_all_scans, name='admin_all_scans'),
     path('admin/scans/<int:scan_id>/delete/', views.delete_scan, name='delete_scan'),
+    path('admin/scans/bulk-delete/', views.admin_bulk_delete_scans, name='admin_bulk_delete_scans'),
+    path('admin/export/', views.admin_export, name='admin_export'),
     path('admin/stats/', views.admin_stats, name='admin_stats'),
+    path('admin/profiles/', views.admin_profiles, name='admin_profiles'),
+    path('admin/models/', views.admin_models, name='admin_models'),
+    path('admin/models/shadow/', views.admin_models_shadow, name='admin_models_shadow'),
+
+    # Operations
+    path('metrics/', views.metrics, name='metrics'),
+    path('health/live/', views.health_live, name='health_live'),
+    path('health/ready/', views.health_ready, name='health_ready'),
 ]
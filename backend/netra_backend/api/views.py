@@ -1,20 +1,37 @@
+import hmac
+
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.db import router
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_GET
 from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import RefreshToken
 
-from .model_loader import load_model, predict_image
-from .models import RetinalScan, ScanImage, DoctorNote, PatientDoctorSubscription
+from .admission import admission_controlled, get_gate
+from .authentication import tokens_for_user
+from .db_router import reading_from_replica, replica_reads
+from .image_derivatives import ensure_derivative, generate_derivatives
+from .image_validation import ImageRejected, inspect_image
+from .login_pool import LoginBusy, run_login_hash
+from .media_serving import is_valid_access_token, serve_protected_file
+from .metrics import registry as metrics_registry
+from .middleware import profile_store
+from .model_registry import deploy, get_registry, health, publish
+from .models import RetinalScan, ScanImage, DoctorNote, PatientDoctorSubscription, PatientTimeline
 from .serializers import (
     RetinalScanSerializer, UserSerializer, RegisterSerializer,
-    ScanImageSerializer, DoctorNoteSerializer, PatientDoctorSubscriptionSerializer
+    ScanImageSerializer, DoctorNoteSerializer, PatientDoctorSubscriptionSerializer,
+    PatientTimelineSerializer, ScanSearchResultSerializer, WorklistItemSerializer
 )
+from .timeline import rebuild_timeline, record_scan
+from . import export, purge, search, subscriptions, tiering, worklist
 
 User = get_user_model()
-model = load_model()
 
 
 @api_view(['POST'])
@@ -24,14 +41,10 @@ def register(request):
     serializer = RegisterSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.save()
-        refresh = RefreshToken.for_user(user)
         return Response({
             'message': 'User created successfully',
             'user': UserSerializer(user).data,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            }
+            'tokens': tokens_for_user(user)
         }, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -45,15 +58,18 @@ def login(request):
     username = request.data.get('username')
     password = request.data.get('password')
 
-    user = authenticate(username=username, password=password)
+    try:
+        user = run_login_hash(authenticate, username=username, password=password)
+    except LoginBusy as exc:
+        return Response(
+            {'error': 'Too many logins in progress. Please retry shortly.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(exc.retry_after)}
+        )
     if user:
-        refresh = RefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            }
+            'tokens': tokens_for_user(user)
         })
     return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
@@ -68,6 +84,7 @@ def get_current_user(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def list_users_by_role(request, role):
     """List all users by role (patient/nurse/doctor)"""
     users = User.objects.filter(role=role)
@@ -77,6 +94,7 @@ def list_users_by_role(request, role):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@admission_controlled
 def predict(request):
     """Run prediction on a single uploaded image (no DB save)"""
     try:
@@ -84,8 +102,10 @@ def predict(request):
         if not image:
             return Response({"error": "No image file provided."}, status=400)
 
-        result = predict_image(model, image)
-        return Response(result)
+        result, version = get_registry().predict(image)
+        return Response(result, headers={'X-Model-Version': version or ''})
+    except ImageRejected as e:
+        return Response({"error": str(e)}, status=e.status_code)
     except Exception as e:
         return Response({"error": str(e)}, status=400)
 
@@ -94,9 +114,14 @@ def predict(request):
 @permission_classes([IsAuthenticated])
 def upload_scan(request):
     """Nurse uploads scan images for a patient"""
+    # Checked before admission, so other roles neither queue nor spend tokens.
     if request.user.role != 'nurse':
         return Response({'error': 'Only nurses can upload scans.'}, status=403)
+    return _store_and_analyze_scan(request)
+
 
+@admission_controlled
+def _store_and_analyze_scan(request):
     patient_id = request.data.get('patient_id')
     doctor_id = request.data.get('doctor_id')
     patient_age = request.data.get('patient_age')
@@ -111,13 +136,21 @@ def upload_scan(request):
     if not left_eye and not right_eye:
         return Response({'error': 'At least one eye image is required.'}, status=400)
 
-    patient = get_object_or_404(User, id=patient_id, role='patient')
-    doctor = get_object_or_404(User, id=doctor_id, role='doctor')
+    for side, image in (('left_eye', left_eye), ('right_eye', right_eye)):
+        if image:
+            try:
+                inspect_image(image)
+            except ImageRejected as e:
+                return Response({'error': f'{side}: {e}'}, status=e.status_code)
+
+    subscription = subscriptions.get_subscription(patient_id, doctor_id)
+    if subscription is None:
+        return Response({'error': 'Patient is not subscribed to this doctor.'}, status=404)
 
     scan = RetinalScan.objects.create(
-        patient=patient,
+        patient=subscription.patient,
         nurse=request.user,
-        doctor=doctor,
+        doctor=subscription.doctor,
         patient_age=int(patient_age) if patient_age else None,
         patient_diabetes_duration=int(diabetes_duration) if diabetes_duration else None,
         status='pending',
@@ -128,12 +161,13 @@ def upload_scan(request):
     ai_results = {}
 
     if left_eye:
-        result_left = predict_image(model, left_eye)
+        result_left, model_version = get_registry().predict(left_eye)
         scan_image = ScanImage.objects.create(
             scan=scan,
             image=left_eye,
             eye_side='left'
         )
+        generate_derivatives(scan_image)
         image_urls.append(scan_image.image.url)
 
         scan.left_eye_prediction = result_left.get('prediction')
@@ -141,12 +175,13 @@ def upload_scan(request):
         ai_results['left_eye'] = result_left
 
     if right_eye:
-        result_right = predict_image(model, right_eye)
+        result_right, model_version = get_registry().predict(right_eye)
         scan_image = ScanImage.objects.create(
             scan=scan,
             image=right_eye,
             eye_side='right'
         )
+        generate_derivatives(scan_image)
         image_urls.append(scan_image.image.url)
 
         scan.right_eye_prediction = result_right.get('prediction')
@@ -154,7 +189,11 @@ def upload_scan(request):
         ai_results['right_eye'] = result_right
 
     scan.ai_details = ai_results
+    scan.model_version = model_version
     scan.save()
+    record_scan(scan)
+    worklist.sync_scan(scan)
+    search.index_scans([scan.id])
 
     serializer = RetinalScanSerializer(scan, context={'request': request})
     return Response({
@@ -165,30 +204,33 @@ def upload_scan(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def my_scans(request):
     """Patients can view their own scans"""
     if request.user.role != 'patient':
         return Response({'error': 'Only patients can view their scans.'}, status=403)
 
-    scans = RetinalScan.objects.filter(patient=request.user).prefetch_related('images', 'doctor_notes')
+    scans = RetinalScanSerializer.eager_load(RetinalScan.objects.filter(patient=request.user))
     serializer = RetinalScanSerializer(scans, many=True, context={'request': request})
     return Response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def nurse_scans(request):
     """Nurses can view scans they uploaded"""
     if request.user.role != 'nurse':
         return Response({'error': 'Only nurses can view their uploads.'}, status=403)
 
-    scans = RetinalScan.objects.filter(nurse=request.user).prefetch_related('images', 'doctor_notes')
+    scans = RetinalScanSerializer.eager_load(RetinalScan.objects.filter(nurse=request.user))
     serializer = RetinalScanSerializer(scans, many=True, context={'request': request})
     return Response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def all_scans(request):
     """Doctors can view all scans assigned to them"""
     if request.user.role != 'doctor':
@@ -197,7 +239,7 @@ def all_scans(request):
     priority_filter = request.GET.get('priority')
     status_filter = request.GET.get('status')
 
-    scans = RetinalScan.objects.filter(doctor=request.user).prefetch_related('images', 'doctor_notes')
+    scans = RetinalScanSerializer.eager_load(RetinalScan.objects.filter(doctor=request.user))
 
     if priority_filter:
         scans = scans.filter(priority=priority_filter)
@@ -208,23 +250,166 @@ def all_scans(request):
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def doctor_worklist(request):
+    """Next pending scans for this doctor, most urgent first"""
+    if request.user.role != 'doctor':
+        return Response({'error': 'Only doctors have a worklist.'}, status=403)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        return Response({'error': 'limit must be an integer.'}, status=400)
+
+    items = worklist.next_items(request.user, limit)
+    serializer = WorklistItemSerializer(items, many=True)
+    return Response(serializer.data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def worklist_claim(request):
+    """Doctor claims the next scan in their worklist, or a specific scan_id"""
+    if request.user.role != 'doctor':
+        return Response({'error': 'Only doctors can claim scans.'}, status=403)
+
+    scan_id = request.data.get('scan_id')
+    if scan_id is not None and not str(scan_id).isdigit():
+        return Response({'error': 'scan_id must be an integer.'}, status=400)
+
+    scan_id = worklist.claim(request.user, int(scan_id) if scan_id is not None else None)
+    if scan_id is None:
+        return Response({'error': 'No scan available to claim.'}, status=status.HTTP_409_CONFLICT)
+
+    scan = RetinalScanSerializer.eager_load(RetinalScan.objects.all()).get(id=scan_id)
+    serializer = RetinalScanSerializer(scan, context={'request': request})
+    return Response(serializer.data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def worklist_complete(request, scan_id):
+    """Doctor finishes a claimed scan, setting its status"""
+    if request.user.role != 'doctor':
+        return Response({'error': 'Only doctors can complete scans.'}, status=403)
+
+    scan_status = request.data.get('status', 'reviewed')
+    if scan_status not in ('reviewed', 'completed'):
+        return Response({'error': 'status must be reviewed or completed.'}, status=400)
+
+    if not worklist.complete(request.user, scan_id, scan_status):
+        return Response({'error': 'Scan is not claimed by you.'}, status=status.HTTP_409_CONFLICT)
+    return Response({'message': 'Scan completed.', 'status': scan_status})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def worklist_release(request, scan_id):
+    """Doctor hands a claimed scan back to the worklist"""
+    if request.user.role != 'doctor':
+        return Response({'error': 'Only doctors can release scans.'}, status=403)
+
+    if not worklist.release(request.user, scan_id):
+        return Response({'error': 'Scan is not claimed by you.'}, status=status.HTTP_409_CONFLICT)
+    return Response({'message': 'Scan released.'})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@replica_reads
+def search_scans(request):
+    """Doctors search their scans (admins all scans) by patient and note text, with facets"""
+    if request.user.role not in ('doctor', 'admin'):
+        return Response({'error': 'Only doctors and admins can search scans.'}, status=403)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        grade = int(request.GET['grade']) if request.GET.get('grade') else None
+    except ValueError:
+        return Response({'error': 'limit, offset and grade must be integers.'}, status=400)
+
+    dates = {}
+    for name in ('date_from', 'date_to'):
+        value = request.GET.get(name)
+        if value:
+            try:
+                dates[name] = parse_date(value)
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                return Response({'error': f'{name} must be a date (YYYY-MM-DD).'}, status=400)
+
+    scans = RetinalScan.objects.all()
+    if request.user.role == 'doctor':
+        scans = scans.filter(doctor=request.user)
+
+    results, facets = search.search(
+        scans,
+        text=request.GET.get('q', ''),
+        priority=request.GET.get('priority'),
+        status=request.GET.get('status'),
+        grade=grade,
+        **dates
+    )
+    count = sum(facets['status'].values())
+    serializer = ScanSearchResultSerializer(results.select_related('patient')[offset:offset + limit], many=True)
+    return Response({'count': count, 'results': serializer.data, 'facets': facets})
+
+
+def can_view_scan(user, scan):
+    """Patients see their own scans, nurses their uploads, doctors their assigned scans."""
+    if user.role == 'patient':
+        return scan.patient_id == user.id
+    if user.role == 'nurse':
+        return scan.nurse_id == user.id
+    if user.role == 'doctor':
+        return scan.doctor_id == user.id
+    return True
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def scan_detail(request, scan_id):
     """Get detailed information about a specific scan"""
-    scan = get_object_or_404(RetinalScan, id=scan_id)
+    scan = get_object_or_404(RetinalScanSerializer.eager_load(RetinalScan.objects.all()), id=scan_id)
 
-    if request.user.role == 'patient' and scan.patient != request.user:
-        return Response({'error': 'Access denied'}, status=403)
-    elif request.user.role == 'nurse' and scan.nurse != request.user:
-        return Response({'error': 'Access denied'}, status=403)
-    elif request.user.role == 'doctor' and scan.doctor != request.user:
+    if not can_view_scan(request.user, scan):
         return Response({'error': 'Access denied'}, status=403)
 
     serializer = RetinalScanSerializer(scan, context={'request': request})
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def scan_image_file(request, image_id):
+    """Serve a scan image (or one of its renditions) after the scan_detail access check"""
+    scan_image = get_object_or_404(ScanImage.objects.select_related('scan'), id=image_id)
+
+    user = request.user
+    if not user.is_authenticated:
+        user_id = request.GET.get('u')
+        token = request.GET.get('access')
+        if not user_id or not token or not is_valid_access_token(token, user_id, scan_image.id):
+            return Response({'error': 'Authentication required.'}, status=401)
+        user = get_object_or_404(User, id=user_id, is_active=True)
+
+    if not can_view_scan(user, scan_image.scan):
+        return Response({'error': 'Access denied'}, status=403)
+
+    rendition = request.GET.get('rendition')
+    if rendition:
+        name = ensure_derivative(scan_image, rendition)
+        if name is None:
+            return Response({'error': 'Unknown rendition.'}, status=404)
+    else:
+        name = tiering.ensure_hot(scan_image)
+
+    return serve_protected_file(request, scan_image.image.storage, name)
+
+
 @api_view(['PATCH'])
 @permission_classes([IsAuthenticated])
 def update_scan(request, scan_id):
@@ -243,6 +428,7 @@ def update_scan(request, scan_id):
         scan.status = scan_status
 
     scan.save()
+    worklist.sync_scan(scan)
 
     serializer = RetinalScanSerializer(scan, context={'request': request})
     return Response({
@@ -269,6 +455,7 @@ def add_doctor_note(request, scan_id):
         doctor=request.user,
         note_text=note_text
     )
+    search.index_scans([scan.id])
 
     serializer = DoctorNoteSerializer(note)
     return Response({
@@ -344,34 +531,31 @@ def unsubscribe_from_doctor(request, subscription_id):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def doctor_patients(request):
     """Get all patients subscribed to this doctor"""
     if request.user.role != 'doctor':
         return Response({'error': 'Only doctors can view their patients.'}, status=403)
 
-    subscriptions = PatientDoctorSubscription.objects.filter(
-        doctor=request.user,
-        is_active=True
-    ).select_related('patient')
-
-    patients = [sub.patient for sub in subscriptions]
-    serializer = UserSerializer(patients, many=True)
+    serializer = UserSerializer(subscriptions.roster(request.user), many=True)
     return Response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def patient_scan_history(request, patient_id):
     """Doctor views a specific patient's scan history"""
     if request.user.role != 'doctor':
         return Response({'error': 'Only doctors can view patient history.'}, status=403)
 
-    patient = get_object_or_404(User, id=patient_id, role='patient')
+    if not subscriptions.is_subscribed(request.user.id, patient_id):
+        return Response({'error': 'Patient is not subscribed to you.'}, status=404)
 
-    scans = RetinalScan.objects.filter(
-        patient=patient,
+    scans = RetinalScanSerializer.eager_load(RetinalScan.objects.filter(
+        patient_id=patient_id,
         doctor=request.user
-    ).prefetch_related('images', 'doctor_notes')
+    ))
 
     serializer = RetinalScanSerializer(scans, many=True, context={'request': request})
     return Response(serializer.data)
@@ -379,6 +563,30 @@ def patient_scan_history(request, patient_id):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+def patient_timeline(request, patient_id):
+    """Doctor views a patient's latest grades and progression since the previous scan"""
+    if request.user.role != 'doctor':
+        return Response({'error': 'Only doctors can view patient timelines.'}, status=403)
+
+    if not subscriptions.is_subscribed(request.user.id, patient_id):
+        return Response({'error': 'Patient is not subscribed to you.'}, status=404)
+
+    with reading_from_replica():
+        timeline = PatientTimeline.objects.filter(patient_id=patient_id).first()
+    if timeline is None:
+        # Not built yet for patients whose scans predate the timeline table;
+        # built from the primary, since it is written there.
+        timeline = rebuild_timeline(patient_id)
+        if timeline is None:
+            return Response({'error': 'No scans for this patient.'}, status=404)
+
+    serializer = PatientTimelineSerializer(timeline)
+    return Response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@replica_reads
 def scan_stats(request):
     """Get scan statistics for doctors"""
     if request.user.role != 'doctor':
@@ -397,6 +605,7 @@ def scan_stats(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
 def admin_all_scans(request):
     """Admins can view all scans in the system"""
     if request.user.role != 'admin':
@@ -405,7 +614,7 @@ def admin_all_scans(request):
     priority_filter = request.GET.get('priority')
     status_filter = request.GET.get('status')
 
-    scans = RetinalScan.objects.all().prefetch_related('images', 'doctor_notes')
+    scans = RetinalScanSerializer.eager_load(RetinalScan.objects.all())
 
     if priority_filter:
         scans = scans.filter(priority=priority_filter)
@@ -424,13 +633,113 @@ def delete_scan(request, scan_id):
         return Response({'error': 'Only admins can delete scans.'}, status=403)
 
     scan = get_object_or_404(RetinalScan, id=scan_id)
-    scan.delete()
+    purge.delete_scans(RetinalScan.objects.filter(id=scan.id))
 
     return Response({'message': 'Scan deleted successfully.'}, status=status.HTTP_200_OK)
 
 
+def _parse_id(value, name):
+    # Strict: JSON true would otherwise become id 1.
+    if isinstance(value, bool) or not str(value).isdigit():
+        raise ValueError(f'{name} must be an integer id.')
+    return int(value)
+
+
+def _parse_flag(value, name):
+    # Strict: the form-encoded string "false" is truthy.
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in ('true', '1'):
+        return True
+    if text in ('false', '0', ''):
+        return False
+    raise ValueError(f'{name} must be true or false.')
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def admin_bulk_delete_scans(request):
+    """Admins delete scans by id list, patient and/or date range (dry_run only counts them)"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can delete scans.'}, status=403)
+
+    scan_ids = request.data.get('scan_ids')
+    patient_id = request.data.get('patient_id')
+    date_from = request.data.get('date_from')
+    date_to = request.data.get('date_to')
+    if not any((scan_ids, patient_id, date_from, date_to)):
+        return Response({'error': 'Provide scan_ids, patient_id, date_from or date_to.'}, status=400)
+
+    scans = RetinalScan.objects.all()
+    try:
+        dry_run = _parse_flag(request.data.get('dry_run'), 'dry_run')
+        if scan_ids:
+            if not isinstance(scan_ids, list):
+                raise ValueError('scan_ids must be a list.')
+            scans = scans.filter(id__in=[_parse_id(scan_id, 'scan_ids') for scan_id in scan_ids])
+        if patient_id:
+            scans = scans.filter(patient_id=_parse_id(patient_id, 'patient_id'))
+        for name, lookup in (('date_from', 'created_at__date__gte'), ('date_to', 'created_at__date__lte')):
+            value = request.data.get(name)
+            if value:
+                day = parse_date(value)
+                if day is None:
+                    raise ValueError(f'{name} must be a date (YYYY-MM-DD).')
+                scans = scans.filter(**{lookup: day})
+    except (TypeError, ValueError) as e:
+        return Response({'error': str(e)}, status=400)
+
+    if dry_run:
+        return Response({'dry_run': True, 'scans': scans.count()})
+    return Response(purge.delete_scans(scans))
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@replica_reads
+def admin_export(request):
+    """Stream every scan with predictions, notes and image paths (optionally a tar with the images)"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can export scans.'}, status=403)
+
+    format_name = request.GET.get('type', 'jsonl')  # DRF reserves ?format=
+    images = request.GET.get('images') == '1'
+    dates = {}
+    try:
+        export.get_format(format_name)
+        for name in ('date_from', 'date_to'):
+            if request.GET.get(name):
+                dates[name] = parse_date(request.GET[name])
+                if dates[name] is None:
+                    raise ValueError(f'{name} must be a date (YYYY-MM-DD).')
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    scans = export.filter_scans(
+        RetinalScan.objects.all(),
+        status=request.GET.get('status'),
+        priority=request.GET.get('priority'),
+        **dates
+    )
+    # The body is generated after the view returns, outside @replica_reads,
+    # so pin the alias chosen now.
+    using = router.db_for_read(RetinalScan)
+    if images:
+        stream = export.stream_tar(format_name, scans, using=using)
+        content_type = 'application/x-tar'
+    else:
+        stream = export.stream_export(format_name, scans, using=using)
+        content_type = export.FORMATS[format_name].content_type
+
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{export.export_filename(format_name, images)}"'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@replica_reads
 def admin_stats(request):
     """Get system-wide statistics for admins"""
     if request.user.role != 'admin':
@@ -453,3 +762,97 @@ def admin_stats(request):
         'pending_scans': pending_scans,
         'urgent_scans': urgent_scans
     })
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def admin_profiles(request):
+    """Slowest profiled requests per endpoint (requires REQUEST_PROFILING_ENABLED)"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can view request profiles.'}, status=403)
+
+    if request.method == 'DELETE':
+        profile_store.clear()
+        return Response({'message': 'Profiles cleared.'})
+
+    samples = profile_store.snapshot()
+    endpoint = request.GET.get('endpoint')
+    if endpoint:
+        samples = {key: value for key, value in samples.items() if key == endpoint}
+    if request.GET.get('include_profile') != '1':
+        samples = {
+            key: [{k: v for k, v in record.items() if k != 'profile'} for record in records]
+            for key, records in samples.items()
+        }
+
+    return Response({
+        'enabled': settings.REQUEST_PROFILING_ENABLED,
+        'sample_rate': settings.REQUEST_PROFILING_SAMPLE_RATE,
+        'endpoints': samples
+    })
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def admin_models(request):
+    """Inspect the model registry, or load a checkpoint to activate or shadow"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can manage models.'}, status=403)
+
+    registry = get_registry()
+    if request.method == 'GET':
+        return Response(registry.describe())
+
+    mode = request.data.get('mode', 'activate')
+    version = request.data.get('version')
+    try:
+        deploy(
+            registry, mode, version, request.data.get('checkpoint'), request.data.get('options'),
+            request.data.get('sample_rate'),
+        )
+    except KeyError:
+        return Response({'error': f'Version {version} is not loaded.'}, status=404)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    # A loaded version (e.g. a rollback) switches at once; a checkpoint loads in the background.
+    return Response(registry.describe(), status=status.HTTP_200_OK if version else status.HTTP_202_ACCEPTED)
+
+
+@api_view(['DELETE'])
+@permission_classes([IsAuthenticated])
+def admin_models_shadow(request):
+    """Stop sending shadow traffic to the candidate model"""
+    if request.user.role != 'admin':
+        return Response({'error': 'Only admins can manage models.'}, status=403)
+
+    registry = get_registry()
+    registry.stop_shadow()
+    publish(registry, shadow=None)
+    return Response({'message': 'Shadow model stopped.'})
+
+
+@require_GET
+def metrics(request):
+    """Prometheus scrape endpoint for this worker's metrics"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponse(status=403)
+    # A local reverse proxy connects from loopback too; only direct scrapes count.
+    if 'HTTP_X_FORWARDED_FOR' in request.META or 'HTTP_X_REAL_IP' in request.META:
+        return HttpResponse(status=403)
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@require_GET
+def health_live(request):
+    """Liveness probe: the worker process is serving requests"""
+    return JsonResponse({'status': 'ok'})
+
+
+@require_GET
+def health_ready(request):
+    """Readiness probe: 503 until this worker's model is loaded and warmed"""
+    state = {**health(), 'lanes': get_gate().snapshot()}
+    return JsonResponse(state, status=200 if state['ready'] else 503)
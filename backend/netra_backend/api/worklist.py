@@ -0,0 +1,124 @@
+"""
+Doctor worklists: a materialized queue of pending scans per doctor.
+
+``WorklistItem`` rows are kept in step with their scans by ``sync_scan``
+(upload, priority/status edits) and ``refresh_grades`` (re-scoring). Items
+rank by priority, then AI grade (the worse eye), then waiting time. The
+``worklist_next_idx`` index stores them in exactly that order, so "next N"
+reads N index entries however long the queue is.
+
+Claiming and completing are single conditional UPDATE/DELETE statements, so
+two requests racing for the same scan (a doctor's second tab or device)
+cannot both win, and no row locks are held between requests. Claims that are
+never completed return to the queue after ``WORKLIST_CLAIM_TIMEOUT`` seconds.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RetinalScan, WorklistItem
+
+PRIORITY_RANKS = {'low': 0, 'medium': 1, 'high': 2, 'urgent': 3}
+NEXT_ORDERING = ('-priority_rank', '-grade', 'queued_at')
+
+
+def scan_grade(scan):
+    """The worse of the two eyes' predicted classes, -1 if neither is graded."""
+    grades = [g for g in (scan.left_eye_prediction_class, scan.right_eye_prediction_class) if g is not None]
+    return max(grades, default=-1)
+
+
+def sync_scan(scan):
+    """Queue, re-rank or drop ``scan``'s item to match its current fields."""
+    if scan.status != 'pending' or scan.doctor_id is None:
+        WorklistItem.objects.filter(scan_id=scan.id).delete()
+        return None
+    item, _ = WorklistItem.objects.update_or_create(scan_id=scan.id, defaults={
+        'doctor_id': scan.doctor_id,
+        'priority_rank': PRIORITY_RANKS.get(scan.priority, 1),
+        'grade': scan_grade(scan),
+        'queued_at': scan.created_at,
+    })
+    return item
+
+
+def enqueue_scans(scans, batch_size=1000):
+    """Bulk-queue freshly created pending scans (e.g. seeded data)."""
+    WorklistItem.objects.bulk_create([
+        WorklistItem(
+            scan_id=scan.id, doctor_id=scan.doctor_id, priority_rank=PRIORITY_RANKS.get(scan.priority, 1),
+            grade=scan_grade(scan), queued_at=scan.created_at,
+        )
+        for scan in scans if scan.status == 'pending' and scan.doctor_id is not None
+    ], batch_size=batch_size, ignore_conflicts=True)
+
+
+def refresh_grades(scans):
+    """Re-rank the queued items of ``scans`` after their predictions changed."""
+    grades = {scan.id: scan_grade(scan) for scan in scans}
+    items = list(WorklistItem.objects.filter(scan_id__in=grades))
+    for item in items:
+        item.grade = grades[item.scan_id]
+    WorklistItem.objects.bulk_update(items, ['grade'])
+
+
+def _claim_cutoff():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'WORKLIST_CLAIM_TIMEOUT', 1800))
+
+
+def release_stale_claims(doctor):
+    return WorklistItem.objects.filter(
+        doctor=doctor, state='claimed', claimed_at__lt=_claim_cutoff(),
+    ).update(state='queued', claimed_at=None)
+
+
+def next_items(doctor, limit):
+    """The ``limit`` highest-ranked queued items for ``doctor``."""
+    release_stale_claims(doctor)
+    return (
+        WorklistItem.objects.filter(doctor=doctor, state='queued')
+        .order_by(*NEXT_ORDERING)
+        .select_related('scan__patient')[:limit]
+    )
+
+
+def claim(doctor, scan_id=None, attempts=5):
+    """
+    Claim ``scan_id``, or the best queued item when omitted. Returns the
+    claimed scan id, or None if nothing could be claimed. Losing a race for
+    the head of the queue moves on to the next candidate.
+    """
+    release_stale_claims(doctor)
+    if scan_id is not None:
+        candidates = [scan_id]
+    else:
+        candidates = list(
+            WorklistItem.objects.filter(doctor=doctor, state='queued')
+            .order_by(*NEXT_ORDERING).values_list('scan_id', flat=True)[:attempts]
+        )
+    for candidate in candidates:
+        claimed = WorklistItem.objects.filter(scan_id=candidate, doctor=doctor, state='queued').update(
+            state='claimed', claimed_at=timezone.now(),
+        )
+        if claimed:
+            return candidate
+    return None
+
+
+def complete(doctor, scan_id, status='reviewed'):
+    """Close a claimed item and set its scan's status in one transaction; False if not claimed by ``doctor``."""
+    with transaction.atomic():
+        removed, _ = WorklistItem.objects.filter(scan_id=scan_id, doctor=doctor, state='claimed').delete()
+        if not removed:
+            return False
+        RetinalScan.objects.filter(id=scan_id).update(status=status, updated_at=timezone.now())
+    return True
+
+
+def release(doctor, scan_id):
+    """Hand a claimed item back to the queue."""
+    return bool(WorklistItem.objects.filter(scan_id=scan_id, doctor=doctor, state='claimed').update(
+        state='queued', claimed_at=None,
+    ))
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +50,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.RequestProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,12 +85,88 @@ WSGI_APPLICATION = 'netra_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# SQLite is used unless NETRA_DB_ENGINE is set (e.g. to 'postgresql'). Each
+# alias reads NETRA_DB_* variables; the optional read replica reads
+# NETRA_DB_REPLICA_* and falls back to the primary's value for anything unset.
+# Connections are kept open for NETRA_DB_CONN_MAX_AGE seconds and health
+# checked before reuse, so workers don't reconnect on every request; on
+# PostgreSQL, NETRA_DB_POOL=1 switches to a psycopg connection pool instead.
+
+DB_ENGINES = {
+    'sqlite': 'django.db.backends.sqlite3',
+    'postgresql': 'django.db.backends.postgresql',
+}
+
+
+def _database_config(prefix, fallback=None):
+    fallback = fallback or {}
+
+    def env(name, default=None):
+        return os.environ.get(f'{prefix}{name}', fallback.get(name, default))
+
+    engine = env('ENGINE', 'sqlite')
+    config = {
+        'ENGINE': DB_ENGINES.get(engine, engine),
+        'CONN_MAX_AGE': int(env('CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
+    if config['ENGINE'] == DB_ENGINES['sqlite']:
+        config['NAME'] = env('NAME', BASE_DIR / 'db.sqlite3')
+        # Take the write lock at BEGIN so concurrent writers wait on
+        # busy_timeout instead of failing with "database is locked".
+        config['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
+    else:
+        config.update({
+            'NAME': env('NAME', 'netra'),
+            'USER': env('USER', ''),
+            'PASSWORD': env('PASSWORD', ''),
+            'HOST': env('HOST', 'localhost'),
+            'PORT': env('PORT', '5432'),
+        })
+        if env('POOL', '').lower() in ('1', 'true', 'yes'):
+            # Server-side pool (requires psycopg 3 with the "pool" extra);
+            # Django refuses persistent connections together with a pool.
+            config['CONN_MAX_AGE'] = 0
+            config['OPTIONS'] = {
+                'pool': {
+                    'min_size': int(env('POOL_MIN_SIZE', 2)),
+                    'max_size': int(env('POOL_MAX_SIZE', 10)),
+                },
+            }
+    return config
+
+
+_PRIMARY_ENV = {
+    name[len('NETRA_DB_'):]: value
+    for name, value in os.environ.items()
+    if name.startswith('NETRA_DB_') and not name.startswith('NETRA_DB_REPLICA_')
+}
+
+DATABASES = {
+    'default': _database_config('NETRA_DB_'),
+}
+
+if os.environ.get('NETRA_DB_REPLICA_NAME') or os.environ.get('NETRA_DB_REPLICA_HOST'):
+    DATABASES['replica'] = _database_config('NETRA_DB_REPLICA_', fallback=_PRIMARY_ENV)
+    # Tests run against a single database; the replica mirrors it there.
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['api.db_router.PrimaryReplicaRouter']
+
+# SQLite tuning applied to every new connection (see api/sqlite_tuning.py).
+# Set SQLITE_PRAGMAS = {} to keep SQLite's defaults. journal_mode=wal is
+# persisted in the database file; the rest only apply to the connection they
+# are run on, hence the per-connection hook.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': int(os.environ.get('NETRA_SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative = KiB, i.e. 64 MiB
+    'temp_store': 'memory',
 }
+SQLITE_OPTIMIZE_INTERVAL = 3600  # seconds between PRAGMA optimize runs
 
 
 # Password validation
@@ -109,6 +188,165 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Inference backend used by the predict/upload views (see api/inference.py):
+# 'torch' (checkpoint), 'exported' (TorchScript/ONNX), 'remote' (HTTP worker)
+# or 'stub' (deterministic fake for CI and load tests), or a dotted path.
+# settings_web.py and settings_inference.py preset this for split deployments.
+INFERENCE_BACKEND = os.environ.get('NETRA_INFERENCE_BACKEND', 'torch')
+INFERENCE_BACKEND_OPTIONS = {
+    'torch': {},
+    'exported': {'checkpoint': os.environ.get('NETRA_EXPORTED_MODEL', str(BASE_DIR / 'api' / 'netra_dr.onnx'))},
+    'remote': {'url': os.environ.get('NETRA_INFERENCE_URL'), 'timeout': 30},
+    'stub': {
+        'seed': int(os.environ.get('NETRA_STUB_SEED', 0)),
+        'latency_ms': float(os.environ.get('NETRA_STUB_LATENCY_MS', 0)),
+        'jitter_ms': float(os.environ.get('NETRA_STUB_JITTER_MS', 0)),
+    },
+}.get(INFERENCE_BACKEND, {})
+
+# Model registry (api/model_registry.py): admins load checkpoints from this
+# directory via /api/admin/models/ to hot-swap or shadow them without a
+# restart. Every model, including the one loaded when a worker starts, is
+# first warmed with MODEL_WARMUP_BATCHES dummy batches of each of
+# MODEL_WARMUP_BATCH_SIZES; /api/health/ready/ reports 503 until then.
+MODEL_REGISTRY_DIR = os.environ.get('NETRA_MODEL_REGISTRY_DIR', str(BASE_DIR / 'api' / 'checkpoints'))
+MODEL_REGISTRY_KEEP = int(os.environ.get('NETRA_MODEL_REGISTRY_KEEP', 2))  # loaded versions kept in memory
+MODEL_WARMUP_BATCHES = int(os.environ.get('NETRA_MODEL_WARMUP_BATCHES', 2))
+MODEL_WARMUP_BATCH_SIZES = [int(v) for v in os.environ.get('NETRA_MODEL_WARMUP_BATCH_SIZES', '1').split(',')]
+MODEL_WARMUP_SIZE = os.environ.get('NETRA_MODEL_WARMUP_SIZE', '224x224')
+MODEL_WARMUP_ON_STARTUP = os.environ.get('NETRA_MODEL_WARMUP_ON_STARTUP', '1').lower() in ('1', 'true', 'yes')
+SHADOW_SAMPLE_RATE = float(os.environ.get('NETRA_SHADOW_SAMPLE_RATE', 0.1))
+SHADOW_MAX_PENDING = 4  # shadow predictions queued before new samples are skipped
+# Workers re-read the deployed model (set through /api/admin/models/) at
+# most this often, so a switch reaches every worker within this many seconds.
+MODEL_SYNC_INTERVAL = float(os.environ.get('NETRA_MODEL_SYNC_INTERVAL', 5))
+
+# Devices and batching for the torch/exported backends (api/devices.py).
+# INFERENCE_DEVICES is 'auto' (all GPUs, else mps, else cpu), 'numa' (one CPU
+# replica per NUMA node, pinned to its cores) or e.g. 'cuda:0,cuda:1'. Batch
+# sizes are picked per call from free device memory: HEADROOM is kept free,
+# and each image is assumed to need ACTIVATION_FACTOR times its float32 input.
+# Out-of-memory batches are retried at half the size.
+INFERENCE_DEVICES = os.environ.get('NETRA_INFERENCE_DEVICES', 'auto')
+INFERENCE_REPLICAS_PER_DEVICE = int(os.environ.get('NETRA_INFERENCE_REPLICAS_PER_DEVICE', 1))
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('NETRA_INFERENCE_MAX_BATCH_SIZE', 32))
+INFERENCE_MEMORY_HEADROOM = float(os.environ.get('NETRA_INFERENCE_MEMORY_HEADROOM', 0.2))
+INFERENCE_ACTIVATION_FACTOR = int(os.environ.get('NETRA_INFERENCE_ACTIVATION_FACTOR', 64))
+
+
+# Admission control for predict/ and upload-scan/ (api/admission.py). At most
+# INFERENCE_CONCURRENCY predictions run per worker; nurses and doctors queue in
+# the 'clinical' lane, which is always served before 'public' (anonymous and
+# other users). Full queues and timeouts answer 503, exhausted token buckets
+# 429, both with Retry-After. Rate limits are per user, or per client IP for
+# anonymous requests, and shared by the workers on a host through the
+# RATE_LIMIT_DB SQLite file (kept apart from the main database so refused
+# requests never queue for its write lock); NETRA_RATE_LIMITS=0 turns them off.
+INFERENCE_CONCURRENCY = int(os.environ.get('NETRA_INFERENCE_CONCURRENCY', os.cpu_count() or 1))
+INFERENCE_LANES = {
+    # max_queued: waiting requests; timeout: seconds to wait; max_active: slots the lane may hold
+    'clinical': {'max_queued': 32, 'timeout': 30},
+    'public': {'max_queued': 4, 'timeout': 5, 'max_active': max(1, INFERENCE_CONCURRENCY // 2)},
+}
+RATE_LIMITS = {
+    'clinical': {'rate': 2.0, 'burst': 20},  # tokens per second, bucket size
+    'public': {'rate': 0.2, 'burst': 5},
+} if os.environ.get('NETRA_RATE_LIMITS', '1').lower() in ('1', 'true', 'yes') else {}
+RATE_LIMIT_DB = os.environ.get('NETRA_RATE_LIMIT_DB', str(BASE_DIR / 'ratelimit.sqlite3'))
+# Proxies whose X-Forwarded-For is believed when identifying anonymous
+# clients; the default covers nginx on the same host.
+TRUSTED_PROXIES = os.environ.get('NETRA_TRUSTED_PROXIES', '127.0.0.1,::1').split(',')
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+# Upload validation before inference (api/image_validation.py). Files are
+# checked from their header alone and rejected with 413 above these limits;
+# images over INFERENCE_MAX_PIXELS are downscaled before prediction so each
+# request stays within INFERENCE_MEMORY_BUDGET bytes.
+IMAGE_ALLOWED_FORMATS = ['JPEG', 'PNG', 'TIFF', 'BMP', 'WEBP']
+IMAGE_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+IMAGE_MAX_PIXELS = 50_000_000
+INFERENCE_MAX_PIXELS = int(os.environ.get('NETRA_INFERENCE_MAX_PIXELS', 12_000_000))
+INFERENCE_MEMORY_BUDGET = int(os.environ.get('NETRA_INFERENCE_MEMORY_BUDGET_MB', 512)) * 1024 * 1024
+
+
+# Doctor worklists (api/worklist.py): a claimed scan that is neither completed
+# nor released within this many seconds goes back to the queue.
+WORKLIST_CLAIM_TIMEOUT = 30 * 60
+
+
+# Scan search (api/search.py): 'fts5' uses the SQLite full-text index created
+# by migration 0007, 'basic' plain icontains queries (any database), 'auto'
+# the index when present. A dotted path selects a custom SearchEngine.
+SEARCH_ENGINE = os.environ.get('NETRA_SEARCH_ENGINE', 'auto')
+
+
+# Logging: the api app logs one JSON object per line (see
+# api/structured_logging.py). Set NETRA_LOG_LEVEL=DEBUG together with
+# INFERENCE_DEBUG to also dump raw model outputs for every prediction.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'api.structured_logging.JSONFormatter'},
+    },
+    'handlers': {
+        'json_console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['json_console'],
+            'level': os.environ.get('NETRA_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+INFERENCE_DEBUG = os.environ.get('NETRA_INFERENCE_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+# Request profiling (api/middleware.py). Off by default; when enabled every
+# response gets a Server-Timing header and SAMPLE_RATE of requests are
+# profiled, keeping the slowest REQUEST_PROFILING_KEEP per endpoint for
+# /api/admin/profiles/. REQUEST_PROFILER may be 'cprofile' or 'pyinstrument'.
+REQUEST_PROFILING_ENABLED = os.environ.get('NETRA_REQUEST_PROFILING', '').lower() in ('1', 'true', 'yes')
+REQUEST_PROFILING_SAMPLE_RATE = float(os.environ.get('NETRA_REQUEST_PROFILING_SAMPLE_RATE', 0.0))
+REQUEST_PROFILING_KEEP = 10
+REQUEST_PROFILER = os.environ.get('NETRA_REQUEST_PROFILER', 'cprofile')
+
+# Prometheus scrapes /api/metrics/ directly from these addresses only;
+# requests relayed by a proxy on the same host are refused. When a token is
+# set the scraper must also send it as ``Authorization: Bearer <token>``.
+METRICS_ALLOWED_IPS = os.environ.get('NETRA_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+METRICS_TOKEN = os.environ.get('NETRA_METRICS_TOKEN', '')
+
+
+# Password hashing: Argon2id when argon2-cffi is installed (tune the costs
+# with `manage.py tune_argon2`), PBKDF2 otherwise. Older hashes keep working
+# and are upgraded on the user's next login.
+
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if find_spec('argon2') is not None:
+    PASSWORD_HASHERS.insert(0, 'api.hashers.TunedArgon2PasswordHasher')
+
+ARGON2_TIME_COST = int(os.environ.get('NETRA_ARGON2_TIME_COST', 2))
+ARGON2_MEMORY_COST = int(os.environ.get('NETRA_ARGON2_MEMORY_COST', 19456))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get('NETRA_ARGON2_PARALLELISM', 1))
+
+# Logins verify passwords on a bounded pool (see api/login_pool.py); 0 runs
+# them inline on the request thread.
+LOGIN_HASH_WORKERS = int(os.environ.get('NETRA_LOGIN_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+LOGIN_MAX_PENDING = 32
+LOGIN_QUEUE_TIMEOUT = 10  # seconds a login may wait for a worker
+LOGIN_RETRY_AFTER = 2  # seconds, sent as Retry-After when saturated
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -131,6 +369,39 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Preview renditions of scan images (longest side in pixels), see
+# api/image_derivatives.py. WebP falls back to JPEG if Pillow lacks support.
+SCAN_IMAGE_RENDITIONS = {
+    'thumbnail': 256,
+    'medium': 1024,
+}
+SCAN_IMAGE_DERIVATIVE_FORMAT = 'WEBP'
+SCAN_IMAGE_DERIVATIVE_QUALITY = 80
+
+# How scan image files are delivered by the scan-images/<id>/file/ endpoint:
+# 'django' serves them in-process (development), 'nginx' hands the transfer
+# off with X-Accel-Redirect to an internal location mapped to MEDIA_ROOT, and
+# 'apache'/'lighttpd' use X-Sendfile.
+MEDIA_SENDFILE_BACKEND = os.environ.get('NETRA_MEDIA_SENDFILE_BACKEND', 'django')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Lifetime in seconds of the signed ?u=&access= image URLs handed to clients
+# that cannot send an Authorization header (<img src>).
+MEDIA_ACCESS_MAX_AGE = int(os.environ.get('NETRA_MEDIA_ACCESS_MAX_AGE', 3600))
+
+# Orphaned scan image files (their scans were deleted) are removed by
+# `manage.py gc_media`, but only once unmodified for this many seconds, so an
+# upload whose database row is not yet committed is never collected.
+MEDIA_GC_GRACE_PERIOD = int(os.environ.get('NETRA_MEDIA_GC_GRACE_PERIOD', 24 * 3600))
+
+# Storage tiering (api/tiering.py): `manage.py tier_scan_images` moves
+# originals of scans older than TIERING_AFTER_DAYS to COLD_STORAGE_ROOT,
+# recompressed losslessly where possible. Viewing one restores it to
+# MEDIA_ROOT, where it then stays for TIERING_KEEP_REHYDRATED_DAYS.
+COLD_STORAGE_ROOT = os.environ.get('NETRA_COLD_STORAGE_ROOT', str(BASE_DIR / 'cold_media'))
+TIERING_AFTER_DAYS = int(os.environ.get('NETRA_TIERING_AFTER_DAYS', 365))
+TIERING_KEEP_REHYDRATED_DAYS = 30
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -142,7 +413,7 @@ AUTH_USER_MODEL = 'api.User'
 # REST Framework + JWT setup
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -159,3 +430,14 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Authenticated users are resolved from a per-process cache instead of a DB
+# query on every request (see api/authentication.py). Saving or deleting a
+# user invalidates the local entry; the TTL bounds staleness in other workers.
+JWT_USER_CACHE_TTL = 60  # seconds
+JWT_USER_CACHE_SIZE = 1024
+
+# Each doctor's set of subscribed patient ids is cached per process for the
+# subscription checks on scan endpoints (see api/subscriptions.py).
+SUBSCRIPTION_CACHE_TTL = 60  # seconds
+SUBSCRIPTION_CACHE_SIZE = 1024
+
@@ -0,0 +1,21 @@
+"""
+Inference settings profile: ``DJANGO_SETTINGS_MODULE=netra_backend.settings_inference``.
+
+Runs the model for web workers using ``settings_web``. The model is loaded and
+warmed when a worker starts. Every request arrives anonymously from a web
+worker that has already applied rate limits and admission lanes, so here
+rate limits are off and the public lane gets the full queue. Any NETRA_*
+variable set in the environment still wins over these defaults.
+"""
+import os
+
+os.environ.setdefault('NETRA_INFERENCE_BACKEND', 'torch')
+os.environ.setdefault('NETRA_MODEL_WARMUP_ON_STARTUP', '1')
+os.environ.setdefault('NETRA_RATE_LIMITS', '0')
+
+from .settings import *  # noqa: E402,F401,F403
+
+INFERENCE_LANES = {
+    'clinical': {'max_queued': 32, 'timeout': 30},
+    'public': {'max_queued': 32, 'timeout': 30},
+}
@@ -0,0 +1,16 @@
+"""
+Web-only settings profile: ``DJANGO_SETTINGS_MODULE=netra_backend.settings_web``.
+
+API workers in this profile predict through the ``remote`` backend, which
+POSTs images to an inference process running ``settings_inference``. They
+never import torch, timm or numpy, so workers and management commands
+start quickly and stay small. Warm-up sends no dummy batches, because the
+inference process warms its own model. Any NETRA_* variable set in the
+environment still wins over these defaults.
+"""
+import os
+
+os.environ.setdefault('NETRA_INFERENCE_BACKEND', 'remote')
+os.environ.setdefault('NETRA_MODEL_WARMUP_BATCHES', '0')
+
+from .settings import *  # noqa: E402,F401,F403
@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netra_backend.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.MODEL_WARMUP_ON_STARTUP:
+    # Load and warm the model off the import path so the worker answers
+    # liveness probes immediately and turns ready once warm.
+    from api.model_registry import warm_up_in_background  # noqa: E402
+
+    warm_up_in_background()
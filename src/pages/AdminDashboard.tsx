@@ -231,7 +231,7 @@ export default function AdminDashboard() {
                   {scan.images.length > 0 && (
                     <div className="mb-4 rounded-xl overflow-hidden">
                       <img
-                        src={scan.images[0].image_url}
+                        src={scan.images[0].thumbnail_url || scan.images[0].image_url}
                         alt="Retinal scan"
                         className="w-full h-48 object-cover"
                       />
@@ -218,7 +218,7 @@ export default function PatientDashboard() {
                 {scan.images.length > 0 && (
                   <div className="mb-4 rounded-xl overflow-hidden">
                     <img
-                      src={scan.images[0].image_url}
+                      src={scan.images[0].thumbnail_url || scan.images[0].image_url}
                       alt="Retinal scan"
                       className="w-full h-40 object-cover"
                     />
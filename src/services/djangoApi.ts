@@ -24,6 +24,7 @@ interface Scan {
   right_eye_prediction: string | null;
   right_eye_prediction_class: number | null;
   ai_details: any;
+  model_version: string | null;
   priority: string;
   status: string;
   patient_age?: number;
@@ -38,8 +39,11 @@ interface ScanImage {
   id: number;
   image: string;
   image_url: string;
+  thumbnail_url: string | null;
+  medium_url: string | null;
   image_filename: string;
   eye_side: string;
+  storage_tier: 'hot' | 'cold';
   created_at: string;
 }
 
@@ -59,6 +63,68 @@ interface Subscription {
   created_at: string;
 }
 
+interface PatientTimeline {
+  patient: number;
+  scan_count: number;
+  last_scan: number | null;
+  last_scan_at: string | null;
+  previous_scan_at: string | null;
+  days_since_last_scan: number | null;
+  days_between_last_scans: number | null;
+  left_grade: number | null;
+  left_grade_label: string | null;
+  left_grade_delta: number | null;
+  right_grade: number | null;
+  right_grade_label: string | null;
+  right_grade_delta: number | null;
+  progressed: boolean;
+  updated_at: string;
+}
+
+interface WorklistItem {
+  scan: number;
+  patient: { id: number; full_name: string; username: string };
+  priority: string;
+  grade: number;
+  grade_label: string | null;
+  state: string;
+  queued_at: string;
+  waiting_minutes: number;
+}
+
+interface ScanSearchResult {
+  id: number;
+  patient: { id: number; full_name: string; username: string };
+  priority: string;
+  status: string;
+  left_eye_prediction: string | null;
+  right_eye_prediction: string | null;
+  grade: number;
+  grade_label: string | null;
+  created_at: string;
+}
+
+interface ScanSearchResponse {
+  count: number;
+  results: ScanSearchResult[];
+  facets: {
+    priority: Record<string, number>;
+    status: Record<string, number>;
+    grade: Record<string, number>;
+  };
+}
+
+interface ScanSearchParams {
+  q?: string;
+  priority?: string;
+  status?: string;
+  grade?: number;
+  date_from?: string;
+  date_to?: string;
+  limit?: number;
+  offset?: number;
+}
+
 class DjangoAPI {
   private getAuthHeader(): HeadersInit {
     const token = localStorage.getItem('access_token');
@@ -236,6 +302,66 @@ class DjangoAPI {
     return data.data;
   }
 
+  async getWorklist(limit = 20): Promise<WorklistItem[]> {
+    const response = await fetch(`${API_URL}/doctor/worklist/?limit=${limit}`, {
+      headers: this.getAuthHeader(),
+    });
+
+    if (!response.ok) {
+      throw new Error('Failed to get worklist');
+    }
+
+    return response.json();
+  }
+
+  async claimNextScan(scanId?: number): Promise<Scan | null> {
+    const response = await fetch(`${API_URL}/doctor/worklist/claim/`, {
+      method: 'POST',
+      headers: this.getAuthHeader(),
+      body: JSON.stringify(scanId ? { scan_id: scanId } : {}),
+    });
+
+    if (response.status === 409) {
+      return null;
+    }
+    if (!response.ok) {
+      throw new Error('Failed to claim scan');
+    }
+
+    return response.json();
+  }
+
+  async completeWorklistScan(scanId: number, status: 'reviewed' | 'completed' = 'reviewed'): Promise<void> {
+    const response = await fetch(`${API_URL}/doctor/worklist/${scanId}/complete/`, {
+      method: 'POST',
+      headers: this.getAuthHeader(),
+      body: JSON.stringify({ status }),
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to complete scan');
+    }
+  }
+
+  async searchScans(params: ScanSearchParams = {}): Promise<ScanSearchResponse> {
+    const query = new URLSearchParams();
+    Object.entries(params).forEach(([key, value]) => {
+      if (value !== undefined && value !== '') query.append(key, String(value));
+    });
+
+    const response = await fetch(`${API_URL}/doctor/search/?${query.toString()}`, {
+      headers: this.getAuthHeader(),
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Failed to search scans');
+    }
+
+    return response.json();
+  }
+
   async getScanStats() {
     const response = await fetch(`${API_URL}/scan-stats/`, {
       headers: this.getAuthHeader(),
@@ -312,6 +438,18 @@ class DjangoAPI {
     return response.json();
   }
 
+  async getPatientTimeline(patientId: number): Promise<PatientTimeline> {
+    const response = await fetch(`${API_URL}/doctor/patients/${patientId}/timeline/`, {
+      headers: this.getAuthHeader(),
+    });
+
+    if (!response.ok) {
+      throw new Error('Failed to get patient timeline');
+    }
+
+    return response.json();
+  }
+
   async getAdminScans(): Promise<Scan[]> {
     const response = await fetch(`${API_URL}/admin/scans/`, {
       headers: this.getAuthHeader(),
@@ -355,4 +493,7 @@ class DjangoAPI {
 }
 
 export const djangoApi = new DjangoAPI();
-export type { User, Scan, ScanImage, DoctorNote, Subscription };
+export type {
+  User, Scan, ScanImage, DoctorNote, Subscription, PatientTimeline, WorklistItem,
+  ScanSearchResult, ScanSearchResponse, ScanSearchParams,
+};